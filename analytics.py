@@ -0,0 +1,149 @@
+# analytics.py
+# Read side of the analytics aggregates that db.py keeps current as users,
+# referrals and payouts are written: the referral_paths closure table,
+# per-referrer counts (referrer_stats) and per-day campaign totals
+# (daily_totals). /stats and /leaderboard read a fixed number of rows
+# whatever the user count; backfill() rebuilds everything once from the
+# users, referrals and payouts tables.
+
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, exists, func, insert, literal, select
+
+from config import ANALYTICS_MAX_DEPTH, LEADERBOARD_SIZE
+from db import engine, run_db, User, Referral, Payout, ReferralPath, ReferrerStats, DailyTotal
+
+logger = logging.getLogger("srd_airdrop_bot.analytics")
+
+METRICS = ("users", "referrals", "payouts_queued", "beam_queued", "payouts_confirmed", "beam_confirmed", "payouts_failed")
+
+
+# =========================== DB ops ===========================
+def _db_campaign(session, today: str) -> Dict[str, Dict[str, int]]:
+    totals = {"all": dict.fromkeys(METRICS, 0), "today": dict.fromkeys(METRICS, 0)}
+    rows = session.query(DailyTotal.day, DailyTotal.metric, DailyTotal.value).filter(DailyTotal.day.in_(("all", today)))
+    for day, metric, value in rows:
+        totals["all" if day == "all" else "today"][metric] = int(value or 0)
+    return totals
+
+
+def _db_leaderboard(session, by: str, limit: int) -> List[Tuple[int, Optional[str], int, int]]:
+    order = ReferrerStats.downline if by == "downline" else ReferrerStats.direct
+    rows = (
+        session.query(ReferrerStats.telegram_id, User.username, ReferrerStats.direct, ReferrerStats.downline)
+        .outerjoin(User, User.telegram_id == ReferrerStats.telegram_id)
+        .order_by(order.desc(), ReferrerStats.telegram_id.desc())
+        .limit(limit)
+    )
+    return [(tg, username, direct or 0, downline or 0) for tg, username, direct, downline in rows]
+
+
+def _db_referrer(session, tg_id: int) -> Tuple[Optional[str], int, int]:
+    """(username, direct, downline) for one user; zeros for a user who referred nobody."""
+    username = session.query(User.username).filter_by(telegram_id=tg_id).scalar()
+    row = session.get(ReferrerStats, tg_id)
+    return username, (row.direct or 0) if row else 0, (row.downline or 0) if row else 0
+
+
+# =========================== API ===========================
+async def campaign_stats() -> Dict[str, Dict[str, int]]:
+    """{"all": {metric: value}, "today": {metric: value}} (UTC day)."""
+    return await run_db(_db_campaign, datetime.utcnow().strftime("%Y-%m-%d"))
+
+
+async def leaderboard(by: str = "direct", limit: int = LEADERBOARD_SIZE):
+    """Top referrers by "direct" or "downline": [(telegram_id, username, direct, downline)]."""
+    return await run_db(_db_leaderboard, by, limit)
+
+
+async def referrer_stats(tg_id: int):
+    return await run_db(_db_referrer, tg_id)
+
+
+# =========================== Backfill ===========================
+def _day(value) -> Optional[str]:
+    # SQLite returns date() as text, PostgreSQL as a date
+    return str(value)[:10] if value is not None else None
+
+
+def backfill() -> dict:
+    """
+    Rebuild referral_paths, referrer_stats and daily_totals from users,
+    referrals and payouts. Run it with the bot stopped (writes made meanwhile would be
+    lost or counted twice), once after deploying and after
+    `manage.py reconcile-referrals` removes duplicates.
+    """
+    paths, prev = ReferralPath.__table__, ReferralPath.__table__.alias("prev")
+    stats = {"paths": 0, "referrers": 0, "daily_rows": 0}
+    with engine.begin() as conn:
+        for model in (ReferralPath, ReferrerStats, DailyTotal):
+            conn.execute(model.__table__.delete())
+
+        # closure table one level at a time: level d = level d-1 extended by one referral
+        stats["paths"] += conn.execute(
+            insert(paths).from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(Referral.referrer_id, Referral.referee_id, literal(1))
+                .where(Referral.referrer_id != Referral.referee_id),
+            )
+        ).rowcount
+        for depth in range(2, ANALYTICS_MAX_DEPTH + 1):
+            added = conn.execute(
+                insert(paths).from_select(
+                    ["ancestor_id", "descendant_id", "depth"],
+                    select(prev.c.ancestor_id, Referral.referee_id, literal(depth))
+                    .join(Referral, Referral.referrer_id == prev.c.descendant_id)
+                    .where(
+                        prev.c.depth == depth - 1,
+                        prev.c.ancestor_id != Referral.referee_id,
+                        ~exists().where(paths.c.ancestor_id == prev.c.ancestor_id,
+                                        paths.c.descendant_id == Referral.referee_id),
+                    ),
+                )
+            ).rowcount
+            stats["paths"] += added
+            if not added:
+                break
+
+        stats["referrers"] = conn.execute(
+            insert(ReferrerStats.__table__).from_select(
+                ["telegram_id", "direct", "downline"],
+                select(paths.c.ancestor_id, func.sum(case((paths.c.depth == 1, 1), else_=0)), func.count())
+                .group_by(paths.c.ancestor_id),
+            )
+        ).rowcount
+
+        totals: Counter = Counter()
+
+        def _add(day, **counts):
+            for metric, value in counts.items():
+                totals[("all", metric)] += int(value or 0)
+                if day is not None:
+                    totals[(_day(day), metric)] += int(value or 0)
+
+        day = func.date(User.created_at)
+        for d, n in conn.execute(select(day, func.count()).group_by(day)):
+            _add(d, users=n)
+        day = func.date(Referral.created_at)
+        for d, n in conn.execute(select(day, func.count()).group_by(day)):
+            _add(d, referrals=n)
+        # every payout row was queued (or planned) once, on the day it was created
+        day = func.date(Payout.created_at)
+        for d, n, tokens in conn.execute(select(day, func.count(), func.sum(Payout.amount)).group_by(day)):
+            _add(d, payouts_queued=n, beam_queued=tokens)
+        day = func.date(func.coalesce(Payout.updated_at, Payout.created_at))
+        for d, n, tokens in conn.execute(
+            select(day, func.count(), func.sum(Payout.amount)).where(Payout.status == "confirmed").group_by(day)
+        ):
+            _add(d, payouts_confirmed=n, beam_confirmed=tokens)
+        for d, n in conn.execute(select(day, func.count()).where(Payout.status == "failed").group_by(day)):
+            _add(d, payouts_failed=n)
+
+        rows = [{"day": d, "metric": m, "value": v} for (d, m), v in totals.items() if v]
+        if rows:
+            conn.execute(insert(DailyTotal.__table__), rows)
+        stats["daily_rows"] = len(rows)
+    return stats
@@ -0,0 +1,65 @@
+# bench/_http.py
+# Tiny keep-alive HTTP/1.1 server for the fake Bot API and fake BSC node,
+# run on its own event loop in a background thread so the stand-ins never
+# add lag to the bot's loop.
+
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Tuple
+
+# handler(method, path, headers, body) -> (status, content type, body)
+Handler = Callable[[str, str, Dict[str, str], bytes], Awaitable[Tuple[int, str, bytes]]]
+
+_REASONS = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+async def _serve_conn(handler: Handler, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, ctype, out = await handler(method, path, headers, body)
+            writer.write(
+                f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\nContent-Type: {ctype}\r\n"
+                f"Content-Length: {len(out)}\r\nConnection: keep-alive\r\n\r\n".encode() + out
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+class ServerThread(threading.Thread):
+    """Serve `handler` on 127.0.0.1:`port` from a daemon thread; .loop is that thread's event loop."""
+
+    def __init__(self, handler: Handler, port: int, name: str):
+        super().__init__(name=name, daemon=True)
+        self.handler = handler
+        self.port = port
+        self.loop = None
+        self._ready = threading.Event()
+
+    def run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        server = self.loop.run_until_complete(
+            asyncio.start_server(lambda r, w: _serve_conn(self.handler, r, w), "127.0.0.1", self.port)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+
+    def start_and_wait(self) -> int:
+        self.start()
+        self._ready.wait()
+        return self.port
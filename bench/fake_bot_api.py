@@ -0,0 +1,87 @@
+# bench/fake_bot_api.py
+# Stand-in for api.telegram.org: answers the methods the bot uses with
+# plausible objects after a configurable delay, injects 429/500 errors at a
+# configurable rate, and reports every message the bot sends to a chat so
+# the driver can time update -> reply.
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 777000, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# methods whose reply lands in a user's chat
+REPLY_METHODS = {"sendMessage", "editMessageText"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0,
+                 member_rate: float = 1.0, on_reply: Optional[Callable[[int, str, str], None]] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.member_rate = member_rate       # share of getChatMember answers that say "member"
+        self.on_reply = on_reply             # (chat_id, method, text), called on the server thread
+        self.calls: Dict[str, int] = {}
+        self.errors = 0
+        self._message_ids = itertools.count(1)
+
+    async def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        # /bot<token>/<method>
+        api_method = path.rsplit("/", 1)[-1]
+        params = _parse_params(headers.get("content-type", ""), body)
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            if random.random() < 0.5:
+                return _json(429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                   "parameters": {"retry_after": 1}})
+            return _json(500, {"ok": False, "error_code": 500, "description": "Internal Server Error"})
+
+        result = self._result(api_method, params)
+        if api_method in REPLY_METHODS and self.on_reply is not None:
+            self.on_reply(int(params.get("chat_id", 0)), api_method, params.get("text", ""))
+        return _json(200, {"ok": True, "result": result})
+
+    def _result(self, api_method: str, params: dict):
+        now = int(time.time())
+        if api_method == "getMe":
+            return {**BOT_USER, "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if api_method == "getChat":
+            chat = params.get("chat_id", "")
+            chat_id = int(chat) if str(chat).lstrip("-").isdigit() else -1000000000000 - abs(hash(chat)) % 10 ** 9
+            # a full ChatFullInfo: PTB requires accent_color_id and max_reaction_count
+            return {"id": chat_id, "type": "channel", "title": str(chat),
+                    "accent_color_id": 0, "max_reaction_count": 11}
+        if api_method == "getChatMember":
+            status = "member" if random.random() < self.member_rate else "left"
+            user_id = int(params.get("user_id", 0))
+            return {"status": status, "user": {"id": user_id, "is_bot": False, "first_name": "u"}}
+        if api_method in REPLY_METHODS:
+            chat_id = int(params.get("chat_id", 0))
+            return {"message_id": next(self._message_ids), "date": now,
+                    "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, "text": params.get("text", "")}
+        if api_method == "getUpdates":
+            return []
+        # answerCallbackQuery, deleteWebhook, setWebhook, ...
+        return True
+
+
+def _parse_params(content_type: str, body: bytes) -> dict:
+    if not body:
+        return {}
+    if "json" in content_type:
+        return json.loads(body)
+    # PTB posts form fields; nested values are JSON-encoded strings
+    return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+
+def _json(status: int, payload: dict):
+    return status, "application/json", json.dumps(payload).encode()
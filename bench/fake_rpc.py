@@ -0,0 +1,193 @@
+# bench/fake_rpc.py
+# Stand-in for a BSC node: enough JSON-RPC for the payout path (chain id,
+# nonce, fees, gas estimate, eth_call reads, raw transaction broadcast and
+# receipts). Transactions are mined into the next block, produced every
+# `block_time` seconds; a share can be made to revert. Latency and error
+# rate are configurable. Batches are supported.
+
+import asyncio
+import json
+import random
+from typing import Dict, List
+
+import rlp
+from eth_abi import decode
+from eth_utils import keccak
+
+GWEI = 10 ** 9
+
+DECIMALS_SELECTOR = "0x313ce567"
+BALANCE_OF_SELECTOR = "0x70a08231"
+ALLOWANCE_SELECTOR = "0xdd62ed3e"
+APPROVE_SELECTOR = "0x095ea7b3"
+DISPERSE_SELECTOR = "0x" + keccak(text="disperseToken(address,address[],uint256[])")[:4].hex()
+
+# estimateGas answers: a transfer, and disperseToken as overhead + one transferFrom per recipient
+TRANSFER_GAS = 52000
+DISPERSE_BASE_GAS = 25000
+DISPERSE_GAS_PER_RECIPIENT = 30000
+
+
+def _word(n: int) -> str:
+    return "0x" + format(n, "064x")
+
+
+class FakeRPC:
+    def __init__(self, chain_id: int, latency: float = 0.03, jitter: float = 0.01, error_rate: float = 0.0,
+                 block_time: float = 0.5, revert_rate: float = 0.0, allowance: int = 2 ** 256 - 1):
+        self.chain_id = chain_id
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.block_time = block_time
+        self.revert_rate = revert_rate
+        self.allowance = allowance
+        self.head = 1
+        self.next_nonce = 0
+        self.calls: Dict[str, int] = {}
+        self.errors = 0
+        self.sent = 0
+        self.txs: Dict[str, dict] = {}               # accepted tx hash -> {nonce, gas, to, data}
+        self._pending: List[str] = []
+        self._blocks: Dict[int, List[str]] = {1: []}
+        self._receipts: Dict[str, dict] = {}
+        self._mempool: set = set()
+        self._miner = None
+
+    async def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        if self._miner is None:
+            self._miner = asyncio.get_running_loop().create_task(self._mine())
+        payload = json.loads(body)
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return 503, "text/plain", b"upstream unavailable"
+        if isinstance(payload, list):
+            out = [self._dispatch(call) for call in payload]
+        else:
+            out = self._dispatch(payload)
+        return 200, "application/json", json.dumps(out).encode()
+
+    async def _mine(self) -> None:
+        while True:
+            await asyncio.sleep(self.block_time)
+            self.head += 1
+            hashes, self._pending = self._pending, []
+            self._blocks[self.head] = hashes
+            for i, h in enumerate(hashes):
+                self._mempool.discard(h)
+                self._receipts[h] = self._receipt(h, self.head, i, self._execute(self.txs[h]["data"]))
+
+    def _disperse_total(self, data: str) -> int:
+        _, _, values = decode(["address", "address[]", "uint256[]"], bytes.fromhex(data[10:]))
+        return sum(values)
+
+    def _execute(self, data: str) -> bool:
+        """Apply a mined tx's effect on the allowance; False if it reverts."""
+        if data.startswith(APPROVE_SELECTOR):
+            self.allowance = int(data[74:138], 16)
+        elif data.startswith(DISPERSE_SELECTOR):
+            total = self._disperse_total(data)
+            if total > self.allowance:
+                return False
+            self.allowance -= total if self.allowance < 2 ** 256 - 1 else 0
+        return random.random() >= self.revert_rate
+
+    def _receipt(self, tx_hash: str, number: int, index: int, ok: bool = True) -> dict:
+        return {
+            "transactionHash": tx_hash,
+            "transactionIndex": hex(index),
+            "blockHash": _word(number),
+            "blockNumber": hex(number),
+            "from": "0x" + "00" * 20,
+            "to": "0x" + "00" * 20,
+            "cumulativeGasUsed": hex(52000 * (index + 1)),
+            "gasUsed": hex(52000),
+            "effectiveGasPrice": hex(3 * GWEI),
+            "contractAddress": None,
+            "logs": [],
+            "logsBloom": "0x" + "00" * 256,
+            "type": "0x2",
+            "status": "0x1" if ok else "0x0",
+        }
+
+    def _dispatch(self, call: dict) -> dict:
+        method, params = call.get("method"), call.get("params") or []
+        self.calls[method] = self.calls.get(method, 0) + 1
+        try:
+            result = self._result(method, params)
+        except KeyError:
+            return {"jsonrpc": "2.0", "id": call.get("id"), "error": {"code": -32601, "message": f"{method} not supported"}}
+        except ValueError as e:
+            return {"jsonrpc": "2.0", "id": call.get("id"), "error": {"code": -32000, "message": str(e)}}
+        return {"jsonrpc": "2.0", "id": call.get("id"), "result": result}
+
+    def _result(self, method: str, params: list):
+        if method == "eth_chainId":
+            return hex(self.chain_id)
+        if method == "eth_blockNumber":
+            return hex(self.head)
+        if method == "eth_gasPrice":
+            return hex(3 * GWEI)
+        if method == "eth_feeHistory":
+            n = int(params[0], 16) if isinstance(params[0], str) else int(params[0])
+            return {"oldestBlock": hex(max(1, self.head - n + 1)), "baseFeePerGas": [hex(GWEI)] * (n + 1),
+                    "gasUsedRatio": [0.5] * n, "reward": [[hex(GWEI)]] * n}
+        if method == "eth_estimateGas":
+            data = params[0].get("data") or params[0].get("input") or ""
+            if data.startswith(DISPERSE_SELECTOR):
+                if self._disperse_total(data) > self.allowance:
+                    raise ValueError("execution reverted: insufficient allowance")
+                n = len(decode(["address", "address[]", "uint256[]"], bytes.fromhex(data[10:]))[1])
+                return hex(DISPERSE_BASE_GAS + DISPERSE_GAS_PER_RECIPIENT * n)
+            return hex(TRANSFER_GAS)
+        if method == "eth_getTransactionCount":
+            return hex(self.next_nonce)
+        if method == "eth_getCode":
+            return "0x"                                # no Multicall3: balances_of falls back to batches
+        if method == "eth_getBalance":
+            return hex(10 ** 18)
+        if method == "eth_call":
+            data = params[0].get("data") or params[0].get("input") or ""
+            if data.startswith(DECIMALS_SELECTOR):
+                return _word(18)
+            if data.startswith(BALANCE_OF_SELECTOR):
+                return _word(10 ** 30)
+            if data.startswith(ALLOWANCE_SELECTOR):
+                return _word(self.allowance)
+            return _word(0)
+        if method == "eth_sendRawTransaction":
+            return self._accept(params[0])
+        if method == "eth_getTransactionReceipt":
+            return self._receipts.get(params[0].lower())
+        if method == "eth_getBlockReceipts":
+            number = int(params[0], 16)
+            return [self._receipts[h] for h in self._blocks.get(number, [])]
+        if method == "eth_getBlockByNumber":
+            number = self.head if params[0] in ("latest", "pending") else int(params[0], 16)
+            if number not in self._blocks:
+                return None
+            return {"number": hex(number), "hash": _word(number), "parentHash": _word(number - 1),
+                    "timestamp": hex(number), "baseFeePerGas": hex(GWEI), "gasLimit": hex(140_000_000),
+                    "gasUsed": hex(52000 * len(self._blocks[number])), "transactions": self._blocks[number]}
+        raise KeyError(method)
+
+    def _accept(self, raw_hex: str) -> str:
+        raw = bytes.fromhex(raw_hex[2:] if raw_hex.startswith("0x") else raw_hex)
+        tx_hash = "0x" + keccak(raw).hex()
+        if tx_hash in self._receipts or tx_hash in self._mempool:
+            raise ValueError("already known")
+        # typed transactions are type byte || rlp([chain_id, nonce, ...]); legacy is rlp([nonce, ...])
+        fields = rlp.decode(raw[1:]) if raw[0] < 0xc0 else rlp.decode(raw)
+        if raw[0] < 0xc0:
+            nonce, gas, to, data = fields[1], fields[4], fields[5], fields[7]
+        else:
+            nonce, gas, to, data = fields[0], fields[2], fields[3], fields[5]
+        nonce = int.from_bytes(nonce, "big")
+        self.txs[tx_hash] = {"nonce": nonce, "gas": int.from_bytes(gas, "big"), "to": "0x" + to.hex(),
+                             "data": "0x" + data.hex()}
+        self.next_nonce = max(self.next_nonce, nonce + 1)
+        self._mempool.add(tx_hash)
+        self._pending.append(tx_hash)
+        self.sent += 1
+        return tx_hash
@@ -0,0 +1,512 @@
+# bench/run.py
+# Load test / benchmark. Starts a fake Bot API (fake_bot_api.py) and a fake
+# BSC node (fake_rpc.py), points the bot at them and drives synthetic users
+# through the real handlers:
+#
+#   start     /start ref_<id> in waves (user i is referred by user (i-1)//3,
+#             so about a third of the users end up with 3 referrals)
+#   verify    each user taps "Verify" --storm times at once
+#   address   "Submit BSC address", then a fresh address as text
+#   withdraw  /withdraw (queues a payout for users with 3 referrals)
+#
+# then waits for the queued payouts to be mined. Users are closed-loop: each
+# sends its next update once the previous one was answered (plus --think).
+#
+#   python bench/run.py --users 2000 --json before.json
+#   python bench/run.py --mode webhook --workers 4 --users 2000
+#   python bench/run.py --disperse --users 2000      # batched payouts
+#   python bench/run.py --compare before.json after.json
+#
+# inproc runs the Application in this process (updates go straight onto its
+# update queue); webhook runs `python bot.py` with BOT_MODE=webhook and
+# posts the updates to its ingress. Reported: updates/sec and p50/p99 reply
+# latency per phase, event-loop lag, DB commits/sec and payouts/sec. The
+# rate limiter is part of what is measured; --tg-rate/--tg-chat-rate default
+# high so it doesn't hide everything else.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _http import ServerThread      # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from fake_rpc import FakeRPC         # noqa: E402
+
+USER_ID_BASE = 10_000_000
+BENCH_KEY = "0x" + "11" * 32                 # throwaway signer; the fake node accepts anything
+BENCH_TOKEN = "123456:BENCH"
+CHAIN_ID = 31337
+BENCH_DISPERSE = "0x" + "00" * 18 + "d15e"   # any address: the fake node accepts disperseToken txs
+
+PAYOUT_SENT = "✅ Sent"
+PAYOUT_FAILED = "⚠️ Transfer failed"
+QUEUED_MARKERS = ("queued for payout", "queued.\n")
+NOT_AWAITING = "Use /start"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pct(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def _parse_metrics(text: str) -> Dict[str, float]:
+    out = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            out[name] = float(value)
+    return out
+
+
+def _git_rev() -> str:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout
+        return rev.strip() + ("+dirty" if dirty.strip() else "")
+    except OSError:
+        return "unknown"
+
+
+# =========================== Updates ===========================
+_update_ids = itertools.count(1)
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}", "username": f"u{uid}"}
+
+
+def message_update(uid: int, text: str) -> dict:
+    n = next(_update_ids)
+    msg = {"message_id": n, "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+           "from": _user(uid), "text": text}
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": n, "message": msg}
+
+
+def callback_update(uid: int, data: str) -> dict:
+    n = next(_update_ids)
+    menu = {"message_id": 1, "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+            "from": {"id": 777000, "is_bot": True, "first_name": "Bench"}, "text": "menu"}
+    return {"update_id": n, "callback_query": {"id": f"cq{n}", "from": _user(uid), "chat_instance": str(uid),
+                                               "data": data, "message": menu}}
+
+
+# =========================== Driver ===========================
+class Driver:
+    """Sends updates, matches the bot's replies to the user that is waiting for one, records latencies."""
+
+    def __init__(self, send: Callable, timeout: float, think: float):
+        self.send = send
+        self.timeout = timeout
+        self.think = think
+        self.loop = asyncio.get_running_loop()
+        self.waiters: Dict[int, deque] = defaultdict(deque)
+        self.phases: Dict[str, dict] = {}
+        self.queued = 0
+        self.payouts = {"sent": 0, "failed": 0, "first": None, "last": None}
+
+    # called on the fake Bot API's thread
+    def on_reply(self, chat_id: int, method: str, text: str) -> None:
+        self.loop.call_soon_threadsafe(self._reply, chat_id, text)
+
+    def _reply(self, chat_id: int, text: str) -> None:
+        if text.startswith(PAYOUT_SENT) or text.startswith(PAYOUT_FAILED):
+            self.payouts["sent" if text.startswith(PAYOUT_SENT) else "failed"] += 1
+            self.payouts["last"] = time.perf_counter()
+            return
+        if any(m in text for m in QUEUED_MARKERS):
+            self.queued += 1
+            if self.payouts["first"] is None:
+                self.payouts["first"] = time.perf_counter()
+        waiting = self.waiters.get(chat_id)
+        while waiting:
+            fut = waiting.popleft()
+            if not fut.done():
+                fut.set_result(text)
+                return
+
+    async def request(self, phase: dict, updates: List[dict]) -> List[Optional[str]]:
+        """Send `updates` for one user at once and wait for a reply to each."""
+        uid = (updates[0].get("message") or updates[0]["callback_query"])["from"]["id"]
+        futs = [self.loop.create_future() for _ in updates]
+        self.waiters[uid].extend(futs)
+        t = time.perf_counter()
+        await asyncio.gather(*(self.send(u) for u in updates))
+        replies = []
+        for fut in futs:
+            try:
+                replies.append(await asyncio.wait_for(fut, self.timeout))
+                phase["latencies"].append(time.perf_counter() - t)
+            except asyncio.TimeoutError:
+                phase["timeouts"] += 1
+                replies.append(None)
+        phase["updates"] += len(updates)
+        if self.think:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.think)
+        return replies
+
+    async def phase(self, name: str, users: List[int], step, concurrency: int) -> None:
+        phase = self.phases.setdefault(name, {"updates": 0, "timeouts": 0, "misses": 0, "latencies": [], "seconds": 0.0})
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(uid):
+            async with sem:
+                await step(phase, uid)
+
+        t = time.perf_counter()
+        await asyncio.gather(*(one(uid) for uid in users))
+        phase["seconds"] += time.perf_counter() - t
+
+    async def drain_payouts(self, timeout: float) -> float:
+        t = time.perf_counter()
+        while self.payouts["sent"] + self.payouts["failed"] < self.queued and time.perf_counter() - t < timeout:
+            await asyncio.sleep(0.1)
+        return time.perf_counter() - t
+
+
+def _waves(n: int) -> List[List[int]]:
+    """User indexes by depth in the referral tree (parent of i is (i-1)//3)."""
+    waves, lo = [], 0
+    size = 1
+    while lo < n:
+        waves.append(list(range(lo, min(n, lo + size))))
+        lo += size
+        size *= 3
+    return waves
+
+
+async def drive(driver: Driver, args) -> dict:
+    uids = [USER_ID_BASE + i for i in range(args.users)]
+
+    # one user first so startup (getMe, channel resolution, worker spawn) isn't timed
+    await driver.request({"updates": 0, "timeouts": 0, "latencies": []}, [message_update(USER_ID_BASE - 1, "/start")])
+
+    async def start(phase, uid):
+        i = uid - USER_ID_BASE
+        text = "/start" if i == 0 else f"/start ref_{USER_ID_BASE + (i - 1) // 3}"
+        await driver.request(phase, [message_update(uid, text)])
+
+    async def verify(phase, uid):
+        await driver.request(phase, [callback_update(uid, "verify") for _ in range(args.storm)])
+
+    async def address(phase, uid):
+        await driver.request(phase, [callback_update(uid, "submit_addr")])
+        reply, = await driver.request(phase, [message_update(uid, "0x" + os.urandom(20).hex())])
+        if reply is not None and reply.startswith(NOT_AWAITING):
+            phase["misses"] += 1
+
+    async def withdraw(phase, uid):
+        await driver.request(phase, [message_update(uid, "/withdraw")])
+
+    steps = {"start": start, "verify": verify, "address": address, "withdraw": withdraw}
+    t = time.perf_counter()
+    for name in args.phases:
+        if name == "start":
+            for wave in _waves(args.users):
+                await driver.phase(name, [uids[i] for i in wave], start, args.concurrency)
+        else:
+            await driver.phase(name, uids, steps[name], args.concurrency)
+    traffic_seconds = time.perf_counter() - t
+    drain_seconds = await driver.drain_payouts(args.drain)
+    return {"traffic_seconds": traffic_seconds, "drain_seconds": drain_seconds}
+
+
+async def _watch_lag(samples: List[float], interval: float = 0.05) -> None:
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - t - interval))
+
+
+# =========================== Modes ===========================
+def bench_env(args, tg_port: int, rpc_port: int, workdir: str) -> Dict[str, str]:
+    env = {
+        "BOT_TOKEN": BENCH_TOKEN,
+        "BOT_API_BASE_URL": f"http://127.0.0.1:{tg_port}",
+        "BSC_RPC": f"http://127.0.0.1:{rpc_port}",
+        "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "ADMIN_PRIVATE_KEY": BENCH_KEY,
+        "BEAM_CONTRACT": "0x" + "00" * 18 + "beef",
+        "DISPERSE_CONTRACT": BENCH_DISPERSE if args.disperse else "",
+        "CHAIN_ID": str(CHAIN_ID),
+        "REQUIRED_CHANNELS": "bench_a,bench_b",
+        "ADMIN_IDS": "",
+        "TG_GLOBAL_RATE": str(args.tg_rate),
+        "TG_CHAT_RATE": str(args.tg_chat_rate),
+        "RECEIPT_POLL_INTERVAL": str(min(0.5, args.block_time / 2)),
+        "METRICS_PORT": "0",
+    }
+    if args.mode == "webhook":
+        env.update({
+            "BOT_MODE": "webhook",
+            "WEBHOOK_URL": "",
+            "WEBHOOK_LISTEN": "127.0.0.1",
+            "PORT": str(_free_port()),
+            "WEBHOOK_WORKERS": str(args.workers),
+            "METRICS_PORT": str(_free_port()),
+        })
+    else:
+        env["BOT_MODE"] = "polling"
+    return env
+
+
+async def run_inproc(args, env: Dict[str, str], api: FakeBotAPI) -> dict:
+    os.environ.update(env)
+    import logging
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    # imported only now: config reads the environment at import time
+    from telegram import Update
+    import bot
+    import db
+    import metrics
+
+    db.init_db()
+    app = bot.build_application()
+    async with app:
+        await app.post_init(app)
+        await app.start()
+
+        async def send(update: dict) -> None:
+            await app.update_queue.put(Update.de_json(update, app.bot))
+
+        driver = Driver(send, args.timeout, args.think)
+        api.on_reply = driver.on_reply
+        lag: List[float] = []
+        watcher = asyncio.create_task(_watch_lag(lag))
+        before = _parse_metrics(metrics.render())
+        result = await drive(driver, args)
+        after = _parse_metrics(metrics.render())
+        watcher.cancel()
+
+        await app.stop()
+    await app.post_shutdown(app)
+    result.update(_summary(driver, before, after, result))
+    result["loop_lag_ms"] = {"p99": _ms(_pct(lag, 99)), "max": _ms(max(lag, default=0.0))}
+    return result
+
+
+async def run_webhook(args, env: Dict[str, str], api: FakeBotAPI, workdir: str) -> dict:
+    import httpx
+
+    port, metrics_port = int(env["PORT"]), int(env["METRICS_PORT"])
+    log_path = os.path.join(workdir, "bot.log")
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen([sys.executable, "bot.py"], cwd=ROOT, env={**os.environ, **env},
+                                stdout=log, stderr=subprocess.STDOUT)
+    try:
+        async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrency)) as client:
+            await _wait_healthy(client, f"http://127.0.0.1:{port}/healthz", proc)
+
+            async def send(update: dict) -> None:
+                while True:
+                    resp = await client.post(f"http://127.0.0.1:{port}/telegram", json=update)
+                    if resp.status_code != 503:     # ingress queue full: back off like Telegram does
+                        return
+                    await asyncio.sleep(0.05)
+
+            async def scrape() -> Dict[str, float]:
+                total: Dict[str, float] = defaultdict(float)
+                for i in range(args.workers):
+                    try:
+                        text = (await client.get(f"http://127.0.0.1:{metrics_port + i}/metrics")).text
+                    except httpx.HTTPError:
+                        continue
+                    for k, v in _parse_metrics(text).items():
+                        total[k] = max(total[k], v) if k.startswith("event_loop_lag") else total[k] + v
+                return total
+
+            driver = Driver(send, args.timeout, args.think)
+            api.on_reply = driver.on_reply
+            before = await scrape()
+            result = await drive(driver, args)
+            after = await scrape()
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    result.update(_summary(driver, before, after, result))
+    result["loop_lag_ms"] = {"p99": None, "max": _ms(after.get("event_loop_lag_max_seconds"))}
+    result["bot_log"] = log_path
+    return result
+
+
+async def _wait_healthy(client, url: str, proc, timeout: float = 60.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"bot exited with {proc.returncode}; see its log")
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit("webhook ingress did not come up")
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def _summary(driver: Driver, before: Dict[str, float], after: Dict[str, float], timing: dict) -> dict:
+    phases = {}
+    for name, p in driver.phases.items():
+        phases[name] = {
+            "updates": p["updates"],
+            "updates_per_sec": round(p["updates"] / p["seconds"], 1) if p["seconds"] else None,
+            "p50_ms": _ms(_pct(p["latencies"], 50)),
+            "p99_ms": _ms(_pct(p["latencies"], 99)),
+            "timeouts": p["timeouts"],
+            "misses": p["misses"],
+        }
+    updates = sum(p["updates"] for p in driver.phases.values())
+    latencies = [x for p in driver.phases.values() for x in p["latencies"]]
+    seconds = timing["traffic_seconds"]
+    commits = after.get("db_commits_total", 0) - before.get("db_commits_total", 0)
+    po = driver.payouts
+    payout_window = (po["last"] - po["first"]) if po["first"] and po["last"] else None
+    return {
+        "phases": phases,
+        "total": {
+            "updates": updates,
+            "updates_per_sec": round(updates / seconds, 1) if seconds else None,
+            "p50_ms": _ms(_pct(latencies, 50)),
+            "p99_ms": _ms(_pct(latencies, 99)),
+        },
+        "db": {"commits": int(commits), "commits_per_sec": round(commits / seconds, 1) if seconds else None},
+        "payouts": {
+            "queued": driver.queued,
+            "sent": po["sent"],
+            "failed": po["failed"],
+            "per_sec": round(po["sent"] / payout_window, 2) if payout_window else None,
+        },
+    }
+
+
+# =========================== Report ===========================
+ROWS = [
+    ("updates/sec", ("total", "updates_per_sec")),
+    ("p50 ms", ("total", "p50_ms")),
+    ("p99 ms", ("total", "p99_ms")),
+    ("loop lag p99 ms", ("loop_lag_ms", "p99")),
+    ("loop lag max ms", ("loop_lag_ms", "max")),
+    ("db commits/sec", ("db", "commits_per_sec")),
+    ("payouts/sec", ("payouts", "per_sec")),
+    ("payouts sent", ("payouts", "sent")),
+]
+
+
+def print_report(result: dict) -> None:
+    batch = "  disperse" if result["args"].get("disperse") else ""
+    print(f"\n{result['rev']}  mode={result['args']['mode']}{batch}  users={result['args']['users']}  "
+          f"traffic {result['traffic_seconds']:.1f}s  payout drain {result['drain_seconds']:.1f}s")
+    print(f"{'phase':<10}{'updates':>9}{'upd/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'timeouts':>10}{'misses':>8}")
+    for name, p in result["phases"].items():
+        print(f"{name:<10}{p['updates']:>9}{_cell(p['updates_per_sec']):>9}{_cell(p['p50_ms']):>9}"
+              f"{_cell(p['p99_ms']):>9}{p['timeouts']:>10}{p['misses']:>8}")
+    for label, (section, key) in ROWS:
+        print(f"{label:<20}{_cell(result[section][key]):>12}")
+
+
+def print_compare(a: dict, b: dict) -> None:
+    print(f"{'':<20}{a['rev']:>14}{b['rev']:>14}{'change':>10}")
+    for label, (section, key) in ROWS:
+        x, y = a[section][key], b[section][key]
+        change = f"{(y - x) / x * 100:+.1f}%" if x and y is not None else "-"
+        print(f"{label:<20}{_cell(x):>14}{_cell(y):>14}{change:>10}")
+
+
+def _cell(v) -> str:
+    return "-" if v is None else str(v)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark the bot against a fake Bot API and a fake BSC node.")
+    ap.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two --json results and exit")
+    ap.add_argument("--mode", choices=("inproc", "webhook"), default="inproc")
+    ap.add_argument("--workers", type=int, default=2, help="webhook workers (webhook mode)")
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--concurrency", type=int, default=200, help="users active at once")
+    ap.add_argument("--phases", default="start,verify,address,withdraw")
+    ap.add_argument("--storm", type=int, default=3, help="simultaneous Verify taps per user")
+    ap.add_argument("--think", type=float, default=0.05, help="mean pause between a user's steps, seconds")
+    ap.add_argument("--timeout", type=float, default=30.0, help="reply timeout, seconds")
+    ap.add_argument("--drain", type=float, default=120.0, help="max wait for queued payouts, seconds")
+    ap.add_argument("--tg-latency", type=float, default=0.05)
+    ap.add_argument("--tg-errors", type=float, default=0.0, help="share of Bot API calls failing with 429/500")
+    ap.add_argument("--member-rate", type=float, default=1.0, help="share of getChatMember answers saying 'member'")
+    ap.add_argument("--tg-rate", type=float, default=1000.0, help="TG_GLOBAL_RATE for the bot")
+    ap.add_argument("--tg-chat-rate", type=float, default=100.0, help="TG_CHAT_RATE for the bot")
+    ap.add_argument("--rpc-latency", type=float, default=0.03)
+    ap.add_argument("--rpc-errors", type=float, default=0.0, help="share of RPC requests failing with 503")
+    ap.add_argument("--revert-rate", type=float, default=0.0)
+    ap.add_argument("--block-time", type=float, default=0.5)
+    ap.add_argument("--disperse", action="store_true", help="batch payouts through a (fake) disperse contract")
+    ap.add_argument("--database-url", default="", help="default: a fresh SQLite file")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="also write the result here")
+    args = ap.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            print_compare(json.load(f), json.load(g))
+        return
+
+    args.phases = [p.strip() for p in args.phases.split(",") if p.strip()]
+    random.seed(args.seed)
+
+    api = FakeBotAPI(args.tg_latency, error_rate=args.tg_errors, member_rate=args.member_rate)
+    rpc = FakeRPC(CHAIN_ID, args.rpc_latency, error_rate=args.rpc_errors, block_time=args.block_time,
+                  revert_rate=args.revert_rate)
+    tg_port = ServerThread(api.handle, 0, "fake-bot-api").start_and_wait()
+    rpc_port = ServerThread(rpc.handle, 0, "fake-rpc").start_and_wait()
+
+    workdir = tempfile.mkdtemp(prefix="srd-bench-")
+    env = bench_env(args, tg_port, rpc_port, workdir)
+    if args.mode == "webhook":
+        result = asyncio.run(run_webhook(args, env, api, workdir))
+    else:
+        result = asyncio.run(run_inproc(args, env, api))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result["rev"] = _git_rev()
+    result["args"] = vars(args)
+    result["bot_api_calls"] = dict(api.calls)
+    result["rpc_calls"] = dict(rpc.calls)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
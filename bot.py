@@ -2,21 +2,27 @@
 # python-telegram-bot v20.x async bot
 
 import asyncio
+import functools
+import html
 import logging
-from typing import Optional, Union
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+_BOOT = time.perf_counter()   # taken before the heavy imports below
 
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
-from telegram.constants import ChatMemberStatus, ParseMode
+from telegram.constants import ParseMode
 from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     ContextTypes,
     filters,
 )
@@ -28,9 +34,27 @@ from config import (
     WELCOME_REWARD_BEAM,
     REFERRAL_REWARD_BEAM,
     REFERRALS_PER_WITHDRAWAL,
+    SINGLE_FLIGHT_DEBOUNCE,
+    TG_GLOBAL_RATE,
+    TG_LOOKUP_RATE,
+    BOT_MODE,
+    BOT_API_BASE_URL,
+    ALLOWED_UPDATES,
+    ADMIN_IDS,
+    METRICS_PORT,
+    ANALYTICS_MAX_DEPTH,
 )
-from db import init_db, SessionLocal, User, Referral, Payout
-from web3_utils import is_address, checksum, send_tokens
+from db import init_db, run_db, write_behind, credit_referral, User
+from web3_utils import is_address, checksum, warm_up as warm_up_web3, rpc_stats
+from payouts import payout_queue, queue_payout
+from membership import MembershipVerifier
+from user_cache import user_cache, ensure_user, UserRecord
+from rewards import welcome_ledger, USER_ALREADY_CLAIMED, ADDRESS_ALREADY_CLAIMED
+from ratelimit import TelegramRateLimiter
+from persistence import SQLPersistence
+import metrics
+from broadcast import create_broadcast, run_broadcast, unfinished_broadcasts, mark_active
+from analytics import campaign_stats, leaderboard, referrer_stats
 
 
 # =========================== Logging ===========================
@@ -40,6 +64,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger("srd_airdrop_bot")
 
+verifier = MembershipVerifier(REQUIRED_CHANNELS)
+_first_update_seen = False
+
 
 # =========================== UI TEXT ===========================
 WELCOME_TEXT = (
@@ -70,59 +97,57 @@ def _dm_only(update: Update) -> bool:
     return bool(update.effective_chat and update.effective_chat.type == "private")
 
 
-async def _ensure_user(session, tg_id: int, username: Optional[str]) -> User:
-    user = session.query(User).filter_by(telegram_id=tg_id).one_or_none()
-    if not user:
-        user = User(telegram_id=tg_id, username=username or "")
-        session.add(user)
-        session.commit()
-    return user
-
-
-async def _is_member_of(
-    context: ContextTypes.DEFAULT_TYPE,
-    channel: Union[int, str],
-    user_id: int
-) -> bool:
+class SingleFlight:
     """
-    Accepts either @username (str) or a numeric chat_id (int or '-100…' str).
-    Returns True if user is NOT 'left' or 'kicked'.
+    Coalesces identical in-flight operations: concurrent calls with the same
+    key share one execution and its result, and calls within `debounce`
+    seconds after it finished get that result without running again.
     """
-    # Resolve chat
-    if isinstance(channel, int):
-        chat_id = channel
-        chat = await context.bot.get_chat(chat_id)
-    else:
-        raw = str(channel).strip()
-        if raw.startswith("-100") and raw[4:].isdigit():
-            chat_id = int(raw)
-            chat = await context.bot.get_chat(chat_id)
+
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._recent: Dict[Hashable, Any] = {}
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if key in self._recent:
+            return self._recent[key]
+        fut = self._inflight.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()   # retrieved: followers re-raise it, nobody else needs to
+            raise
         else:
-            uname = raw.lstrip("@")
-            chat = await context.bot.get_chat(f"@{uname}")
+            fut.set_result(result)
+            self._recent[key] = result
+            asyncio.get_running_loop().call_later(self.debounce, self._recent.pop, key, None)
+            return result
+        finally:
+            del self._inflight[key]
 
-    member = await context.bot.get_chat_member(chat.id, user_id)
-    status = str(member.status).lower()
-    is_joined = status not in {"left", "kicked"}
 
-    # debug line
-    logger.info("verify %s -> status=%s => %s", chat.id, member.status, "OK" if is_joined else "NO")
-    return is_joined
+metrics.dict_collector("user_cache", user_cache.stats, "User record LRU")
+metrics.rows_collector("rpc_endpoint", rpc_stats, "url", "Per-endpoint RPC pool stats")
+
+# per-user verify / withdraw / address-submit coalescing
+single_flight = SingleFlight(SINGLE_FLIGHT_DEBOUNCE)
 
 
 async def _verify_all_required(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
     """Return True only if ALL required channels pass."""
-    all_ok = True
-    for ch in REQUIRED_CHANNELS:
-        try:
-            ok = await _is_member_of(context, ch, user_id)
-            if not ok:
-                all_ok = False
-        except Exception as e:
-            logger.warning("verify failed for %s: %s", ch, e)
-            all_ok = False
-        await asyncio.sleep(0.2)  # be gentle with API
-    return all_ok
+    return await single_flight.run(
+        (user_id, "verify"), lambda: verifier.verify_all(context.bot, user_id)
+    )
 
 
 async def safe_edit_message(query, text: str, **kwargs):
@@ -139,32 +164,120 @@ async def safe_edit_message(query, text: str, **kwargs):
         raise
 
 
+# =========================== DB ops ===========================
+# Blocking session work; handlers call these through db.run_db().
+
+def _db_start(session, tg_id: int, username: Optional[str], referrer_id: Optional[int]):
+    """Returns (user record, telegram_id of the credited referrer or None)."""
+    user = ensure_user(session, tg_id, username)
+    if user.referred_by is None and credit_referral(session, referrer_id, tg_id):
+        session.refresh(user)
+        return UserRecord.from_user(user), referrer_id
+    return UserRecord.from_user(user), None
+
+
+def _db_withdraw(session, tg_id: int, username: Optional[str]):
+    """Returns (user record, payout_id); payout_id is None when the user isn't eligible."""
+    user = ensure_user(session, tg_id, username)
+    if (user.referrals_count or 0) < REFERRALS_PER_WITHDRAWAL or not user.bsc_address:
+        return UserRecord.from_user(user), None
+
+    # reserve the referrals now so repeated /withdraw can't queue twice;
+    # the conditional UPDATE makes concurrent withdrawals race-free, and the
+    # payout worker gives the referrals back if the transfer fails
+    reserved = (
+        session.query(User)
+        .filter(User.id == user.id, User.referrals_count >= REFERRALS_PER_WITHDRAWAL)
+        .update({User.referrals_count: User.referrals_count - REFERRALS_PER_WITHDRAWAL},
+                synchronize_session=False)
+    )
+    if not reserved:
+        session.rollback()
+        return UserRecord.from_user(user), None
+    payout = queue_payout(session, user, "referral", REFERRAL_REWARD_BEAM, user.bsc_address)
+    session.commit()
+    return UserRecord.from_user(user), payout.id
+
+
+# =========================== Operations ===========================
+# Shared through single_flight; each returns what every waiting caller replies.
+
+async def _submit_address(context: ContextTypes.DEFAULT_TYPE, tg_id: int, username: Optional[str], addr: str):
+    """Returns (reply text, is_html, done) where done ends the awaiting-address state."""
+    if await welcome_ledger.address_taken(addr):
+        return "❌ This address has already received the welcome reward. Send a different one.", False, False
+    user = await user_cache.set_address(tg_id, username, addr)
+
+    # verify telegram joins before rewarding
+    ok = await _verify_all_required(context, user.telegram_id)
+    if not ok:
+        return "You must join all channels first. Tap 'Verify Telegram joins' again.", False, False
+
+    # claim + queue in one transaction; the ledger's unique keys make retries
+    # and concurrent taps resolve to a single payout
+    status, payout_id = await welcome_ledger.claim(user.telegram_id, WELCOME_REWARD_BEAM, addr)
+    if status == USER_ALREADY_CLAIMED:
+        return "✅ Address saved. You've already received the welcome reward.", False, True
+    if status == ADDRESS_ALREADY_CLAIMED:
+        return "❌ This address has already received the welcome reward. Send a different one.", False, False
+    payout_queue.enqueue(payout_id)
+    return (
+        f"✅ Address saved.\n<b>{WELCOME_REWARD_BEAM} BEAM</b> queued for payout. "
+        "You'll get the TX here once it's sent.",
+        True,
+        True,
+    )
+
+
+async def _withdraw(tg_id: int, username: Optional[str]):
+    """Returns (reply text, is_html)."""
+    # eligibility reads bsc_address, which may still be in the write-behind queue
+    await write_behind.flush()
+    user, payout_id = await run_db(_db_withdraw, tg_id, username)
+    user_cache.invalidate(user.telegram_id)
+
+    if payout_id is None:
+        refs = user.referrals_count or 0
+        if refs < REFERRALS_PER_WITHDRAWAL:
+            need = REFERRALS_PER_WITHDRAWAL - refs
+            return f"You need {need} more referral(s) to trigger auto-withdraw.", False
+        return "Submit your BSC address first.", False
+
+    payout_queue.enqueue(payout_id)
+    return (
+        f"⏳ Withdrawal of <b>{REFERRAL_REWARD_BEAM} BEAM</b> queued.\n"
+        "You'll get the TX here once it's sent.",
+        True,
+    )
+
+
 # =========================== Handlers ===========================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not _dm_only(update):
         return
-    session = SessionLocal()
-    try:
-        user = await _ensure_user(session, update.effective_user.id, update.effective_user.username)
-
-        # Handle referral payload: /start ref_12345
-        if update.message and update.message.text:
-            parts = update.message.text.split(maxsplit=1)
-            if len(parts) > 1 and parts[1].startswith("ref_"):
-                try:
-                    referrer_id = int(parts[1][4:])
-                    if referrer_id != user.telegram_id and user.referred_by is None:
-                        ref = session.query(User).filter_by(telegram_id=referrer_id).one_or_none()
-                        if ref:
-                            user.referred_by = ref.telegram_id
-                            session.add(Referral(referrer_id=ref.telegram_id, referee_id=user.telegram_id))
-                            session.commit()
-                except Exception as e:
-                    logger.info("referral parse error: %s", e)
-
-        await update.message.reply_text(WELCOME_TEXT, parse_mode=ParseMode.HTML, reply_markup=kb_main())
-    finally:
-        session.close()
+
+    # Handle referral payload: /start ref_12345
+    referrer_id = None
+    if update.message and update.message.text:
+        parts = update.message.text.split(maxsplit=1)
+        if len(parts) > 1 and parts[1].startswith("ref_"):
+            try:
+                referrer_id = int(parts[1][4:])
+            except ValueError as e:
+                logger.info("referral parse error: %s", e)
+
+    # a user who blocked the bot and comes back has unblocked it
+    mark_active(update.effective_user.id)
+
+    if referrer_id is None:
+        # plain /start: new users are inserted by the write-behind group commit
+        await user_cache.get(update.effective_user.id, update.effective_user.username)
+    else:
+        user, credited = await run_db(_db_start, update.effective_user.id, update.effective_user.username, referrer_id)
+        user_cache.put(user)
+        if credited is not None:
+            user_cache.invalidate(credited)
+    await update.message.reply_text(WELCOME_TEXT, parse_mode=ParseMode.HTML, reply_markup=kb_main())
 
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -179,191 +292,218 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q:
         return
-    await q.answer()
     data = q.data or ""
-    session = SessionLocal()
 
-    try:
-        user = await _ensure_user(session, q.from_user.id, q.from_user.username)
-
-        if data == "verify":
-            ok = await _verify_all_required(context, user.telegram_id)
-            if ok:
-                await safe_edit_message(
-                    q,
-                    "✅ All channels joined! Now submit your BSC address.",
-                    reply_markup=kb_main()
-                )
-            else:
-                # Show the configured channels (as links where possible)
-                lines = []
-                for ch in REQUIRED_CHANNELS:
-                    if isinstance(ch, int) or (isinstance(ch, str) and ch.startswith("-100")):
-                        lines.append(f"• {ch}")
-                    else:
-                        uname = str(ch).lstrip("@")
-                        lines.append(f"• https://t.me/{uname}")
-                await safe_edit_message(
-                    q,
-                    "❌ You haven't joined all channels yet. Please join:\n" + "\n".join(lines),
-                    reply_markup=kb_main()
-                )
-
-        elif data == "x_tasks":
-            # Provide buttons that open X (Twitter) profiles directly
-            x_kb = InlineKeyboardMarkup([
-                [InlineKeyboardButton("Follow @srdaryandubey", url="https://x.com/srdaryandubey")],
-                [InlineKeyboardButton("Follow @srdexchange", url="https://x.com/SrdExchange/status/1958187109447283119")],
-                [InlineKeyboardButton("✅ DONE", callback_data="back_main")]
-            ])
+    # only the balance screen needs the user row; everything else is pure UI
+    if data == "balance":
+        _, user = await asyncio.gather(q.answer(), user_cache.get(q.from_user.id, q.from_user.username))
+    else:
+        await q.answer()
+
+    if data == "verify":
+        ok = await _verify_all_required(context, q.from_user.id)
+        if ok:
             await safe_edit_message(
                 q,
-                "Follow both profiles and do the pinned post task 💡 Must Do All Task Otherwise Banned soon.",
-                reply_markup=x_kb
+                "✅ All channels joined! Now submit your BSC address.",
+                reply_markup=kb_main()
             )
-
-        elif data == "back_main":
-            await safe_edit_message(q, WELCOME_TEXT, parse_mode=ParseMode.HTML, reply_markup=kb_main())
-
-        elif data == "submit_addr":
-            await safe_edit_message(q, "Send me your <b>BSC address</b> now:", parse_mode=ParseMode.HTML)
-            context.user_data["awaiting_bsc"] = True
-
-        elif data == "balance":
-            bal = user.balance_beam or 0
-            refs = user.referrals_count or 0
-            txt = (
-                f"💰 Balance: <b>{bal} BEAM</b>\n"
-                f"👥 Referrals: <b>{refs}</b>\n\n"
-                "Withdrawals are auto-triggered every "
-                f"<b>{REFERRALS_PER_WITHDRAWAL}</b> referrals."
+        else:
+            # Show the configured channels (as links where possible)
+            lines = []
+            for ch in REQUIRED_CHANNELS:
+                if isinstance(ch, int) or (isinstance(ch, str) and ch.startswith("-100")):
+                    lines.append(f"• {ch}")
+                else:
+                    uname = str(ch).lstrip("@")
+                    lines.append(f"• https://t.me/{uname}")
+            await safe_edit_message(
+                q,
+                "❌ You haven't joined all channels yet. Please join:\n" + "\n".join(lines),
+                reply_markup=kb_main()
             )
-            await safe_edit_message(q, txt, parse_mode=ParseMode.HTML, reply_markup=kb_main())
 
-        elif data == "ref":
-            me = await context.bot.get_me()
-            link = f"https://t.me/{me.username}?start=ref_{user.telegram_id}"
-            await safe_edit_message(q, f"Your referral link:\n{link}", reply_markup=kb_main())
+    elif data == "x_tasks":
+        # Provide buttons that open X (Twitter) profiles directly
+        x_kb = InlineKeyboardMarkup([
+            [InlineKeyboardButton("Follow @srdaryandubey", url="https://x.com/srdaryandubey")],
+            [InlineKeyboardButton("Follow @srdexchange", url="https://x.com/SrdExchange/status/1958187109447283119")],
+            [InlineKeyboardButton("✅ DONE", callback_data="back_main")]
+        ])
+        await safe_edit_message(
+            q,
+            "Follow both profiles and do the pinned post task 💡 Must Do All Task Otherwise Banned soon.",
+            reply_markup=x_kb
+        )
+
+    elif data == "back_main":
+        await safe_edit_message(q, WELCOME_TEXT, parse_mode=ParseMode.HTML, reply_markup=kb_main())
+
+    elif data == "submit_addr":
+        await safe_edit_message(q, "Send me your <b>BSC address</b> now:", parse_mode=ParseMode.HTML)
+        context.user_data["awaiting_bsc"] = True
+
+    elif data == "balance":
+        bal = user.balance_beam or 0
+        refs = user.referrals_count or 0
+        txt = (
+            f"💰 Balance: <b>{bal} BEAM</b>\n"
+            f"👥 Referrals: <b>{refs}</b>\n\n"
+            "Withdrawals are auto-triggered every "
+            f"<b>{REFERRALS_PER_WITHDRAWAL}</b> referrals."
+        )
+        await safe_edit_message(q, txt, parse_mode=ParseMode.HTML, reply_markup=kb_main())
 
-        elif data == "help":
-            await safe_edit_message(q, "Use /start to open the menu.", reply_markup=kb_main())
+    elif data == "ref":
+        # bot.username is cached by get_me() during startup
+        link = f"https://t.me/{context.bot.username}?start=ref_{q.from_user.id}"
+        await safe_edit_message(q, f"Your referral link:\n{link}", reply_markup=kb_main())
 
-    finally:
-        session.close()
+    elif data == "help":
+        await safe_edit_message(q, "Use /start to open the menu.", reply_markup=kb_main())
 
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not _dm_only(update):
         return
-    session = SessionLocal()
-    try:
-        user = await _ensure_user(session, update.effective_user.id, update.effective_user.username)
-
-        # Expecting BSC address?
-        if context.user_data.get("awaiting_bsc"):
-            addr = (update.message.text or "").strip()
-            if not is_address(addr):
-                await update.message.reply_text("❌ That doesn't look like a valid BSC address. Try again.")
-                return
-
-            addr = checksum(addr)
-            user.bsc_address = addr
-            session.commit()
-
-            # verify telegram joins before rewarding
-            ok = await _verify_all_required(context, user.telegram_id)
-            if not ok:
-                await update.message.reply_text(
-                    "You must join all channels first. Tap 'Verify Telegram joins' again.",
-                    reply_markup=kb_main()
-                )
-                return
-
-            # send welcome reward
-            try:
-                tx_hash = send_tokens(addr, WELCOME_REWARD_BEAM)
-                user.balance_beam = (user.balance_beam or 0) + WELCOME_REWARD_BEAM
-                session.commit()
-                await update.message.reply_text(
-                    f"✅ Address saved.\nSent <b>{WELCOME_REWARD_BEAM} BEAM</b>.\nTX: {tx_hash}",
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=kb_main()
-                )
-            except Exception as e:
-                await update.message.reply_text(f"⚠️ Transfer failed: {e}", reply_markup=kb_main())
 
-            context.user_data["awaiting_bsc"] = False
+    # Expecting BSC address?
+    if context.user_data.get("awaiting_bsc"):
+        addr = (update.message.text or "").strip()
+        if not is_address(addr):
+            await update.message.reply_text("❌ That doesn't look like a valid BSC address. Try again.")
             return
 
-        # any other text in DM
-        await update.message.reply_text("Use /start to open the menu.", reply_markup=kb_main())
+        addr = checksum(addr)
+        tg_id, username = update.effective_user.id, update.effective_user.username
+        text, html, done = await single_flight.run(
+            (tg_id, "address", addr), lambda: _submit_address(context, tg_id, username, addr)
+        )
+        await update.message.reply_text(
+            text, parse_mode=ParseMode.HTML if html else None, reply_markup=kb_main()
+        )
+        if done:
+            context.user_data["awaiting_bsc"] = False
+        return
 
-    finally:
-        session.close()
+    # any other text in DM
+    await user_cache.get(update.effective_user.id, update.effective_user.username)
+    await update.message.reply_text("Use /start to open the menu.", reply_markup=kb_main())
 
 
 async def withdraw_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not _dm_only(update):
         return
-    session = SessionLocal()
-    try:
-        user = await _ensure_user(session, update.effective_user.id, update.effective_user.username)
+    tg_id, username = update.effective_user.id, update.effective_user.username
+    text, html = await single_flight.run((tg_id, "withdraw"), lambda: _withdraw(tg_id, username))
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML if html else None, reply_markup=kb_main())
 
-        refs = user.referrals_count or 0
-        if refs < REFERRALS_PER_WITHDRAWAL:
-            need = REFERRALS_PER_WITHDRAWAL - refs
-            await update.message.reply_text(
-                f"You need {need} more referral(s) to trigger auto-withdraw.",
-                reply_markup=kb_main()
-            )
-            return
 
-        if not user.bsc_address:
-            await update.message.reply_text("Submit your BSC address first.", reply_markup=kb_main())
-            return
+# ------------ Admin ------------
+_broadcast_tasks: Dict[int, asyncio.Task] = {}
+
+
+def _launch_broadcast(app, broadcast_id: int, admin_id: Optional[int]) -> None:
+    """Run a broadcast in the background (once per id) and report to the admin who started it."""
+    if broadcast_id in _broadcast_tasks:
+        return
 
+    async def _run():
         try:
-            tx_hash = send_tokens(user.bsc_address, REFERRAL_REWARD_BEAM)
-            user.balance_beam = (user.balance_beam or 0) + REFERRAL_REWARD_BEAM
-            user.referrals_count = refs - REFERRALS_PER_WITHDRAWAL
-            session.add(Payout(telegram_id=user.telegram_id, amount=REFERRAL_REWARD_BEAM, tx_hash=tx_hash))
-            session.commit()
-            await update.message.reply_text(
-                f"✅ Withdrawn <b>{REFERRAL_REWARD_BEAM} BEAM</b>.\nTX: {tx_hash}",
-                parse_mode=ParseMode.HTML,
-                reply_markup=kb_main()
-            )
+            b = await run_broadcast(app.bot, broadcast_id)
+            report = f"📣 Broadcast #{b.id} done: sent {b.sent}, blocked {b.blocked}, failed {b.failed}."
         except Exception as e:
-            await update.message.reply_text(f"⚠️ Withdrawal failed: {e}", reply_markup=kb_main())
+            logger.exception("broadcast %s crashed", broadcast_id)
+            report = f"⚠️ Broadcast #{broadcast_id} stopped: {e}. It resumes on the next restart."
+        finally:
+            _broadcast_tasks.pop(broadcast_id, None)
+        if admin_id:
+            try:
+                await app.bot.send_message(admin_id, report)
+            except Exception as e:
+                logger.warning("broadcast report to %s failed: %s", admin_id, e)
 
-    finally:
-        session.close()
+    _broadcast_tasks[broadcast_id] = asyncio.create_task(_run())
+
+
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not _dm_only(update) or update.effective_user.id not in ADMIN_IDS:
+        return
+    parts = update.message.text_html.split(maxsplit=1)
+    if len(parts) < 2:
+        await update.message.reply_text("Usage: /broadcast <message> (HTML allowed)")
+        return
+    broadcast_id = await create_broadcast(parts[1], update.effective_user.id)
+    _launch_broadcast(context.application, broadcast_id, update.effective_user.id)
+    await update.message.reply_text(f"📣 Broadcast #{broadcast_id} started. I'll report here when it's done.")
+
+
+def _who(tg_id: int, username: Optional[str]) -> str:
+    return f"@{html.escape(username)}" if username else f"<code>{tg_id}</code>"
+
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats: campaign totals; /stats <telegram_id>: one referrer."""
+    if not _dm_only(update) or update.effective_user.id not in ADMIN_IDS:
+        return
+    if context.args:
+        try:
+            tg_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("Usage: /stats [telegram_id]")
+            return
+        username, direct, downline = await referrer_stats(tg_id)
+        await update.message.reply_text(
+            f"👤 {_who(tg_id, username)}: <b>{direct}</b> direct referral(s), "
+            f"<b>{downline}</b> in the downline ({ANALYTICS_MAX_DEPTH} levels)",
+            parse_mode=ParseMode.HTML,
+        )
+        return
+
+    totals = await campaign_stats()
+    a, t = totals["all"], totals["today"]
+    await update.message.reply_text(
+        "📊 <b>Campaign</b> (today, UTC, in brackets)\n"
+        f"Users: {a['users']} (+{t['users']})\n"
+        f"Referrals: {a['referrals']} (+{t['referrals']})\n"
+        f"Payouts queued: {a['payouts_queued']} / {a['beam_queued']} BEAM "
+        f"(+{t['payouts_queued']} / {t['beam_queued']} BEAM)\n"
+        f"Payouts confirmed: {a['payouts_confirmed']} / {a['beam_confirmed']} BEAM "
+        f"(+{t['payouts_confirmed']} / {t['beam_confirmed']} BEAM)\n"
+        f"Payouts failed: {a['payouts_failed']} (+{t['payouts_failed']})",
+        parse_mode=ParseMode.HTML,
+    )
+
+
+async def leaderboard_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/leaderboard [direct|downline]"""
+    if not _dm_only(update) or update.effective_user.id not in ADMIN_IDS:
+        return
+    by = "downline" if context.args and context.args[0].lower() == "downline" else "direct"
+    rows = await leaderboard(by)
+    if not rows:
+        await update.message.reply_text("No referrals yet.")
+        return
+    lines = [f"🏆 <b>Top referrers</b> by {by}" + (f" ({ANALYTICS_MAX_DEPTH} levels)" if by == "downline" else "")]
+    for rank, (tg_id, username, direct, downline) in enumerate(rows, 1):
+        lines.append(f"{rank}. {_who(tg_id, username)}: {direct} direct, {downline} downline")
+    await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.HTML)
 
 
 # ------------ Debug command to see exactly what the bot sees ------------
 async def checkverify(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not _dm_only(update):
         return
-    user_id = update.effective_user.id
     rows = []
-    for ch in REQUIRED_CHANNELS:
-        try:
-            # Resolve for display
-            if isinstance(ch, int) or (isinstance(ch, str) and ch.startswith("-100")):
-                chat = await context.bot.get_chat(int(ch))
-                label = str(chat.id)
-            else:
-                uname = str(ch).lstrip("@")
-                chat = await context.bot.get_chat(f"@{uname}")
-                label = f"@{uname}"
-
-            m = await context.bot.get_chat_member(chat.id, user_id)
-            status = str(m.status).upper()
-            ok = status.lower() not in {"left", "kicked"}
-            rows.append(f"{'✅' if ok else '❌'} {label} → {status} ({'OK' if ok else 'ERROR'})")
-        except Exception as e:
-            rows.append(f"❌ {ch} → ERROR: {e}")
-        await asyncio.sleep(0.15)
+    for r in await verifier.check(context.bot, update.effective_user.id):
+        source = "cached" if r.cached else "live"
+        if r.error:
+            rows.append(f"❌ {r.label} → ERROR: {r.error}")
+        else:
+            rows.append(
+                f"{'✅' if r.ok else '❌'} {r.label} → {r.status.upper()} "
+                f"({'OK' if r.ok else 'ERROR'}, {source})"
+            )
 
     await update.message.reply_text("\n".join(rows))
 
@@ -381,16 +521,112 @@ async def _clear_webhook(app):
         pass
 
 
+async def _timed(name: str, timings: dict, coro):
+    t = time.perf_counter()
+    try:
+        return await coro
+    except Exception as e:
+        logger.warning("warm-up %s failed: %s", name, e)
+    finally:
+        timings[name] = time.perf_counter() - t
+
+
+# started by post_init, cancelled by post_shutdown (broadcasts too: they resume from their checkpoint)
+_startup_tasks: Set[asyncio.Task] = set()
+
+
+async def _warm_up_web3():
+    """Runs in the background so polling never waits on a slow or unreachable RPC."""
+    try:
+        timings = await asyncio.to_thread(warm_up_web3)
+    except Exception as e:
+        logger.warning("web3 warm-up failed (will retry on first payout): %s", e)
+        return
+    logger.info("web3 warm-up: %s", ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items()))
+
+
+async def _post_init(app, run_payouts: bool = True, payout_poll: Optional[float] = None, metrics_port: int = 0):
+    """Warm-up phase: Telegram prefetches run concurrently; web3 warms in the background."""
+    timings = {}
+    steps = [
+        _timed("metrics", timings, metrics.start(metrics_port)),
+        _timed("get_me", timings, app.bot.get_me()),
+        _timed("channels", timings, verifier.resolve(app.bot)),
+        _timed("reward_ledger", timings, welcome_ledger.warm()),
+    ]
+    if BOT_MODE == "polling":
+        steps.append(_timed("delete_webhook", timings, _clear_webhook(app)))
+    if run_payouts:
+        steps.append(_timed("payout_queue", timings, payout_queue.start(app, payout_poll)))
+    await asyncio.gather(*steps)
+    if run_payouts:
+        task = asyncio.create_task(_warm_up_web3())
+        _startup_tasks.add(task)
+        task.add_done_callback(_startup_tasks.discard)
+        # broadcasts interrupted by a restart pick up from their checkpoint
+        for broadcast_id in await unfinished_broadcasts():
+            _launch_broadcast(app, broadcast_id, None)
+    logger.info(
+        "warm-up: %s; ready %.0fms after start",
+        ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items()),
+        (time.perf_counter() - _BOOT) * 1000,
+    )
+
+
+async def _first_update(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    global _first_update_seen
+    if not _first_update_seen:
+        _first_update_seen = True
+        logger.info("first update %.0fms after start", (time.perf_counter() - _BOOT) * 1000)
+
+
+async def _post_shutdown(app):
+    tasks = [*_startup_tasks, *_broadcast_tasks.values()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await payout_queue.stop()
+    await write_behind.close()
+    logger.info("user cache: %s", user_cache.stats())
+
+
 # =========================== Entrypoint ===========================
-def main():
-    init_db()
-    app = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(True).build()
+def build_application(
+    global_rate: float = TG_GLOBAL_RATE,
+    lookup_rate: float = TG_LOOKUP_RATE,
+    run_payouts: bool = True,
+    payout_poll: Optional[float] = None,
+    metrics_port: int = METRICS_PORT,
+):
+    """
+    The bot with all handlers. Webhook workers (webhook.py) build one each,
+    with a share of the global send and lookup rates; only one of them runs payouts.
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .rate_limiter(TelegramRateLimiter(global_rate, lookup_rate))
+        .persistence(SQLPersistence())
+        .post_init(functools.partial(
+            _post_init, run_payouts=run_payouts, payout_poll=payout_poll, metrics_port=metrics_port
+        ))
+        .post_shutdown(_post_shutdown)
+    )
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(f"{BOT_API_BASE_URL}/bot").base_file_url(f"{BOT_API_BASE_URL}/file/bot")
+    app = builder.build()
 
     # Commands
     app.add_handler(CommandHandler("start", start, filters=filters.ChatType.PRIVATE))
     app.add_handler(CommandHandler("help", help_cmd, filters=filters.ChatType.PRIVATE))
     app.add_handler(CommandHandler("withdraw", withdraw_cmd, filters=filters.ChatType.PRIVATE))
 
+    # Admin
+    app.add_handler(CommandHandler("broadcast", broadcast_cmd, filters=filters.ChatType.PRIVATE))
+    app.add_handler(CommandHandler("stats", stats_cmd, filters=filters.ChatType.PRIVATE))
+    app.add_handler(CommandHandler("leaderboard", leaderboard_cmd, filters=filters.ChatType.PRIVATE))
+
     # Debug command
     app.add_handler(CommandHandler("checkverify", checkverify, filters=filters.ChatType.PRIVATE))
 
@@ -400,9 +636,26 @@ def main():
 
     app.add_error_handler(error_handler)
 
+    # Startup timing
+    app.add_handler(TypeHandler(Update, _first_update), group=-1)
+
+    metrics.instrument_application(app)
+    return app
+
+
+def main():
+    t = time.perf_counter()
+    init_db()
+    logger.info("init_db %.0fms", (time.perf_counter() - t) * 1000)
+
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+        run_webhook()
+        return
+
     # Ensure no webhook and start polling
-    app.post_init = _clear_webhook
-    app.run_polling(allowed_updates=["message", "callback_query"], drop_pending_updates=True)
+    app = build_application()
+    app.run_polling(allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+# broadcast.py
+# Mass messages to every user. Recipients are streamed from the users table
+# in telegram_id order (keyset pages, never the whole table), sent through
+# the bot's rate limiter with a bounded number in flight, and the position
+# is checkpointed after every page so an interrupted broadcast resumes where
+# it stopped. Users who blocked the bot are flagged and skipped from then on.
+
+import asyncio
+import logging
+from typing import List, Optional
+
+from sqlalchemy import or_
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden
+
+from config import BROADCAST_CHUNK, BROADCAST_CONCURRENCY
+from db import run_db, write_behind, User, Broadcast
+
+logger = logging.getLogger("srd_airdrop_bot.broadcast")
+
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+
+# =========================== DB ops ===========================
+def _db_create(session, text: str, created_by: Optional[int]) -> int:
+    b = Broadcast(text=text, created_by=created_by)
+    session.add(b)
+    session.commit()
+    return b.id
+
+
+def _db_get(session, broadcast_id: int) -> Optional[Broadcast]:
+    return session.get(Broadcast, broadcast_id)
+
+
+def _db_unfinished(session) -> List[int]:
+    return [bid for (bid,) in session.query(Broadcast.id).filter_by(status="running").order_by(Broadcast.id)]
+
+
+def _db_page(session, after: int, limit: int) -> List[int]:
+    # keyset pagination on the unique telegram_id index: constant cost per page
+    q = (
+        session.query(User.telegram_id)
+        .filter(User.telegram_id > after, or_(User.blocked.is_(None), User.blocked.is_(False)))
+        .order_by(User.telegram_id)
+        .limit(limit)
+    )
+    return [tg for (tg,) in q]
+
+
+def _db_checkpoint(session, broadcast_id: int, last_tg: int, counts: dict, blocked_ids: List[int]) -> None:
+    if blocked_ids:
+        session.query(User).filter(User.telegram_id.in_(blocked_ids)).update(
+            {User.blocked: True}, synchronize_session=False
+        )
+    session.query(Broadcast).filter_by(id=broadcast_id).update(
+        {
+            Broadcast.last_telegram_id: last_tg,
+            Broadcast.sent: Broadcast.sent + counts[SENT],
+            Broadcast.failed: Broadcast.failed + counts[FAILED],
+            Broadcast.blocked: Broadcast.blocked + counts[BLOCKED],
+        },
+        synchronize_session=False,
+    )
+    session.commit()
+
+
+def _db_finish(session, broadcast_id: int) -> Broadcast:
+    b = session.get(Broadcast, broadcast_id)
+    b.status = "done"
+    session.commit()
+    return b
+
+
+# write-behind op (see db.WriteBehind): a blocked user who talks to the bot again has unblocked it
+def _wb_clear_blocked(session, tg_id: int) -> None:
+    session.query(User).filter(User.telegram_id == tg_id, User.blocked.is_(True)).update(
+        {User.blocked: False}, synchronize_session=False
+    )
+
+
+def mark_active(tg_id: int) -> None:
+    """The user messaged the bot, so it isn't blocked (anymore); persisted with the next group commit."""
+    write_behind.submit(_wb_clear_blocked, tg_id)
+
+
+# =========================== Sending ===========================
+async def _send_one(bot, tg_id: int, text: str, slots: asyncio.Semaphore, priority: str) -> str:
+    async with slots:
+        try:
+            await bot.send_message(
+                tg_id, text, parse_mode=ParseMode.HTML, disable_web_page_preview=True,
+                rate_limit_args={"priority": priority},
+            )
+            return SENT
+        except Forbidden:
+            # blocked by the user, or the account was deleted
+            return BLOCKED
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                return BLOCKED
+            logger.warning("broadcast to %s failed: %s", tg_id, e)
+            return FAILED
+        except Exception as e:
+            logger.warning("broadcast to %s failed: %s", tg_id, e)
+            return FAILED
+
+
+async def create_broadcast(text: str, created_by: Optional[int] = None) -> int:
+    return await run_db(_db_create, text, created_by)
+
+
+async def unfinished_broadcasts() -> List[int]:
+    return await run_db(_db_unfinished)
+
+
+async def run_broadcast(
+    bot,
+    broadcast_id: int,
+    priority: str = "low",
+    concurrency: int = BROADCAST_CONCURRENCY,
+    chunk: int = BROADCAST_CHUNK,
+) -> Broadcast:
+    """
+    Send (or resume) a broadcast; returns its final row. `bot` needs the
+    TelegramRateLimiter (an ExtBot); in the bot, priority "low" leaves
+    headroom for interactive replies. A crash resends at most one page.
+    """
+    b = await run_db(_db_get, broadcast_id)
+    if b is None:
+        raise ValueError(f"no broadcast {broadcast_id}")
+    if b.status == "done":
+        return b
+    if b.last_telegram_id:
+        logger.info("broadcast %s: resuming after user %s", broadcast_id, b.last_telegram_id)
+
+    slots = asyncio.Semaphore(concurrency)
+    page = await run_db(_db_page, b.last_telegram_id or 0, chunk)
+    while page:
+        # read the next page while this one is being sent
+        next_page = asyncio.create_task(run_db(_db_page, page[-1], chunk))
+        results = await asyncio.gather(*(_send_one(bot, tg, b.text, slots, priority) for tg in page))
+        counts = {SENT: 0, FAILED: 0, BLOCKED: 0}
+        for r in results:
+            counts[r] += 1
+        blocked_ids = [tg for tg, r in zip(page, results) if r == BLOCKED]
+        await run_db(_db_checkpoint, broadcast_id, page[-1], counts, blocked_ids)
+        page = await next_page
+
+    b = await run_db(_db_finish, broadcast_id)
+    logger.info("broadcast %s done: sent=%s failed=%s blocked=%s", b.id, b.sent, b.failed, b.blocked)
+    return b
@@ -10,6 +10,9 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")   # must be set in .env or Railway Variables
 
+# telegram ids allowed to use admin commands (/broadcast)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+
 # Required channels: you can use @username or numeric chat IDs (-100…)
 # Example with usernames:
 # REQUIRED_CHANNELS = ["srdexchange", "srdexchangeglobal", "srdearning"]
@@ -26,13 +29,107 @@ REQUIRED_CHANNELS = [
     if c.strip()
 ]
 
+# membership cache: how long a "joined" / "not joined" answer is reused (seconds)
+MEMBERSHIP_TTL_OK = float(os.getenv("MEMBERSHIP_TTL_OK", "300"))
+MEMBERSHIP_TTL_FAIL = float(os.getenv("MEMBERSHIP_TTL_FAIL", "10"))
+
+# Bot API pacing (Telegram: ~30 msg/s overall, ~1 msg/s per private chat, 20 msg/min per group)
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_GROUP_RATE = float(os.getenv("TG_GROUP_RATE", "20"))     # per minute
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))      # RetryAfter retries per call
+# calls that post nothing (getChatMember, getChat, answerCallbackQuery, ...) are paced separately, per second
+TG_LOOKUP_RATE = float(os.getenv("TG_LOOKUP_RATE", "300"))
+
+# broadcasts: users read per keyset page, and messages in flight at once (pacing is the rate limiter's job)
+BROADCAST_CHUNK = int(os.getenv("BROADCAST_CHUNK", "500"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "25"))
+
+# repeated verify / withdraw / address taps within this many seconds reuse the last result
+SINGLE_FLIGHT_DEBOUNCE = float(os.getenv("SINGLE_FLIGHT_DEBOUNCE", "3"))
+
+# /metrics (Prometheus text format) on this port, 0 = off; webhook worker N listens on METRICS_PORT + N.
+# Keep it on loopback: with METRICS_PROFILE=1 it also serves stack samples at /debug/profile.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_PROFILE = os.getenv("METRICS_PROFILE", "0").lower() in ("1", "true", "yes")
+METRICS_PROFILE_INTERVAL = float(os.getenv("METRICS_PROFILE_INTERVAL", "0.01"))   # seconds between stack samples
+
+# in-memory LRU of user records in front of the users table
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "100000"))
+
+# seconds between writes of changed user/chat data (e.g. awaiting_bsc) to the bot_state table
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+
+# Analytics (analytics.py): referral trees are tracked this many levels deep; /leaderboard shows this many rows
+ANALYTICS_MAX_DEPTH = int(os.getenv("ANALYTICS_MAX_DEPTH", "3"))
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+
+# ===============================================================
+# Updates / Webhook
+# ===============================================================
+
+# update types the bot subscribes to (polling and webhook)
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+# "polling" (one process) or "webhook" (HTTP ingress sharding updates over worker processes, see webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")              # public https URL registered with Telegram; empty = don't register
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))   # Railway sets PORT
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")        # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000"))   # per worker; full -> 503, Telegram retries
+WEBHOOK_STATS_INTERVAL = float(os.getenv("WEBHOOK_STATS_INTERVAL", "60"))
+
+# e.g. http://127.0.0.1:8081 to talk to a local (fake or self-hosted) Bot API server
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "").rstrip("/")
+
 # ===============================================================
 # Blockchain (BSC / BEP20)
 # ===============================================================
 
+# one endpoint or a comma-separated list; reads are hedged and raw txs fanned out across them
 BSC_RPC = os.getenv("BSC_RPC", "https://bsc-dataseed.binance.org/")  # default BSC RPC
+BSC_RPC_URLS = [u.strip() for u in BSC_RPC.split(",") if u.strip()]
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", "30"))
+RPC_HEDGE_DELAY = float(os.getenv("RPC_HEDGE_DELAY", "0.3"))        # seconds before asking a 2nd node
+RPC_BROADCAST_FANOUT = int(os.getenv("RPC_BROADCAST_FANOUT", "3"))  # nodes each raw tx is sent to
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "8"))                # keep-alive connections per node
 ADMIN_PRIVATE_KEY = os.getenv("ADMIN_PRIVATE_KEY", "")
 BEAM_CONTRACT = os.getenv("BEAM_CONTRACT", "")
+CHAIN_ID = int(os.getenv("CHAIN_ID", "56"))  # 56 = BSC mainnet; 31337 for a local anvil chain
+
+# how many payout transfers may be signed and in flight at once
+PAYOUT_MAX_IN_FLIGHT = int(os.getenv("PAYOUT_MAX_IN_FLIGHT", "16"))
+# manage.py distribute: transfers broadcast but not yet mined at any time
+DISTRIBUTE_WINDOW = int(os.getenv("DISTRIBUTE_WINDOW", "64"))
+# webhook mode: payouts queued by other worker processes are picked up from the DB this often (seconds)
+PAYOUT_POLL_INTERVAL = float(os.getenv("PAYOUT_POLL_INTERVAL", "2"))
+
+# receipt tracker: how often to look for new blocks, and when to give up on a tx
+RECEIPT_POLL_INTERVAL = float(os.getenv("RECEIPT_POLL_INTERVAL", "1.5"))
+RECEIPT_TIMEOUT_BLOCKS = int(os.getenv("RECEIPT_TIMEOUT_BLOCKS", "60"))
+# how often "stuck" payouts are re-checked: settled once mined, failed once their nonce went to another tx
+STUCK_SWEEP_INTERVAL = float(os.getenv("STUCK_SWEEP_INTERVAL", "60"))
+
+# fee oracle: fee data is reused for FEE_CACHE_SECONDS (about one BSC block)
+FEE_CACHE_SECONDS = float(os.getenv("FEE_CACHE_SECONDS", "3"))
+FEE_MIN_PRIORITY_GWEI = float(os.getenv("FEE_MIN_PRIORITY_GWEI", "1"))
+FEE_MAX_GWEI = float(os.getenv("FEE_MAX_GWEI", "10"))
+FEE_BUMP_PERCENT = float(os.getenv("FEE_BUMP_PERCENT", "15"))       # replacement must beat the old tx by >10%
+FEE_MAX_REPRICES = int(os.getenv("FEE_MAX_REPRICES", "3"))          # per payout before marking it stuck
+GAS_LIMIT_MARGIN = float(os.getenv("GAS_LIMIT_MARGIN", "1.25"))     # headroom over estimate_gas
+
+# Batch payouts through a disperse contract (leave empty for one transfer per payout).
+# Queued payouts are grouped for up to PAYOUT_BATCH_WINDOW seconds or PAYOUT_BATCH_SIZE rows.
+DISPERSE_CONTRACT = os.getenv("DISPERSE_CONTRACT", "")
+PAYOUT_BATCH_SIZE = int(os.getenv("PAYOUT_BATCH_SIZE", "50"))
+PAYOUT_BATCH_WINDOW = float(os.getenv("PAYOUT_BATCH_WINDOW", "2.0"))
+
+# Multicall3 (same address on BSC and most chains); balance audits fall back to JSON-RPC batches without it
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
 
 # ===============================================================
 # Rewards Config
@@ -1,11 +1,31 @@
 # db.py
-from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import (
+    create_engine, event, inspect, text,
+    Column, Integer, BigInteger, String, Text, Boolean, DateTime, ForeignKey, Index, UniqueConstraint,
+    select, update, insert, exists, literal, func, bindparam, union_all, or_,
+)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import asyncio
+import logging
 import os
 
+from config import ANALYTICS_MAX_DEPTH
+from metrics import instrument_engine
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///airdrop.db")
 
+# SQLite tuning: WAL lets readers run during a write. synchronous=FULL fsyncs
+# every commit, so a signed tx recorded before broadcast survives power loss;
+# NORMAL only fsyncs at checkpoints (faster, but the last commits can be lost)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "FULL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+logger = logging.getLogger("srd_airdrop_bot.db")
+
 engine = create_engine(
     DATABASE_URL,
     future=True,
@@ -13,7 +33,19 @@ engine = create_engine(
     connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
 )
 
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.close()
+
+instrument_engine(engine)   # per-statement latency for /metrics
+
+# expire_on_commit=False: rows returned from run_db() stay readable after their session closes
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False, future=True)
 Base = declarative_base()
 
 class User(Base):
@@ -26,10 +58,11 @@ class User(Base):
     username = Column(String(255), default="")
 
     # Airdrop fields your bot uses
-    bsc_address = Column(String(64), nullable=True)
+    bsc_address = Column(String(64), nullable=True, index=True)
     balance_beam = Column(Integer, default=0)          # accumulated BEAM
     referrals_count = Column(Integer, default=0)       # number of successful referrals
     referred_by = Column(BigInteger, nullable=True)    # telegram_id of referrer
+    blocked = Column(Boolean, default=False)           # bot blocked / account gone; broadcasts skip
 
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -45,6 +78,9 @@ class Referral(Base):
     referee_id = Column(BigInteger, index=True, nullable=False)   # telegram_id of referee
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # a user can be referred only once; credit_referral() relies on this
+    __table_args__ = (Index("uq_referrals_referee", "referee_id", unique=True),)
+
     # not strictly needed for queries, but nice to have
     referrer_db_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     referrer = relationship("User", back_populates="referrals", foreign_keys=[referrer_db_id])
@@ -58,8 +94,389 @@ class Payout(Base):
     tx_hash = Column(String(100), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # payout queue bookkeeping (see payouts.py)
+    kind = Column(String(32), default="referral")                  # "welcome" | "referral"
+    address = Column(String(64), nullable=True)                    # destination BSC address
+    status = Column(String(16), default="confirmed", index=True)   # queued | sending | sent | confirmed | failed | stuck
+    error = Column(String(255), nullable=True)
+    # manage.py distribute: planned -> signed (nonce + raw tx stored before broadcast) -> confirmed | failed
+    nonce = Column(BigInteger, nullable=True)
+    raw_tx = Column(Text, nullable=True)
+    replaced = Column(Text, nullable=True)                         # earlier hashes of this nonce (repriced), comma-separated
+    confirmed_block = Column(BigInteger, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     user = relationship("User", back_populates="payouts")
 
+class RewardClaim(Base):
+    """
+    One row per granted one-time reward, written in the same transaction as
+    its Payout. The unique keys make retries, double taps and address reuse
+    across accounts resolve to a single payout.
+    """
+    __tablename__ = "reward_claims"
+    __table_args__ = (
+        UniqueConstraint("telegram_id", "reward_type", name="uq_reward_claims_user"),
+        UniqueConstraint("reward_type", "address", name="uq_reward_claims_address"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    telegram_id = Column(BigInteger, nullable=False)
+    reward_type = Column(String(32), nullable=False)       # "welcome"
+    address = Column(String(64), nullable=False)           # checksummed BSC address
+    payout_id = Column(Integer, ForeignKey("payouts.id"), nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Broadcast(Base):
+    """A mass message and its checkpoint; users are sent to in telegram_id order (see broadcast.py)."""
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(Text, nullable=False)                  # HTML
+    status = Column(String(16), default="running")       # running | done
+    last_telegram_id = Column(BigInteger, default=0)     # every user up to here has been handled
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    created_by = Column(BigInteger, nullable=True)       # admin telegram_id, None from the CLI
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BotState(Base):
+    """PTB user/chat/bot/conversation data (see persistence.py), one JSON blob per key."""
+    __tablename__ = "bot_state"
+    __table_args__ = (UniqueConstraint("kind", "key", name="uq_bot_state_key"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(64), nullable=False)      # "user" | "chat" | "bot" | "conv:<name>"
+    key = Column(String(255), nullable=False)      # telegram id, or JSON conversation key
+    data = Column(Text, nullable=False)            # compact JSON
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ReferralPath(Base):
+    """Closure table over referrals: who is in whose downline, up to ANALYTICS_MAX_DEPTH levels apart."""
+    __tablename__ = "referral_paths"
+    __table_args__ = (Index("ix_referral_paths_descendant", "descendant_id"),)
+
+    ancestor_id = Column(BigInteger, primary_key=True, autoincrement=False)     # telegram_id
+    descendant_id = Column(BigInteger, primary_key=True, autoincrement=False)   # telegram_id
+    depth = Column(Integer, nullable=False)                                     # 1 = direct referral
+
+class ReferrerStats(Base):
+    """Per-referrer counts behind /leaderboard, kept current by link_referral()."""
+    __tablename__ = "referrer_stats"
+    __table_args__ = (
+        Index("ix_referrer_stats_direct", "direct", "telegram_id"),
+        Index("ix_referrer_stats_downline", "downline", "telegram_id"),
+    )
+
+    telegram_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    direct = Column(Integer, default=0)      # all-time; users.referrals_count is spent by withdrawals
+    downline = Column(Integer, default=0)    # referees up to ANALYTICS_MAX_DEPTH levels down
+
+class DailyTotal(Base):
+    """Campaign counters per UTC day, plus day "all" for the running total (see bump_daily())."""
+    __tablename__ = "daily_totals"
+    __table_args__ = (UniqueConstraint("day", "metric", name="uq_daily_totals_key"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    day = Column(String(10), nullable=False)       # "YYYY-MM-DD" | "all"
+    metric = Column(String(32), nullable=False)    # e.g. referrals, payouts_confirmed, beam_confirmed
+    value = Column(BigInteger, default=0)
+
+def _add_missing_columns():
+    """create_all() never alters existing tables; add new nullable columns and indexes in place."""
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                col_type = col.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}'))
+    for table in Base.metadata.sorted_tables:
+        for idx in table.indexes:
+            try:
+                with engine.begin() as conn:
+                    idx.create(bind=conn, checkfirst=True)
+            except Exception as e:
+                # e.g. a unique index over legacy duplicates; `manage.py reconcile-referrals` cleans those
+                logger.warning("could not create index %s: %s", idx.name, e)
+
+# Rows written before a column existed get NULL from ALTER TABLE; the model
+# default only covers new inserts. Pre-queue payouts were paid referral
+# withdrawals, so they are settled as such. Runs on every start (a DB
+# migrated without it still has the NULLs); status is indexed, so it is cheap.
+def _backfill_legacy_rows():
+    with engine.begin() as conn:
+        conn.execute(
+            update(Payout).where(Payout.status.is_(None))
+            .values(status="confirmed", kind=func.coalesce(Payout.kind, "referral"))
+        )
+
+# daily_totals only counts users created since the counter was added: the
+# all-time total starts from the users table once (backfill() redoes the days).
+def _seed_user_total():
+    with engine.begin() as conn:
+        key = (DailyTotal.day == "all", DailyTotal.metric == "users")
+        if conn.execute(select(DailyTotal.id).where(*key)).first() is None:
+            conn.execute(insert(DailyTotal).values(
+                day="all", metric="users", value=select(func.count(User.id)).scalar_subquery()
+            ))
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _backfill_legacy_rows()
+    _seed_user_total()
+
+# ===============================================================
+# Referral accounting
+# ===============================================================
+
+def credit_referral(session, referrer_id: int, referee_id: int) -> bool:
+    """
+    Atomically record that `referrer_id` referred `referee_id` (both telegram ids;
+    the referee's row must exist) and bump the referrer's counter. The guarded
+    INSERT ... SELECT plus the unique index on referee_id decide concurrent
+    /start races; both UPDATEs commit in the same transaction. True if credited.
+    """
+    if referrer_id == referee_id:
+        return False
+    now = datetime.utcnow()
+    referrer_db_id = select(User.id).where(User.telegram_id == referrer_id).scalar_subquery()
+    stmt = insert(Referral).from_select(
+        ["referrer_id", "referee_id", "referrer_db_id", "created_at"],
+        select(literal(referrer_id), literal(referee_id), referrer_db_id, literal(now))
+        .where(exists().where(User.telegram_id == referrer_id)),
+    )
+    try:
+        if session.execute(stmt).rowcount != 1:
+            session.rollback()
+            return False
+    except IntegrityError:
+        session.rollback()   # already referred
+        return False
+    session.execute(
+        update(User)
+        .where(User.telegram_id == referrer_id)
+        .values(referrals_count=func.coalesce(User.referrals_count, 0) + 1)
+    )
+    session.execute(update(User).where(User.telegram_id == referee_id).values(referred_by=referrer_id))
+    link_referral(session, referrer_id, referee_id)
+    bump_daily(session, now, referrals=1)
+    session.commit()
+    return True
+
+# ===============================================================
+# Analytics aggregates: updated in the same transaction as the User,
+# Referral or Payout write they count, so /stats and /leaderboard read a
+# few rows instead of scanning those tables (see analytics.py).
+# ===============================================================
+
+def _bump(session, model, key: dict, **deltas) -> None:
+    """Add `deltas` to the columns of the `model` row identified by `key`, creating the row if missing."""
+    where = [getattr(model, k) == v for k, v in key.items()]
+    values = {getattr(model, c): func.coalesce(getattr(model, c), 0) + d for c, d in deltas.items()}
+    if session.query(model).filter(*where).update(values, synchronize_session=False):
+        return
+    try:
+        with session.begin_nested():
+            session.execute(insert(model).values(**key, **deltas))
+    except IntegrityError:
+        # another transaction created it first
+        session.query(model).filter(*where).update(values, synchronize_session=False)
+
+def bump_daily(session, when: datetime, **counts) -> None:
+    """Add `counts` (metric=amount) to the totals of `when`'s UTC day and to the all-time totals."""
+    for day in (when.strftime("%Y-%m-%d"), "all"):
+        for metric, by in counts.items():
+            if by:
+                _bump(session, DailyTotal, {"day": day, "metric": metric}, value=by)
+
+def link_referral(session, referrer_id: int, referee_id: int) -> None:
+    """
+    Hang the referee, with whatever downline it already has, under the
+    referrer and the referrer's ancestors (paths up to ANALYTICS_MAX_DEPTH),
+    then bump every ancestor's downline by the paths it gained. Existing
+    paths and self-paths are skipped, so a referral cycle can't double count.
+    """
+    P = ReferralPath
+    up = union_all(
+        select(literal(referrer_id, BigInteger).label("node"), literal(1).label("depth")),
+        select(P.ancestor_id, P.depth + 1).where(P.descendant_id == referrer_id, P.depth < ANALYTICS_MAX_DEPTH),
+    ).subquery()
+    down = union_all(
+        select(literal(referee_id, BigInteger).label("node"), literal(0).label("depth")),
+        select(P.descendant_id, P.depth).where(P.ancestor_id == referee_id, P.depth < ANALYTICS_MAX_DEPTH),
+    ).subquery()
+    depth = up.c.depth + down.c.depth
+    paths = session.execute(
+        select(up.c.node, down.c.node, depth).where(
+            depth <= ANALYTICS_MAX_DEPTH,
+            up.c.node != down.c.node,
+            ~exists().where(P.ancestor_id == up.c.node, P.descendant_id == down.c.node),
+        )
+    ).all()
+    if not paths:
+        return
+    session.execute(insert(P), [{"ancestor_id": a, "descendant_id": d, "depth": n} for a, d, n in paths])
+    for ancestor, gained in Counter(a for a, _, _ in paths).items():
+        _bump(session, ReferrerStats, {"telegram_id": ancestor},
+              direct=1 if ancestor == referrer_id else 0, downline=gained)
+
+def reconcile_referral_counts(batch_size: int = 1000) -> dict:
+    """
+    Recompute users.referrals_count from the referrals table in one streaming
+    pass: referrals made minus REFERRALS_PER_WITHDRAWAL per non-failed referral
+    payout (withdrawals spend referrals). Duplicate referrals per referee are
+    removed first so the unique index can be created. Returns counts.
+    """
+    from config import REFERRALS_PER_WITHDRAWAL
+
+    stats = {"duplicates_removed": 0, "users_checked": 0, "users_fixed": 0}
+    with engine.begin() as conn:
+        keep = select(func.min(Referral.id)).group_by(Referral.referee_id).scalar_subquery()
+        stats["duplicates_removed"] = conn.execute(
+            Referral.__table__.delete().where(Referral.id.not_in(keep))
+        ).rowcount
+    _add_missing_columns()   # retry the unique index now that duplicates are gone
+
+    made = (
+        select(Referral.referrer_id.label("tg"), func.count().label("n"))
+        .group_by(Referral.referrer_id).subquery()
+    )
+    spent = (
+        select(Payout.telegram_id.label("tg"), func.count().label("n"))
+        .where(
+            or_(Payout.kind == "referral", Payout.kind.is_(None)),
+            or_(Payout.status.is_(None), Payout.status != "failed"),   # NULL: paid before the queue existed
+        )
+        .group_by(Payout.telegram_id).subquery()
+    )
+    query = (
+        select(User.telegram_id, User.referrals_count, func.coalesce(made.c.n, 0), func.coalesce(spent.c.n, 0))
+        .outerjoin(made, made.c.tg == User.telegram_id)
+        .outerjoin(spent, spent.c.tg == User.telegram_id)
+    )
+
+    fixes = []
+
+    def _flush():
+        if fixes:
+            with engine.begin() as wconn:
+                wconn.execute(
+                    update(User).where(User.telegram_id == bindparam("tg")).values(referrals_count=bindparam("n")),
+                    fixes,
+                )
+            stats["users_fixed"] += len(fixes)
+            fixes.clear()
+
+    with engine.connect() as conn:
+        rows = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+        for tg, current, n_made, n_spent in rows:
+            stats["users_checked"] += 1
+            expected = max(0, n_made - n_spent * REFERRALS_PER_WITHDRAWAL)
+            if (current or 0) != expected:
+                fixes.append({"tg": tg, "n": expected})
+                if len(fixes) >= batch_size:
+                    _flush()
+    _flush()
+    return stats
+
+# ===============================================================
+# Async access: blocking SQLAlchemy work runs on a small dedicated pool
+# so handlers never stall the event loop on a query or commit.
+# ===============================================================
+
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "4"))
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
+
+def _in_session(fn, args, kwargs):
+    session = SessionLocal()
+    try:
+        return fn(session, *args, **kwargs)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+async def run_db(fn, *args, **kwargs):
+    """Run fn(session, *args, **kwargs) on the DB pool with a fresh session; fn commits itself."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, _in_session, fn, args, kwargs)
+
+# ===============================================================
+# Write-behind: non-critical writes (new users, address updates) from many
+# handlers are coalesced into one transaction every few milliseconds.
+# Balance and Payout writes never go through here - they use run_db().
+# Queued ops must be idempotent: they may run after a synchronous path
+# already wrote the same row.
+# ===============================================================
+
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "50")) / 1000
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "200"))
+
+def _apply_batch(session, ops):
+    try:
+        for fn, args in ops:
+            fn(session, *args)
+        session.commit()
+        return
+    except Exception as e:
+        session.rollback()
+        logger.warning("write-behind batch of %d failed (%s); retrying one by one", len(ops), e)
+    for fn, args in ops:
+        try:
+            fn(session, *args)
+            session.commit()
+        except Exception:
+            session.rollback()
+            logger.exception("write-behind op %s%s dropped", fn.__name__, args)
+
+class WriteBehind:
+    def __init__(self, interval: float, max_rows: int):
+        self.interval = interval
+        self.max_rows = max_rows
+        self._ops = []
+        self._timer = None
+        self._flushing = set()
+
+    def submit(self, fn, *args) -> None:
+        """Queue fn(session, *args) (no commit inside fn) for the next group commit."""
+        self._ops.append((fn, args))
+        if len(self._ops) >= self.max_rows:
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._spawn_flush)
+
+    def _spawn_flush(self) -> None:
+        task = asyncio.get_running_loop().create_task(self._commit())
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _commit(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        ops, self._ops = self._ops, []
+        if ops:
+            await run_db(_apply_batch, ops)
+
+    async def flush(self) -> None:
+        """Return once everything submitted so far is committed, including group commits under way."""
+        in_flight = set(self._flushing)
+        await self._commit()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def close(self) -> None:
+        await self.flush()
+
+write_behind = WriteBehind(WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_ROWS)
@@ -0,0 +1,369 @@
+# distribute.py
+# Campaign-end settlement (manage.py distribute). Unspent referral rewards
+# become "planned" Payout rows; planned rows are merged per address and
+# paid by a pipelined sender that keeps up to DISTRIBUTE_WINDOW transfers
+# in flight on consecutive nonces. Every transfer is signed first and its
+# hash, nonce and raw bytes are committed ("signed") before it is broadcast,
+# so a crash at any point resumes without paying anyone twice: a signed tx
+# is either found mined, re-broadcast byte-for-byte, or - once its nonce
+# was provably used by something else - planned again.
+#
+# Run it with the bot's payout queue stopped: both send from the admin wallet,
+# so run() refuses to start while queue payouts are sending or unconfirmed.
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, update
+
+from config import REFERRALS_PER_WITHDRAWAL, REFERRAL_REWARD_BEAM, DISTRIBUTE_WINDOW
+from db import run_db, bump_daily, User, Payout
+from payouts import _db_fail
+from receipts import receipt_tracker, receipt_ok, receipt_block
+from web3_utils import (
+    chain, nonces, to_wei_tokens, token_balance,
+    sign_transfer, broadcast_raw, simulate_transfer, receipt_or_none,
+)
+
+logger = logging.getLogger("srd_airdrop_bot.distribute")
+
+PLANNED = "planned"
+SIGNED = "signed"
+
+PAGE_SIZE = 500
+BROADCAST_RETRIES = 3
+
+
+# =========================== DB ops ===========================
+def _eligible(session, after: int, limit: int) -> List[User]:
+    return (
+        session.query(User)
+        .filter(
+            User.telegram_id > after,
+            User.bsc_address.isnot(None),
+            User.referrals_count >= REFERRALS_PER_WITHDRAWAL,
+        )
+        .order_by(User.telegram_id)
+        .limit(limit)
+        .all()
+    )
+
+
+def _db_plan(session, after: int, limit: int) -> Tuple[Optional[int], int]:
+    """
+    Turn one keyset page of users' unspent referrals into planned payouts
+    (one row per REFERRALS_PER_WITHDRAWAL, like /withdraw). Returns
+    (last telegram_id of the page or None when done, rows planned).
+    """
+    users = _eligible(session, after, limit)
+    planned = 0
+    for u in users:
+        units = u.referrals_count // REFERRALS_PER_WITHDRAWAL
+        spend = units * REFERRALS_PER_WITHDRAWAL
+        # conditional: a concurrent /withdraw may have spent them already
+        if session.execute(
+            update(User)
+            .where(User.id == u.id, User.referrals_count >= spend)
+            .values(referrals_count=User.referrals_count - spend)
+        ).rowcount != 1:
+            continue
+        for _ in range(units):
+            session.add(Payout(
+                telegram_id=u.telegram_id, user_id=u.id, amount=REFERRAL_REWARD_BEAM,
+                kind="referral", address=u.bsc_address, status=PLANNED,
+            ))
+        planned += units
+    bump_daily(session, datetime.utcnow(), payouts_queued=planned, beam_queued=planned * REFERRAL_REWARD_BEAM)
+    session.commit()
+    return (users[-1].telegram_id if users else None), planned
+
+
+def _db_preview(session, after: int, limit: int) -> Tuple[Optional[int], Dict[str, int]]:
+    """Dry-run counterpart of _db_plan: {address: tokens} for one page, nothing written."""
+    users = _eligible(session, after, limit)
+    amounts: Dict[str, int] = {}
+    for u in users:
+        units = u.referrals_count // REFERRALS_PER_WITHDRAWAL
+        amounts[u.bsc_address] = amounts.get(u.bsc_address, 0) + units * REFERRAL_REWARD_BEAM
+    return (users[-1].telegram_id if users else None), amounts
+
+
+def _db_groups(session, after: str, limit: int) -> List[Tuple[str, List[int], int]]:
+    """Planned rows merged per address, keyset-paged by address: [(address, ids, tokens)]."""
+    addrs = [
+        a for (a,) in session.query(Payout.address)
+        .filter(Payout.status == PLANNED, Payout.address > after)
+        .group_by(Payout.address)
+        .order_by(Payout.address)
+        .limit(limit)
+    ]
+    if not addrs:
+        return []
+    groups: Dict[str, Tuple[List[int], int]] = {a: ([], 0) for a in addrs}
+    rows = session.query(Payout.id, Payout.address, Payout.amount).filter(
+        Payout.status == PLANNED, Payout.address.in_(addrs)
+    )
+    for pid, addr, amount in rows:
+        ids, total = groups[addr]
+        ids.append(pid)
+        groups[addr] = (ids, total + amount)
+    return [(a, ids, total) for a, (ids, total) in groups.items()]
+
+
+def _db_sign(session, ids: List[int], tx_hash: str, nonce: int, raw: str) -> bool:
+    """planned -> signed for all of `ids`, or nothing (someone else touched them)."""
+    n = session.query(Payout).filter(Payout.id.in_(ids), Payout.status == PLANNED).update(
+        {Payout.status: SIGNED, Payout.tx_hash: tx_hash, Payout.nonce: nonce, Payout.raw_tx: raw},
+        synchronize_session=False,
+    )
+    if n != len(ids):
+        session.rollback()
+        return False
+    session.commit()
+    return True
+
+
+def _db_signed(session) -> List[Tuple[str, int, str, List[int]]]:
+    """Signed, unsettled transfers in nonce order: [(tx hash, nonce, raw tx, ids)]."""
+    txs: Dict[str, Tuple[int, str, List[int]]] = {}
+    for p in session.query(Payout).filter_by(status=SIGNED).order_by(Payout.nonce, Payout.id):
+        txs.setdefault(p.tx_hash, (p.nonce, p.raw_tx, []))[2].append(p.id)
+    return [(h, nonce, raw, ids) for h, (nonce, raw, ids) in txs.items()]
+
+
+def _db_confirm(session, ids: List[int], tx_hash: str, block: int) -> int:
+    confirmed = tokens = 0
+    for p in session.query(Payout).filter(Payout.id.in_(ids), Payout.status == SIGNED):
+        p.status = "confirmed"
+        p.confirmed_block = block
+        p.raw_tx = None
+        session.query(User).filter_by(telegram_id=p.telegram_id).update(
+            {User.balance_beam: func.coalesce(User.balance_beam, 0) + p.amount}, synchronize_session=False
+        )
+        confirmed += 1
+        tokens += p.amount
+    bump_daily(session, datetime.utcnow(), payouts_confirmed=confirmed, beam_confirmed=tokens)
+    session.commit()
+    return confirmed
+
+
+def _db_queue_busy(session) -> int:
+    """Payout-queue rows holding admin-wallet nonces that may not be mined yet."""
+    return session.query(func.count(Payout.id)).filter(Payout.status.in_(("sending", "sent"))).scalar()
+
+
+def _db_replan(session, ids: List[int]) -> None:
+    session.query(Payout).filter(Payout.id.in_(ids), Payout.status == SIGNED).update(
+        {Payout.status: PLANNED, Payout.tx_hash: None, Payout.nonce: None, Payout.raw_tx: None},
+        synchronize_session=False,
+    )
+    session.commit()
+
+
+# =========================== Sender ===========================
+class Distributor:
+    def __init__(self, window: int = DISTRIBUTE_WINDOW, page_size: int = PAGE_SIZE):
+        self.window = window
+        self.page_size = page_size
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: set = set()
+        self.stats = {
+            "planned": 0, "txs": 0, "confirmed": 0, "failed": 0, "left": 0,
+            "tokens": 0, "gas": 0, "fee_wei": 0,
+        }
+
+    async def plan(self) -> int:
+        after = 0
+        while True:
+            last, n = await run_db(_db_plan, after, self.page_size)
+            if last is None:
+                break
+            self.stats["planned"] += n
+            after = last
+        logger.info("planned %d payout row(s)", self.stats["planned"])
+        return self.stats["planned"]
+
+    async def run(self) -> dict:
+        """Resume signed transfers, then send every planned row. Returns stats."""
+        busy = await run_db(_db_queue_busy)
+        if busy:
+            raise RuntimeError(
+                f"{busy} payout(s) are sending or awaiting a receipt; "
+                "let the bot settle them and stop its payout queue first"
+            )
+        self._slots = asyncio.Semaphore(self.window)
+        t = time.monotonic()
+        await receipt_tracker.start()
+        progress = asyncio.create_task(self._progress(t))
+        try:
+            await self._recover()
+            after = ""
+            while True:
+                groups = await run_db(_db_groups, after, self.page_size)
+                if not groups:
+                    break
+                for addr, ids, amount in groups:
+                    await self._slots.acquire()
+                    await self._send(addr, ids, amount)
+                after = groups[-1][0]
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            progress.cancel()
+            await receipt_tracker.stop()
+        self.stats["elapsed"] = time.monotonic() - t
+        return self.stats
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, addr: str, ids: List[int], amount: int) -> None:
+        nonce = nonces.allocate()
+        try:
+            tx_hash, raw = await asyncio.to_thread(sign_transfer, addr, amount, nonce)
+            signed = await run_db(_db_sign, ids, tx_hash, nonce, raw)
+        except Exception:
+            nonces.release(nonce)
+            self._slots.release()
+            raise
+        if not signed:
+            nonces.release(nonce)
+            self._slots.release()
+            return
+        self.stats["txs"] += 1
+        self.stats["tokens"] += amount
+        self._spawn(self._broadcast_and_settle(tx_hash, nonce, raw, ids))
+
+    async def _broadcast_and_settle(self, tx_hash: str, nonce: int, raw: str, ids: List[int]) -> None:
+        try:
+            for attempt in range(BROADCAST_RETRIES):
+                try:
+                    await asyncio.to_thread(broadcast_raw, raw)
+                    break
+                except Exception as e:
+                    if "nonce too low" in str(e).lower():
+                        # the nonce is used: by this very tx (an earlier attempt landed) or by another one
+                        await self._resolve_used_nonce(tx_hash, ids)
+                        return
+                    logger.warning("broadcast %s (nonce %s) failed: %s", tx_hash, nonce, e)
+                    await asyncio.sleep(2 ** attempt)
+            else:
+                # stays "signed": the next run re-broadcasts or re-plans it
+                self.stats["left"] += len(ids)
+                return
+            try:
+                receipt = await receipt_tracker.track(tx_hash)
+            except TimeoutError as e:
+                logger.warning("%s; left for the next run", e)
+                self.stats["left"] += len(ids)
+                return
+            await self._settle(tx_hash, ids, receipt)
+        finally:
+            self._slots.release()
+
+    async def _settle(self, tx_hash: str, ids: List[int], receipt) -> None:
+        self.stats["gas"] += int(receipt["gasUsed"])
+        self.stats["fee_wei"] += int(receipt["gasUsed"]) * int(receipt.get("effectiveGasPrice", 0))
+        if receipt_ok(receipt):
+            self.stats["confirmed"] += await run_db(_db_confirm, ids, tx_hash, receipt_block(receipt))
+        else:
+            self.stats["failed"] += len(await run_db(_db_fail, ids, f"distribution reverted: {tx_hash}"))
+
+    async def _resolve_used_nonce(self, tx_hash: str, ids: List[int]) -> None:
+        receipt = await asyncio.to_thread(receipt_or_none, tx_hash)
+        if receipt is not None:
+            await self._settle(tx_hash, ids, receipt)
+        else:
+            # another tx took the nonce, so this signed tx can never be mined
+            nonces.resync()
+            await run_db(_db_replan, ids)
+            logger.warning("%s lost its nonce; re-planned %d row(s)", tx_hash, len(ids))
+
+    async def _recover(self) -> None:
+        """Settle, re-broadcast or re-plan transfers signed by an interrupted run."""
+        signed = await run_db(_db_signed)
+        if not signed:
+            return
+        logger.info("resuming %d signed transfer(s)", len(signed))
+        c = chain()
+        mined_nonce = await asyncio.to_thread(c.w3.eth.get_transaction_count, c.account.address, "latest")
+        pending_nonce = await asyncio.to_thread(c.w3.eth.get_transaction_count, c.account.address, "pending")
+        replanned = 0
+        held = set()
+        for tx_hash, nonce, raw, ids in signed:
+            receipt = await asyncio.to_thread(receipt_or_none, tx_hash)
+            if receipt is not None:
+                await self._settle(tx_hash, ids, receipt)
+            elif nonce < mined_nonce:
+                await run_db(_db_replan, ids)
+                replanned += len(ids)
+            else:
+                await self._slots.acquire()
+                self.stats["txs"] += 1
+                held.add(nonce)
+                self._spawn(self._broadcast_and_settle(tx_hash, nonce, raw, ids))
+        if replanned:
+            logger.info("re-planned %d row(s) whose nonce was used by another tx", replanned)
+        # the re-broadcasts may not have reached the node yet, so its pending
+        # count can't be trusted: allocate past them and fill any holes below
+        nonces.resync()
+        if held:
+            await asyncio.to_thread(nonces.advance_to, max(held) + 1)
+            for nonce in range(max(mined_nonce, pending_nonce), max(held)):
+                if nonce not in held:
+                    nonces.release(nonce)
+
+    async def _progress(self, started: float, every: float = 10.0) -> None:
+        while True:
+            await asyncio.sleep(every)
+            elapsed = time.monotonic() - started
+            logger.info(
+                "distribute: %d tx sent, %d confirmed (%.2f tx/s), %d in flight, gas %d",
+                self.stats["txs"], self.stats["confirmed"], self.stats["confirmed"] / elapsed,
+                len(self._tasks), self.stats["gas"],
+            )
+
+
+async def dry_run(page_size: int = PAGE_SIZE) -> dict:
+    """
+    Everything but the writes: plan in memory, merge per address, and
+    simulate each transfer against the configured RPC (point BSC_RPC at a
+    local fork for a rehearsal). Returns totals, including the admin balance.
+    """
+    amounts: Dict[str, int] = {}
+    after = 0
+    while True:
+        last, page = await run_db(_db_preview, after, page_size)
+        if last is None:
+            break
+        for addr, n in page.items():
+            amounts[addr] = amounts.get(addr, 0) + n
+        after = last
+    for addr, ids, total in await _all_planned_groups(page_size):
+        amounts[addr] = amounts.get(addr, 0) + total
+
+    stats = {"recipients": len(amounts), "tokens": sum(amounts.values()), "gas": 0, "reverts": 0}
+    for addr, n in amounts.items():
+        try:
+            stats["gas"] += await asyncio.to_thread(simulate_transfer, addr, n)
+        except Exception as e:
+            stats["reverts"] += 1
+            logger.warning("transfer of %d to %s would fail: %s", n, addr, e)
+    stats["balance_wei"] = await asyncio.to_thread(token_balance)
+    stats["needed_wei"] = await asyncio.to_thread(to_wei_tokens, stats["tokens"])
+    return stats
+
+
+async def _all_planned_groups(page_size: int) -> List[Tuple[str, List[int], int]]:
+    out, after = [], ""
+    while True:
+        groups = await run_db(_db_groups, after, page_size)
+        if not groups:
+            return out
+        out.extend(groups)
+        after = groups[-1][0]
@@ -0,0 +1,72 @@
+# fees.py
+# Cached gas/fee oracle. Fee data is sampled from eth_feeHistory at most
+# once per FEE_CACHE_SECONDS (about one block) and shared by every payout;
+# gas limits are estimated once per call shape and reused.
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable
+
+from config import (
+    FEE_CACHE_SECONDS,
+    FEE_MIN_PRIORITY_GWEI,
+    FEE_MAX_GWEI,
+    FEE_BUMP_PERCENT,
+    GAS_LIMIT_MARGIN,
+)
+
+logger = logging.getLogger("srd_airdrop_bot.fees")
+
+GWEI = 10 ** 9
+
+
+class FeeOracle:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fees = None
+        self._fetched_at = 0.0
+        self._gas: Dict[Hashable, int] = {}
+
+    def fees(self, w3) -> Dict[str, int]:
+        """{"maxFeePerGas", "maxPriorityFeePerGas"} for the next block, cached ~one block."""
+        with self._lock:
+            if self._fees is None or time.monotonic() - self._fetched_at > FEE_CACHE_SECONDS:
+                self._fees = self._sample(w3)
+                self._fetched_at = time.monotonic()
+            return dict(self._fees)
+
+    @staticmethod
+    def _sample(w3) -> Dict[str, int]:
+        min_tip = int(FEE_MIN_PRIORITY_GWEI * GWEI)
+        cap = int(FEE_MAX_GWEI * GWEI)
+        try:
+            hist = w3.eth.fee_history(5, "latest", [50])
+            base = int(hist["baseFeePerGas"][-1])   # next block's base fee
+            tips = sorted(int(r[0]) for r in hist.get("reward", []) if r)
+            tip = max(min_tip, tips[len(tips) // 2] if tips else 0)
+        except Exception as e:
+            # nodes without feeHistory: treat gas price as the whole fee
+            logger.info("eth_feeHistory unavailable (%s); using gas price", e)
+            base, tip = 0, max(min_tip, int(w3.eth.gas_price))
+        max_fee = min(cap, 2 * base + tip)
+        return {"maxFeePerGas": max(max_fee, tip), "maxPriorityFeePerGas": tip}
+
+    def gas_limit(self, key: Hashable, estimate: Callable[[], int]) -> int:
+        """Gas limit for call shape `key`; `estimate()` runs only the first time."""
+        limit = self._gas.get(key)
+        if limit is None:
+            limit = int(estimate() * GAS_LIMIT_MARGIN)
+            self._gas[key] = limit
+        return limit
+
+    def bump(self, w3, tx_fees: Dict[str, int]) -> Dict[str, int]:
+        """Fees for replacing a stuck tx: at least FEE_BUMP_PERCENT above the old ones, or today's fees."""
+        now = self.fees(w3)
+        factor = 1 + FEE_BUMP_PERCENT / 100
+        bumped = {k: max(now[k], int(tx_fees[k] * factor) + 1) for k in now}
+        bumped["maxFeePerGas"] = max(bumped["maxFeePerGas"], bumped["maxPriorityFeePerGas"])
+        return bumped
+
+
+fee_oracle = FeeOracle()
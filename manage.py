@@ -0,0 +1,171 @@
+# manage.py
+# Maintenance commands that run outside the bot process.
+#
+#   python manage.py reconcile-referrals
+#   python manage.py broadcast --text "<b>New task</b> is live" | --file msg.html | --resume ID
+#   python manage.py distribute [--dry-run] [--window 64] [--no-plan]
+#   python manage.py reconcile-balances [--out report.csv] [--batch-size 2000]
+#   python manage.py analytics-backfill
+
+import argparse
+import asyncio
+import logging
+
+from db import init_db, reconcile_referral_counts
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = logging.getLogger("srd_airdrop_bot.manage")
+
+
+def cmd_reconcile_referrals(args):
+    stats = reconcile_referral_counts(batch_size=args.batch_size)
+    logger.info(
+        "referrals reconciled: %d duplicate referral(s) removed, %d user(s) checked, %d counter(s) fixed",
+        stats["duplicates_removed"], stats["users_checked"], stats["users_fixed"],
+    )
+
+
+def cmd_broadcast(args):
+    from telegram.ext import ExtBot
+    from broadcast import create_broadcast, run_broadcast
+    from config import BOT_TOKEN, BOT_API_BASE_URL
+    from ratelimit import TelegramRateLimiter
+
+    async def _run():
+        if args.resume:
+            broadcast_id = args.resume
+        else:
+            text = args.text
+            if args.file:
+                with open(args.file, encoding="utf-8") as f:
+                    text = f.read()
+            if not text:
+                raise SystemExit("broadcast: --text, --file or --resume is required")
+            broadcast_id = await create_broadcast(text)
+            logger.info("broadcast %d created", broadcast_id)
+
+        kwargs = {}
+        if BOT_API_BASE_URL:
+            kwargs = {"base_url": f"{BOT_API_BASE_URL}/bot", "base_file_url": f"{BOT_API_BASE_URL}/file/bot"}
+        async with ExtBot(BOT_TOKEN, rate_limiter=TelegramRateLimiter(args.rate), **kwargs) as bot:
+            b = await run_broadcast(bot, broadcast_id, priority="normal", concurrency=args.concurrency, chunk=args.chunk)
+        logger.info("broadcast %d: sent %d, blocked %d, failed %d", b.id, b.sent, b.blocked, b.failed)
+
+    asyncio.run(_run())
+
+
+def cmd_distribute(args):
+    from distribute import Distributor, dry_run
+
+    if args.dry_run:
+        stats = asyncio.run(dry_run(args.page_size))
+        logger.info(
+            "dry run: %d recipient(s), %d BEAM, %d gas, %d would revert; admin balance %d wei, needed %d wei%s",
+            stats["recipients"], stats["tokens"], stats["gas"], stats["reverts"],
+            stats["balance_wei"], stats["needed_wei"],
+            "" if stats["balance_wei"] >= stats["needed_wei"] else " - INSUFFICIENT BALANCE",
+        )
+        return
+
+    async def _run():
+        d = Distributor(window=args.window, page_size=args.page_size)
+        if not args.no_plan:
+            await d.plan()
+        return await d.run()
+
+    try:
+        stats = asyncio.run(_run())
+    except RuntimeError as e:
+        raise SystemExit(f"distribute: {e}")
+    elapsed = max(stats["elapsed"], 1e-9)
+    logger.info(
+        "distributed: %d tx (%d row(s) confirmed, %d failed, %d left for the next run), %d BEAM, "
+        "%.1fs, %.2f tx/s, gas %d, fees %.6f BNB",
+        stats["txs"], stats["confirmed"], stats["failed"], stats["left"], stats["tokens"],
+        elapsed, stats["txs"] / elapsed, stats["gas"], stats["fee_wei"] / 10 ** 18,
+    )
+
+
+def cmd_reconcile_balances(args):
+    import sys
+    from reconcile import reconcile_balances
+
+    out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+    try:
+        stats = reconcile_balances(out, batch_size=args.batch_size, parallel=args.parallel)
+    finally:
+        if args.out:
+            out.close()
+    logger.info(
+        "balances reconciled: %d ledger mismatch(es) (%.1fs); %d address(es) read on-chain, "
+        "%d below paid, %d unreadable (%.1fs)",
+        stats["ledger"], stats["ledger_seconds"], stats["addresses"],
+        stats["below_paid"], stats["unreadable"], stats["chain_seconds"],
+    )
+
+
+def cmd_analytics_backfill(args):
+    from analytics import backfill
+
+    stats = backfill()
+    logger.info(
+        "analytics rebuilt: %d referral path(s), %d referrer(s), %d daily total row(s)",
+        stats["paths"], stats["referrers"], stats["daily_rows"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SRD airdrop bot maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("reconcile-referrals", help="recompute users.referrals_count from the referrals table")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=cmd_reconcile_referrals)
+
+    from config import TG_GLOBAL_RATE, BROADCAST_CHUNK, BROADCAST_CONCURRENCY
+
+    p = sub.add_parser("broadcast", help="message every user (interrupted runs resume with --resume ID)")
+    p.add_argument("--text", help="message, HTML allowed")
+    p.add_argument("--file", help="read the message from this file")
+    p.add_argument("--resume", type=int, metavar="ID", help="continue an interrupted broadcast")
+    p.add_argument("--rate", type=float, default=TG_GLOBAL_RATE,
+                   help="messages/s; a running bot shares Telegram's budget, so lower this while it is up")
+    p.add_argument("--concurrency", type=int, default=BROADCAST_CONCURRENCY)
+    p.add_argument("--chunk", type=int, default=BROADCAST_CHUNK, help="users read per page")
+    p.set_defaults(func=cmd_broadcast)
+
+    p = sub.add_parser("reconcile-balances", help="audit balance_beam and on-chain balances against confirmed payouts")
+    p.add_argument("--out", help="CSV file for discrepancies (default: stdout)")
+    p.add_argument("--batch-size", type=int, default=2000, help="addresses per multicall")
+    p.add_argument("--parallel", type=int, default=4, help="multicalls in flight")
+    p.set_defaults(func=cmd_reconcile_balances)
+
+    from config import DISTRIBUTE_WINDOW
+
+    p = sub.add_parser(
+        "distribute",
+        help="pay all unspent referral rewards (stop the bot's payouts first); safe to re-run after a crash",
+    )
+    p.add_argument("--dry-run", action="store_true",
+                   help="plan and simulate only, no DB writes or transactions (point BSC_RPC at a local fork)")
+    p.add_argument("--window", type=int, default=DISTRIBUTE_WINDOW, help="transfers in flight")
+    p.add_argument("--page-size", type=int, default=500)
+    p.add_argument("--no-plan", action="store_true", help="only resume / send rows planned earlier")
+    p.set_defaults(func=cmd_distribute)
+
+    p = sub.add_parser(
+        "analytics-backfill",
+        help="rebuild referral trees, referrer counts and daily totals from referrals and payouts (bot stopped)",
+    )
+    p.set_defaults(func=cmd_analytics_backfill)
+
+    args = parser.parse_args()
+    init_db()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
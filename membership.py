@@ -0,0 +1,118 @@
+# membership.py
+# Channel-membership verification: channel ids are resolved once (failed
+# lookups are retried with backoff), all channels are checked concurrently,
+# and results are cached per (user, channel) - briefly for "not joined",
+# longer for "joined".
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from config import MEMBERSHIP_TTL_OK, MEMBERSHIP_TTL_FAIL
+
+logger = logging.getLogger("srd_airdrop_bot.membership")
+
+# drop expired entries once the cache grows past this
+CACHE_PRUNE_AT = 50000
+
+# a channel that failed to resolve is retried after this delay, doubling up to the max (seconds)
+RESOLVE_RETRY_MIN = 5.0
+RESOLVE_RETRY_MAX = 300.0
+
+
+class ChannelResult(NamedTuple):
+    channel: Union[int, str]     # as configured in REQUIRED_CHANNELS
+    label: str                   # "@name" or numeric chat id, for display
+    ok: bool
+    status: str                  # member status, or "ERROR"
+    cached: bool
+    error: Optional[str] = None
+
+
+def _is_numeric_id(channel: Union[int, str]) -> bool:
+    return isinstance(channel, int) or (str(channel).startswith("-100") and str(channel)[4:].isdigit())
+
+
+class MembershipVerifier:
+    def __init__(self, channels: List[Union[int, str]]):
+        self.channels = list(channels)
+        self._chat_ids: Dict[Union[int, str], int] = {}
+        self._resolving: Dict[Union[int, str], asyncio.Task] = {}        # one lookup per channel, shared
+        self._failed: Dict[Union[int, str], Tuple[float, float]] = {}   # channel -> (retry delay, retry at)
+        self._cache: Dict[Tuple[int, int], Tuple[bool, str, float]] = {}
+
+    @staticmethod
+    def label(channel: Union[int, str]) -> str:
+        if _is_numeric_id(channel):
+            return str(channel)
+        return "@" + str(channel).lstrip("@")
+
+    async def resolve(self, bot) -> None:
+        """
+        Look up chat ids for the configured channels. Concurrent callers share
+        one lookup per channel, and a failed channel is only retried after a
+        growing delay; until then its checks report "channel not resolved".
+        """
+        now = time.monotonic()
+        for ch in self.channels:
+            if ch in self._chat_ids or ch in self._resolving:
+                continue
+            if ch in self._failed and self._failed[ch][1] > now:
+                continue
+            self._resolving[ch] = asyncio.create_task(self._resolve_one(bot, ch))
+        if self._resolving:
+            # shielded: a cancelled caller must not cancel a lookup others wait on
+            await asyncio.gather(*(asyncio.shield(t) for t in list(self._resolving.values())))
+
+    async def _resolve_one(self, bot, ch) -> None:
+        target = int(ch) if _is_numeric_id(ch) else "@" + str(ch).lstrip("@")
+        try:
+            chat = await bot.get_chat(target)
+        except Exception as e:
+            delay = min(self._failed[ch][0] * 2, RESOLVE_RETRY_MAX) if ch in self._failed else RESOLVE_RETRY_MIN
+            self._failed[ch] = (delay, time.monotonic() + delay)
+            logger.warning("could not resolve channel %s: %s (retry in %.0fs)", ch, e, delay)
+        else:
+            self._chat_ids[ch] = chat.id
+            self._failed.pop(ch, None)
+        finally:
+            self._resolving.pop(ch, None)
+
+    async def _check_one(self, bot, channel, user_id: int, now: float) -> ChannelResult:
+        label = self.label(channel)
+        chat_id = self._chat_ids.get(channel)
+        if chat_id is None:
+            return ChannelResult(channel, label, False, "ERROR", False, "channel not resolved")
+
+        hit = self._cache.get((user_id, chat_id))
+        if hit and hit[2] > now:
+            return ChannelResult(channel, label, hit[0], hit[1], True)
+
+        try:
+            member = await bot.get_chat_member(chat_id, user_id)
+        except Exception as e:
+            # errors are never cached
+            return ChannelResult(channel, label, False, "ERROR", False, str(e))
+
+        status = str(member.status).lower()
+        ok = status not in {"left", "kicked"}
+        ttl = MEMBERSHIP_TTL_OK if ok else MEMBERSHIP_TTL_FAIL
+        self._cache[(user_id, chat_id)] = (ok, status, now + ttl)
+        return ChannelResult(channel, label, ok, status, False)
+
+    async def check(self, bot, user_id: int) -> List[ChannelResult]:
+        """Per-channel results for `user_id`, all channels queried concurrently."""
+        await self.resolve(bot)
+        now = time.monotonic()
+        if len(self._cache) > CACHE_PRUNE_AT:
+            self._cache = {k: v for k, v in self._cache.items() if v[2] > now}
+        return list(await asyncio.gather(*(self._check_one(bot, ch, user_id, now) for ch in self.channels)))
+
+    async def verify_all(self, bot, user_id: int) -> bool:
+        """True only if ALL required channels pass."""
+        results = await self.check(bot, user_id)
+        for r in results:
+            if r.error:
+                logger.warning("verify failed for %s: %s", r.channel, r.error)
+        return all(r.ok for r in results)
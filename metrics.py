@@ -0,0 +1,355 @@
+# metrics.py
+# In-process metrics in the Prometheus text format, without extra
+# dependencies: handler latency, Telegram API calls (hooked in the rate
+# limiter), web3 RPCs (hooked in rpc_pool) and SQL statements (SQLAlchemy
+# engine events), plus event-loop lag. Served on METRICS_PORT at /metrics;
+# with METRICS_PROFILE on, /debug/profile shows where a stack sampler
+# caught the event-loop thread busy.
+
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as _Tally
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import METRICS_HOST, METRICS_PORT, METRICS_PROFILE, METRICS_PROFILE_INTERVAL
+
+logger = logging.getLogger("srd_airdrop_bot.metrics")
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_le(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()   # observed from the loop, RPC threads and DB threads
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels: str, by: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + by
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, by: float = 1) -> None:
+        self.inc(*labels, by=-by)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self._values: Dict[tuple, list] = {}   # labels -> [per-bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            v = self._values.get(labels)
+            if v is None:
+                v = self._values[labels] = [0] * (len(self.buckets) + 2)
+            v[bisect_left(self.buckets, value)] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = self.header()
+        for k, v in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, v):
+                cumulative += n
+                le = 'le="%s"' % _fmt_le(bound)
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {v[-2]}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {v[-1]}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+# callables returning extra exposition lines at scrape time (cache stats, RPC endpoint scores)
+COLLECTORS: List[Callable[[], List[str]]] = []
+
+handler_seconds = Histogram("bot_handler_seconds", "Update handler latency", ("handler",))
+handler_inflight = Gauge("bot_handler_inflight", "Handlers currently running", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Handlers that raised", ("handler",))
+telegram_seconds = Histogram("telegram_api_seconds", "Bot API call latency, excluding rate-limit waits", ("endpoint",))
+telegram_errors = Counter("telegram_api_errors_total", "Bot API calls that raised", ("endpoint",))
+telegram_inflight = Gauge("telegram_api_inflight", "Bot API calls in flight")
+rpc_seconds = Histogram("rpc_seconds", "JSON-RPC call latency (hedging and failover included)", ("method",))
+rpc_errors = Counter("rpc_errors_total", "JSON-RPC calls that raised", ("method",))
+rpc_inflight = Gauge("rpc_inflight", "JSON-RPC calls in flight")
+rpc_endpoint_seconds = Histogram("rpc_endpoint_seconds", "HTTP round-trip latency per RPC node", ("url",))
+db_seconds = Histogram("db_statement_seconds", "SQL statement latency", ("op",))
+db_errors = Counter("db_statement_errors_total", "SQL statements that raised", ("op",))
+db_commits = Counter("db_commits_total", "Transactions committed")
+loop_lag = Gauge("event_loop_lag_seconds", "How late the last event-loop wake-up was")
+loop_lag_max = Gauge("event_loop_lag_max_seconds", "Worst event-loop lag since start")
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in REGISTRY:
+        lines.extend(m.render())
+    for collect in COLLECTORS:
+        try:
+            lines.extend(collect())
+        except Exception as e:
+            logger.warning("metrics collector %s failed: %s", getattr(collect, "__name__", collect), e)
+    return "\n".join(lines) + "\n"
+
+
+def dict_collector(name: str, stats: Callable[[], dict], help: str = "") -> None:
+    """Export the numeric values of `stats()` as gauges `<name>_<key>`."""
+    def _collect() -> List[str]:
+        out = []
+        for k, v in stats().items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                out += [f"# HELP {name}_{k} {help or name}", f"# TYPE {name}_{k} gauge", f"{name}_{k} {v}"]
+        return out
+    _collect.__name__ = name
+    COLLECTORS.append(_collect)
+
+
+def rows_collector(name: str, rows: Callable[[], List[dict]], label: str, help: str = "") -> None:
+    """Like dict_collector for a list of dicts, one series per row labelled by row[label]."""
+    def _collect() -> List[str]:
+        series: Dict[str, List[str]] = {}
+        for row in rows():
+            for k, v in row.items():
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    series.setdefault(k, []).append(f'{name}_{k}{{{label}="{row[label]}"}} {v}')
+        out = []
+        for k, lines in series.items():
+            out += [f"# HELP {name}_{k} {help or name}", f"# TYPE {name}_{k} gauge"] + lines
+        return out
+    _collect.__name__ = name
+    COLLECTORS.append(_collect)
+
+
+# =========================== Hooks ===========================
+def instrument_handler(name: str, callback):
+    """Wrap a PTB handler callback with latency / in-flight / error metrics."""
+    @functools.wraps(callback)
+    async def _wrapped(update, context):
+        handler_inflight.inc(name)
+        t = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - t, name)
+            handler_inflight.dec(name)
+    return _wrapped
+
+
+def instrument_application(app) -> None:
+    """Wrap every registered handler's callback (call after all add_handler calls)."""
+    for handlers in app.handlers.values():
+        for h in handlers:
+            h.callback = instrument_handler(getattr(h.callback, "__name__", type(h).__name__), h.callback)
+
+
+async def observe_telegram(endpoint: str, coro):
+    telegram_inflight.inc()
+    t = time.perf_counter()
+    try:
+        return await coro
+    except Exception:
+        telegram_errors.inc(endpoint)
+        raise
+    finally:
+        telegram_seconds.observe(time.perf_counter() - t, endpoint)
+        telegram_inflight.dec()
+
+
+def observe_rpc(method: str, call: Callable[[], Any]) -> Any:
+    rpc_inflight.inc()
+    t = time.perf_counter()
+    try:
+        resp = call()
+    except Exception:
+        rpc_errors.inc(method)
+        raise
+    else:
+        # a batch is a list of responses; it counts as failed if any call in it did
+        if any("error" in r for r in resp) if isinstance(resp, list) else "error" in resp:
+            rpc_errors.inc(method)
+        return resp
+    finally:
+        rpc_seconds.observe(time.perf_counter() - t, method)
+        rpc_inflight.dec()
+
+
+def instrument_engine(engine) -> None:
+    """Time every SQL statement run through `engine` and count commits."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_t", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["_metrics_t"].pop()
+        db_seconds.observe(time.perf_counter() - started, _sql_op(statement))
+
+    @event.listens_for(engine, "commit")
+    def _commit(conn):
+        db_commits.inc()
+
+    @event.listens_for(engine, "handle_error")
+    def _error(ctx):
+        stack = ctx.connection.info.get("_metrics_t") if ctx.connection is not None else None
+        if stack:
+            stack.pop()
+        db_errors.inc(_sql_op(ctx.statement or ""))
+
+
+def _sql_op(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+
+# =========================== Event loop ===========================
+async def _watch_loop_lag() -> None:
+    worst = 0.0
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.perf_counter() - t - LOOP_LAG_INTERVAL)
+        loop_lag.set(lag)
+        if lag > worst:
+            worst = lag
+            loop_lag_max.set(worst)
+
+
+class StackSampler:
+    """
+    Samples the event-loop thread's stack every `interval` seconds from a
+    daemon thread and tallies the samples where it was busy (not parked in
+    the selector). The most common stacks are what is blocking the loop.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self._stacks: _Tally = _Tally()
+        self._thread_id: Optional[int] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self._thread_id = threading.get_ident()
+        threading.Thread(target=self._run, name="stack-sampler", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack[0].startswith("selectors.py:"):
+                continue   # idle, waiting for I/O
+            self._stacks[";".join(reversed(stack))] += 1
+
+    def report(self, top: int = 30) -> str:
+        busy = sum(self._stacks.values())
+        lines = [f"samples={self.samples} busy={busy} interval={self.interval}s"]
+        for stack, n in self._stacks.most_common(top):
+            lines.append(f"{n} {stack}")
+        return "\n".join(lines) + "\n"
+
+
+sampler: Optional[StackSampler] = None
+
+
+# =========================== HTTP endpoint ===========================
+async def _serve_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request_line.decode("latin-1").split(" ")[1] if request_line else ""
+        if path == "/metrics":
+            status, body = "200 OK", render()
+        elif path == "/debug/profile" and sampler is not None:
+            status, body = "200 OK", sampler.report()
+        else:
+            status, body = "404 Not Found", ""
+        data = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+    except (ConnectionError, IndexError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start(port: int = METRICS_PORT) -> None:
+    """Start the loop-lag watcher, the optional sampler and the /metrics server (port 0 = off)."""
+    global sampler
+    if not port:
+        return
+    asyncio.get_running_loop().create_task(_watch_loop_lag())
+    if METRICS_PROFILE and sampler is None:
+        sampler = StackSampler(METRICS_PROFILE_INTERVAL)
+        sampler.start()
+    await asyncio.start_server(_serve_http, METRICS_HOST, port)
+    logger.info("metrics on http://%s:%d/metrics%s", METRICS_HOST, port, " (+ /debug/profile)" if sampler else "")
@@ -0,0 +1,495 @@
+# payouts.py
+# Durable payout queue: handlers record a "queued" Payout row and return
+# immediately; a background worker broadcasts the transfer off the event
+# loop, and the receipt tracker settles it and notifies the user.
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func
+from telegram.constants import ParseMode
+
+from config import (
+    REFERRALS_PER_WITHDRAWAL,
+    PAYOUT_MAX_IN_FLIGHT,
+    DISPERSE_CONTRACT,
+    PAYOUT_BATCH_SIZE,
+    PAYOUT_BATCH_WINDOW,
+    FEE_MAX_REPRICES,
+    STUCK_SWEEP_INTERVAL,
+)
+from db import run_db, bump_daily, User, Payout, RewardClaim
+from user_cache import user_cache
+from receipts import receipt_tracker, receipt_ok, receipt_block
+from web3_utils import (
+    sign_payout, send_signed, broadcast_raw, reprice, forget, nonces, pending_nonce, mined_nonce, receipt_or_none,
+    is_stale_nonce, TxRejected, SignedTx, disperse_allowance, sign_disperse_approval, to_wei_tokens,
+)
+
+logger = logging.getLogger("srd_airdrop_bot.payouts")
+
+SEND_RETRIES = 2   # re-signs after a stale-nonce rejection
+
+
+def queue_payout(session, user: User, kind: str, amount: int, address: str) -> Payout:
+    """Persist a queued payout for `user`. Caller commits, then calls payout_queue.enqueue()."""
+    payout = Payout(
+        telegram_id=user.telegram_id,
+        user_id=user.id,
+        amount=amount,
+        kind=kind,
+        address=address,
+        status="queued",
+    )
+    session.add(payout)
+    bump_daily(session, datetime.utcnow(), payouts_queued=1, beam_queued=amount)
+    return payout
+
+
+# =========================== DB ops ===========================
+# Blocking session work; the worker calls these through db.run_db().
+
+def _db_load_pending(session):
+    # a tx is recorded as "sent" before it is broadcast, so "sending" rows were
+    # interrupted before anything could reach a node: queue them again
+    n = session.query(Payout).filter_by(status="sending").update({Payout.status: "queued"}, synchronize_session=False)
+    session.commit()
+    if n:
+        logger.info("requeued %d payout(s) interrupted before broadcast", n)
+    pending = [p.id for p in session.query(Payout).filter_by(status="queued").order_by(Payout.id)]
+    # signed before the restart, maybe broadcast: send again and wait for their receipts
+    sent = {}
+    for p in session.query(Payout).filter_by(status="sent"):
+        sent.setdefault(p.tx_hash, (p.raw_tx, p.nonce, []))[2].append(p.id)
+    return pending, sent
+
+
+def _db_queued_ids(session) -> List[int]:
+    return [pid for (pid,) in session.query(Payout.id).filter_by(status="queued").order_by(Payout.id)]
+
+
+def _db_claim(session, ids: List[int]) -> List[Payout]:
+    # one conditional UPDATE per row: a row picked up twice (enqueue + DB poll) is claimed once
+    claimed = [
+        pid for pid in ids
+        if session.query(Payout)
+        .filter(Payout.id == pid, Payout.status == "queued")
+        .update({Payout.status: "sending"}, synchronize_session=False) == 1
+    ]
+    session.commit()
+    if not claimed:
+        return []
+    return session.query(Payout).filter(Payout.id.in_(claimed)).order_by(Payout.id).all()
+
+
+def _db_mark_sent(session, ids: List[int], tx_hash: str, nonce: int, raw: str) -> None:
+    """Record the signed tx before it is broadcast, so a crash or an unclear send never loses it."""
+    for p in session.query(Payout).filter(Payout.id.in_(ids)):
+        if p.tx_hash and p.tx_hash != tx_hash and p.nonce == nonce:
+            # a replacement: the earlier hash may still be the one that mines
+            known = p.replaced.split(",") if p.replaced else []
+            if p.tx_hash not in known:
+                p.replaced = ",".join(known + [p.tx_hash])
+        p.tx_hash, p.nonce, p.raw_tx, p.status = tx_hash, nonce, raw, "sent"
+    session.commit()
+
+
+def _db_fail(session, ids: List[int], err: str) -> List[Payout]:
+    payouts = session.query(Payout).filter(Payout.id.in_(ids)).all()
+    bump_daily(session, datetime.utcnow(), payouts_failed=sum(p.status != "failed" for p in payouts))
+    for p in payouts:
+        p.status = "failed"
+        p.error = err[:255]
+        if p.kind == "welcome":
+            # release the one-time claim so the user can submit again
+            session.query(RewardClaim).filter_by(payout_id=p.id).delete(synchronize_session=False)
+        elif p.kind == "referral":
+            # give the referrals back so /withdraw can be retried
+            session.query(User).filter_by(telegram_id=p.telegram_id).update(
+                {User.referrals_count: func.coalesce(User.referrals_count, 0) + REFERRALS_PER_WITHDRAWAL},
+                synchronize_session=False,
+            )
+    session.commit()
+    return payouts
+
+
+def _db_confirm(session, ids: List[int], tx_hash: str, block: int) -> List[Payout]:
+    payouts = session.query(Payout).filter(Payout.id.in_(ids), Payout.status.in_(("sent", "stuck"))).all()
+    for p in payouts:
+        p.status = "confirmed"
+        p.tx_hash = tx_hash   # the mined one, which may be an earlier hash than a replacement
+        p.confirmed_block = block
+        p.raw_tx = None
+        p.replaced = None
+        session.query(User).filter_by(telegram_id=p.telegram_id).update(
+            {User.balance_beam: func.coalesce(User.balance_beam, 0) + p.amount}, synchronize_session=False
+        )
+    bump_daily(
+        session, datetime.utcnow(), payouts_confirmed=len(payouts), beam_confirmed=sum(p.amount for p in payouts)
+    )
+    session.commit()
+    return payouts
+
+
+def _db_stuck(session) -> List[Tuple[List[int], List[str], Optional[int], Optional[str]]]:
+    """Stuck payouts grouped per tx: (ids, every hash signed for the nonce, nonce, raw tx)."""
+    groups = {}
+    for p in session.query(Payout).filter_by(status="stuck").order_by(Payout.id):
+        g = groups.setdefault(p.tx_hash, ([], [p.tx_hash] + (p.replaced.split(",") if p.replaced else []),
+                                          p.nonce, p.raw_tx))
+        g[0].append(p.id)
+    return list(groups.values())
+
+
+def _db_mark_stuck(session, ids: List[int], err: str) -> None:
+    session.query(Payout).filter(Payout.id.in_(ids)).update(
+        {Payout.status: "stuck", Payout.error: err[:255]}, synchronize_session=False
+    )
+    session.commit()
+
+
+class PayoutQueue:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._poll_task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._known: set = set()   # ids queued here and not yet claimed
+        self._inflight: set = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._bot = None
+        self._allowance = 0                              # disperse allowance left, as last read
+        self._approval: Optional[SignedTx] = None         # approve tx sent but not yet mined
+        self._allowance_lock: Optional[asyncio.Lock] = None
+
+    def enqueue(self, payout_id: int) -> None:
+        if self._queue is None:
+            # worker not started yet (or runs in another process); it picks queued rows up from the DB
+            return
+        if payout_id in self._known:
+            return
+        self._known.add(payout_id)
+        self._queue.put_nowait(payout_id)
+
+    async def start(self, app, poll_interval: Optional[float] = None) -> None:
+        """
+        Resume from the DB and start sending. With `poll_interval`, also pick up
+        rows queued by other processes (webhook workers) every that many seconds.
+        """
+        self._bot = app.bot
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(PAYOUT_MAX_IN_FLIGHT)
+        self._allowance_lock = asyncio.Lock()
+
+        pending, sent = await run_db(_db_load_pending)
+
+        for payout_id in pending:
+            self.enqueue(payout_id)
+        if pending:
+            logger.info("resuming %d queued payout(s)", len(pending))
+
+        await receipt_tracker.start()
+        for tx_hash, (raw, _, ids) in sent.items():
+            task = asyncio.create_task(self._resume(ids, tx_hash, raw))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+        held = {nonce for _, nonce, _ in sent.values() if nonce is not None}
+        self._task = asyncio.create_task(self._run(held))
+        if poll_interval:
+            self._poll_task = asyncio.create_task(self._poll(poll_interval))
+        if STUCK_SWEEP_INTERVAL:
+            self._sweep_task = asyncio.create_task(self._sweep(STUCK_SWEEP_INTERVAL))
+
+    @staticmethod
+    async def _reserve_nonces(held: set) -> None:
+        """
+        Keep new payouts off the nonces of txs recorded before a restart: they
+        may not have reached the node (its pending count skips them), and
+        they are about to be re-broadcast. Holes below them are reused.
+        """
+        nonces.resync()
+        if not held:
+            return
+        pending = await asyncio.to_thread(pending_nonce)
+        await asyncio.to_thread(nonces.advance_to, max(held) + 1)
+        for nonce in range(pending, max(held)):
+            if nonce not in held:
+                nonces.release(nonce)
+        logger.info("reserved nonces up to %d for %d resumed tx(s)", max(held), len(held))
+
+    async def stop(self) -> None:
+        for attr in ("_poll_task", "_sweep_task", "_task"):
+            task = getattr(self, attr)
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                setattr(self, attr, None)
+        for t in list(self._inflight):
+            t.cancel()
+        await receipt_tracker.stop()
+
+    async def _run(self, held: set) -> None:
+        # nonces come from web3_utils.nonces, so up to PAYOUT_MAX_IN_FLIGHT
+        # transfers can be pending on-chain at the same time
+        while True:
+            try:
+                await self._reserve_nonces(held)
+                break
+            except Exception as e:
+                logger.warning("could not reserve nonces of resumed payouts (%s); retrying", e)
+                await asyncio.sleep(5)
+        while True:
+            batch = await self._next_batch()
+            await self._slots.acquire()
+            task = asyncio.create_task(self._guarded(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _poll(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                for payout_id in await run_db(_db_queued_ids):
+                    self.enqueue(payout_id)
+            except Exception as e:
+                logger.warning("payout poll failed: %s", e)
+
+    async def _sweep(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep_stuck()
+            except Exception as e:
+                logger.warning("stuck payout sweep failed: %s", e)
+
+    async def sweep_stuck(self) -> None:
+        """
+        Re-check "stuck" payouts: settle them once any hash signed for their
+        nonce has a receipt, fail them (referrals / welcome claim released)
+        once the nonce was provably used by another tx, else re-broadcast.
+        """
+        groups = await run_db(_db_stuck)
+        if not groups:
+            return
+        # read before the receipts: a tx of ours mined in between still shows up as a receipt
+        mined = await asyncio.to_thread(mined_nonce)
+        for ids, hashes, nonce, raw in groups:
+            for tx_hash in hashes:
+                receipt = await asyncio.to_thread(receipt_or_none, tx_hash)
+                if receipt is not None:
+                    logger.info("stuck payouts %s mined as %s", ids, tx_hash)
+                    await self._finish(ids, tx_hash, receipt)
+                    break
+            else:
+                if nonce is not None and nonce < mined:
+                    logger.warning("stuck payouts %s: nonce %s went to another tx", ids, nonce)
+                    for p in await run_db(_db_fail, ids, "transaction replaced by another"):
+                        user_cache.invalidate(p.telegram_id)
+                        await self._notify(p.telegram_id, "⚠️ Transfer failed, nothing was sent. You can try again.")
+                elif raw:
+                    # nonce still unused: keep the tx in the nodes' pools so it can mine
+                    try:
+                        await asyncio.to_thread(broadcast_raw, raw)
+                    except Exception as e:
+                        logger.info("re-broadcast of stuck %s: %s", hashes[0], e)
+
+    async def _next_batch(self) -> List[int]:
+        batch = [await self._queue.get()]
+        if not DISPERSE_CONTRACT:
+            return batch
+        # gather more payouts for one disperse tx: until the window closes or the batch is full
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PAYOUT_BATCH_WINDOW
+        while len(batch) < PAYOUT_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _guarded(self, batch: List[int]) -> None:
+        try:
+            await self._process(batch)
+        except Exception:
+            logger.exception("payouts %s crashed", batch)
+        finally:
+            self._slots.release()
+            self._known.difference_update(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _process(self, batch: List[int]) -> None:
+        payouts = await run_db(_db_claim, batch)
+        if not payouts:
+            return
+        ids = [p.id for p in payouts]
+        recipients = [(p.address, p.amount) for p in payouts]
+        if len(recipients) > 1:
+            try:
+                await self._ensure_allowance(await asyncio.to_thread(to_wei_tokens, sum(p.amount for p in payouts)))
+            except Exception as e:
+                await self._fail(payouts, f"disperse approval failed: {e}")   # nothing was sent
+                return
+
+        for attempt in range(SEND_RETRIES + 1):
+            try:
+                tx = await asyncio.to_thread(sign_payout, recipients)
+            except Exception as e:
+                await self._fail(payouts, str(e))   # nothing was sent
+                return
+            # record the signed tx first; one tx may settle many rows
+            await run_db(_db_mark_sent, ids, tx.hash, tx.nonce, tx.raw)
+            try:
+                await asyncio.to_thread(send_signed, tx.raw)
+            except TxRejected as e:
+                # the nodes answered "no": the tx can't mine and its nonce is free again
+                forget(tx.hash)
+                if is_stale_nonce(e) and attempt < SEND_RETRIES:
+                    logger.warning("nonce %s rejected (%s); resyncing", tx.nonce, e)
+                    nonces.resync()
+                    continue
+                nonces.release(tx.nonce)
+                await self._fail(payouts, str(e))
+                return
+            except Exception as e:
+                # timeout or dropped connection: the tx may be in a pool, so the receipt decides
+                logger.warning("broadcast of %s for payouts %s unconfirmed (%s); waiting for a receipt", tx.hash, ids, e)
+            break
+        await self._settle(ids, tx.hash, tx.raw)
+
+    async def _ensure_allowance(self, total_wei: int) -> None:
+        """
+        Make sure the disperse contract may move `total_wei`: approve it once,
+        with a managed nonce, and wait on the receipt tracker (no thread is held).
+        An approval that timed out is waited on again rather than signed anew.
+        """
+        async with self._allowance_lock:
+            if self._allowance < total_wei and self._approval is None:
+                self._allowance = await asyncio.to_thread(disperse_allowance)
+            if self._allowance < total_wei:
+                if self._approval is None:
+                    tx = await asyncio.to_thread(sign_disperse_approval)
+                    try:
+                        await asyncio.to_thread(send_signed, tx.raw)
+                    except TxRejected:
+                        forget(tx.hash)
+                        nonces.release(tx.nonce)
+                        raise
+                    except Exception as e:
+                        logger.warning("broadcast of approval %s unconfirmed (%s); waiting for a receipt", tx.hash, e)
+                    self._approval = tx
+                else:
+                    try:
+                        await asyncio.to_thread(broadcast_raw, self._approval.raw)
+                    except Exception as e:
+                        # e.g. "nonce too low": it was mined meanwhile; the receipt decides
+                        logger.info("re-broadcast of approval %s: %s", self._approval.hash, e)
+                receipt, _, err = await self._first_receipt([self._approval.hash])
+                if receipt is None:
+                    raise RuntimeError(f"approval {self._approval.hash} not mined: {err}")
+                tx, self._approval = self._approval, None
+                forget(tx.hash)
+                if not receipt_ok(receipt):
+                    raise RuntimeError(f"approval {tx.hash} reverted")
+                logger.info("disperse contract approved in %s", tx.hash)
+                self._allowance = await asyncio.to_thread(disperse_allowance)
+            # spent by the batch about to be signed
+            self._allowance -= total_wei
+
+    async def _fail(self, payouts: List[Payout], err: str) -> None:
+        await run_db(_db_fail, [p.id for p in payouts], err)
+        for p in payouts:
+            user_cache.invalidate(p.telegram_id)
+            await self._notify(p.telegram_id, f"⚠️ Transfer failed: {err}")
+
+    async def _resume(self, ids: List[int], tx_hash: str, raw: Optional[str]) -> None:
+        """A tx recorded before a restart: re-broadcast it (it may never have left) and settle it."""
+        if raw:
+            try:
+                await asyncio.to_thread(broadcast_raw, raw)
+            except Exception as e:
+                # e.g. "nonce too low": it or a replacement was mined; the receipt decides
+                logger.info("re-broadcast of %s: %s", tx_hash, e)
+        await self._settle(ids, tx_hash, raw)
+
+    async def _settle(self, ids: List[int], tx_hash: str, raw: Optional[str] = None) -> None:
+        """Wait for the block-driven receipt tracker, repricing stuck txs, then finalize the rows."""
+        hashes = [tx_hash]   # original + replacements; all share one nonce, so only one can mine
+        reprices = 0
+        while True:
+            receipt, tx_hash, err = await self._first_receipt(hashes)
+            if receipt is not None:
+                break
+            if reprices >= FEE_MAX_REPRICES:
+                await run_db(_db_mark_stuck, ids, str(err))
+                logger.warning("payouts %s stuck: %s", ids, err)
+                return
+            reprices += 1
+            try:
+                new = await asyncio.to_thread(reprice, hashes[-1], raw)
+                await run_db(_db_mark_sent, ids, new.hash, new.nonce, new.raw)
+            except Exception as e:
+                await run_db(_db_mark_stuck, ids, f"reprice failed: {e}")
+                logger.warning("payouts %s stuck, reprice failed: %s", ids, e)
+                return
+            try:
+                await asyncio.to_thread(send_signed, new.raw)
+            except TxRejected as e:
+                # e.g. "nonce too low" because an earlier hash just mined: keep waiting on those
+                logger.warning("replacement %s for payouts %s rejected: %s", new.hash, ids, e)
+                forget(new.hash)
+                await run_db(_db_mark_sent, ids, hashes[-1], new.nonce, raw)
+                continue
+            except Exception as e:
+                logger.warning("broadcast of replacement %s unconfirmed (%s); tracking it", new.hash, e)
+            hashes.append(new.hash)
+            raw = new.raw
+        await self._finish(ids, tx_hash, receipt)
+
+    async def _finish(self, ids: List[int], tx_hash: str, receipt) -> None:
+        forget(tx_hash)
+        if receipt_ok(receipt):
+            for p in await run_db(_db_confirm, ids, tx_hash, receipt_block(receipt)):
+                user_cache.invalidate(p.telegram_id)
+                await self._notify(p.telegram_id, f"✅ Sent <b>{p.amount} BEAM</b>.\nTX: {tx_hash}")
+        else:
+            for p in await run_db(_db_fail, ids, "Token transfer failed"):
+                user_cache.invalidate(p.telegram_id)
+                await self._notify(p.telegram_id, f"⚠️ Transfer failed (reverted).\nTX: {tx_hash}")
+
+    @staticmethod
+    async def _first_receipt(hashes: List[str]):
+        """(receipt, hash, None) for whichever of `hashes` mines first, or (None, None, TimeoutError)."""
+        futs = {receipt_tracker.track(h): h for h in hashes}
+        err = None
+        pending = set(futs)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    for other in pending:
+                        # consume late timeouts so they aren't logged as unretrieved
+                        other.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    return fut.result(), futs[fut], None
+                err = fut.exception()
+        return None, None, err
+
+    async def _notify(self, chat_id: int, text: str) -> None:
+        try:
+            await self._bot.send_message(
+                chat_id, text, parse_mode=ParseMode.HTML, rate_limit_args={"priority": "low"}
+            )
+        except Exception as e:
+            logger.warning("payout notify to %s failed: %s", chat_id, e)
+
+
+payout_queue = PayoutQueue()
@@ -0,0 +1,171 @@
+# persistence.py
+# PTB persistence on the bot_state table, so user_data (awaiting_bsc) and
+# friends survive restarts and are shared by replicas. Nothing is loaded at
+# startup: a user's or chat's data is read the first time an update for it
+# arrives. Changed entries are written every PERSISTENCE_INTERVAL seconds
+# through db.write_behind, so one interval's changes land in a few group
+# commits; unchanged and empty entries are never written.
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import PERSISTENCE_INTERVAL
+from db import run_db, write_behind, BotState
+
+logger = logging.getLogger("srd_airdrop_bot.persistence")
+
+USER = "user"
+CHAT = "chat"
+BOT = "bot"
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, separators=(",", ":"), sort_keys=True)
+
+
+def _digest(raw: str) -> bytes:
+    """Fingerprint of a stored JSON value; b"" stands for "no row"."""
+    return hashlib.blake2b(raw.encode(), digest_size=16).digest() if raw else b""
+
+
+def _db_get(session, kind: str, key: str) -> Optional[str]:
+    row = session.query(BotState.data).filter_by(kind=kind, key=key).first()
+    return row[0] if row else None
+
+
+def _db_get_kind(session, kind: str) -> Dict[str, str]:
+    return dict(session.query(BotState.key, BotState.data).filter_by(kind=kind))
+
+
+# write-behind ops (see db.WriteBehind): idempotent, no commit
+def _wb_put(session, kind: str, key: str, data: str) -> None:
+    updated = session.query(BotState).filter_by(kind=kind, key=key).update(
+        {BotState.data: data}, synchronize_session=False
+    )
+    if not updated:
+        session.add(BotState(kind=kind, key=key, data=data))
+        session.flush()
+
+
+def _wb_delete(session, kind: str, key: str) -> None:
+    session.query(BotState).filter_by(kind=kind, key=key).delete(synchronize_session=False)
+
+
+class SQLPersistence(BasePersistence):
+    """
+    Stores user_data, chat_data, bot_data and conversation states as JSON,
+    so values must be JSON-serializable. Callback data is not persisted.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(user_data=True, chat_data=True, bot_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        # digest of the last JSON seen in / written to the DB per (kind, key), not
+        # the JSON itself: PTB already holds the data, this only detects changes
+        self._stored: Dict[tuple, bytes] = {}
+        self._loading: Dict[tuple, asyncio.Future] = {}
+
+    # ----- lazy loading -----
+    async def _load(self, kind: str, key, target: dict) -> None:
+        k = (kind, str(key))
+        if k in self._stored:
+            return
+        fut = self._loading.get(k)
+        if fut is not None:
+            await asyncio.shield(fut)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._loading[k] = fut
+        try:
+            raw = await run_db(_db_get, kind, k[1])
+            if raw:
+                # keep anything a handler set meanwhile
+                target.update({**json.loads(raw), **target})
+            self._stored[k] = _digest(raw or "")
+            fut.set_result(None)
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()
+            raise
+        finally:
+            del self._loading[k]
+
+    def _save(self, kind: str, key: str, raw: str) -> None:
+        """Queue a write of `raw` ("" deletes the row) unless the DB already holds it."""
+        digest = _digest(raw)
+        if self._stored.get((kind, key), b"") == digest:
+            return
+        self._stored[(kind, key)] = digest
+        if raw:
+            write_behind.submit(_wb_put, kind, key, raw)
+        else:
+            write_behind.submit(_wb_delete, kind, key)
+
+    # ----- user / chat data: loaded per id in refresh_*, not up front -----
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        await self._load(USER, user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        await self._load(CHAT, chat_id, chat_data)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        self._save(USER, str(user_id), _dumps(data) if data else "")
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        self._save(CHAT, str(chat_id), _dumps(data) if data else "")
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._save(USER, str(user_id), "")
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._save(CHAT, str(chat_id), "")
+
+    # ----- bot data: a single row -----
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        data: Dict[Any, Any] = {}
+        await self._load(BOT, BOT, data)
+        return data
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        self._save(BOT, BOT, _dumps(data) if data else "")
+
+    # ----- conversations: PTB needs every state of a handler up front -----
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        kind = f"conv:{name}"
+        rows = await run_db(_db_get_kind, kind)
+        convs = {}
+        for key, raw in rows.items():
+            self._stored[(kind, key)] = _digest(raw)
+            convs[tuple(json.loads(key))] = json.loads(raw)
+        return convs
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        self._save(f"conv:{name}", _dumps(list(key)), "" if new_state is None else _dumps(new_state))
+
+    # ----- callback data: not persisted -----
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Called by PTB on shutdown, after a final update pass."""
+        await write_behind.flush()
+        logger.info("persistence flushed (%d keys tracked)", len(self._stored))
@@ -0,0 +1,137 @@
+# ratelimit.py
+# Central pacing for every Bot API call made through the application's bot.
+# Token buckets enforce Telegram's global and per-chat limits on posted
+# messages; lookups (getChatMember, answerCallbackQuery, ...) draw from a
+# separate, much larger bucket so verify storms don't eat the send budget.
+# Callers can pass rate_limit_args={"priority": "low"} for background
+# traffic so user replies always keep some headroom. RetryAfter is retried
+# with backoff.
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import TG_GLOBAL_RATE, TG_CHAT_RATE, TG_GROUP_RATE, TG_MAX_RETRIES, TG_LOOKUP_RATE
+from metrics import observe_telegram
+
+logger = logging.getLogger("srd_airdrop_bot.ratelimit")
+
+# share of the global bucket that low-priority traffic may not touch
+LOW_PRIORITY_RESERVE = 0.3
+# idle per-chat buckets are dropped after this many seconds
+CHAT_BUCKET_IDLE = 120.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.max_rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, reserve: float = 0.0) -> None:
+        """Take one token, leaving `reserve` tokens for higher-priority callers."""
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens - reserve >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 + reserve - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def slow_down(self) -> None:
+        self.rate = max(self.max_rate / 10, self.rate * 0.7)
+
+    def recover(self) -> None:
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.01)
+
+
+def _posts_message(endpoint: str) -> bool:
+    # Telegram's global and per-chat limits are about messages posted, not lookups like getChatMember
+    return endpoint.startswith(("send", "edit", "copy", "forward"))
+
+
+def _retry_seconds(err: RetryAfter) -> float:
+    retry_after = err.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class TelegramRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, lookup_rate: float = TG_LOOKUP_RATE):
+        # webhook workers each get a share of the bot-wide budget
+        self._global = TokenBucket(global_rate, global_rate)
+        self._lookups = TokenBucket(lookup_rate, lookup_rate)
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._last_prune = time.monotonic()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        now = time.monotonic()
+        if now - self._last_prune > CHAT_BUCKET_IDLE:
+            self._chats = {k: b for k, b in self._chats.items() if now - b.updated < CHAT_BUCKET_IDLE}
+            self._last_prune = now
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # private chats have positive ids; groups/channels are negative
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            rate = TG_CHAT_RATE if is_private else TG_GROUP_RATE / 60.0
+            bucket = TokenBucket(rate, 1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        low = (rate_limit_args or {}).get("priority") == "low"
+        posts = _posts_message(endpoint)
+        bucket = self._global if posts else self._lookups
+        reserve = bucket.capacity * LOW_PRIORITY_RESERVE if low else 0.0
+        chat_id = data.get("chat_id")
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None and posts else None
+
+        for attempt in range(TG_MAX_RETRIES + 1):
+            if chat_bucket:
+                await chat_bucket.acquire()
+            await bucket.acquire(reserve)
+            try:
+                result = await observe_telegram(endpoint, callback(*args, **kwargs))
+            except RetryAfter as e:
+                if attempt >= TG_MAX_RETRIES:
+                    raise
+                wait = _retry_seconds(e)
+                logger.warning("%s flood-limited for %.1fs (chat %s)", endpoint, wait, chat_id)
+                (chat_bucket or bucket).pause(wait)
+                bucket.slow_down()
+                continue
+            bucket.recover()
+            return result
+        raise AssertionError("unreachable")
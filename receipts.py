@@ -0,0 +1,136 @@
+# receipts.py
+# One block-driven receipt tracker for every pending transfer, instead of a
+# wait_for_transaction_receipt polling loop per tx. RPC load scales with the
+# block rate, not with the number of transfers in flight.
+
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from config import RECEIPT_POLL_INTERVAL, RECEIPT_TIMEOUT_BLOCKS
+from web3_utils import get_w3
+
+logger = logging.getLogger("srd_airdrop_bot.receipts")
+
+# never scan further back than this many blocks in one tick
+MAX_BLOCKS_PER_TICK = 50
+
+
+def _norm(tx_hash) -> str:
+    """Lower-case 0x-prefixed hex for str or HexBytes hashes."""
+    if not isinstance(tx_hash, str):
+        tx_hash = tx_hash.hex()
+    tx_hash = tx_hash.lower()
+    return tx_hash if tx_hash.startswith("0x") else "0x" + tx_hash
+
+
+class ReceiptTracker:
+    def __init__(self):
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._since: Dict[str, int] = {}          # tx hash -> head block when tracking began
+        self._last_block: Optional[int] = None
+        self._block_receipts = True               # eth_getBlockReceipts supported?
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, tx_hash: str) -> asyncio.Future:
+        """Future resolving to the receipt (an AttributeDict) once the tx is mined."""
+        key = _norm(tx_hash)
+        fut = self._pending.get(key)
+        if fut is None:
+            fut = asyncio.get_running_loop().create_future()
+            self._pending[key] = fut
+            self._since[key] = self._last_block or 0
+        return fut
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._tick()
+            except Exception as e:
+                logger.warning("receipt tracker tick failed: %s", e)
+            await asyncio.sleep(RECEIPT_POLL_INTERVAL)
+
+    async def _tick(self) -> None:
+        head = await asyncio.to_thread(lambda: get_w3().eth.block_number)
+        if self._last_block is None:
+            self._last_block = head - 1
+            for key in self._since:
+                self._since[key] = head
+        if not self._pending:
+            self._last_block = head
+            return
+
+        first = max(self._last_block + 1, head - MAX_BLOCKS_PER_TICK + 1)
+        for number in range(first, head + 1):
+            if not self._pending:
+                break
+            receipts = await asyncio.to_thread(self._receipts_for_block, number)
+            for receipt in receipts:
+                self._resolve(_norm(receipt["transactionHash"]), receipt)
+        self._last_block = head
+
+        # anything left over too long: ask for it directly once, then give up
+        for key in [k for k, since in self._since.items() if head - since >= RECEIPT_TIMEOUT_BLOCKS]:
+            receipt = await asyncio.to_thread(self._direct_receipt, key)
+            if receipt is not None:
+                self._resolve(key, receipt)
+                continue
+            fut = self._pending.pop(key)
+            self._since.pop(key, None)
+            # the nonce stays with whoever owns the tx: the payout queue reprices it on the same nonce
+            if not fut.done():
+                fut.set_exception(TimeoutError(f"{key} not mined after {RECEIPT_TIMEOUT_BLOCKS} blocks"))
+
+    def _resolve(self, key: str, receipt) -> None:
+        fut = self._pending.pop(key, None)
+        if fut is None:
+            return
+        self._since.pop(key, None)
+        if not fut.done():
+            fut.set_result(receipt)
+
+    def _receipts_for_block(self, number: int):
+        """All receipts in `number` that we are waiting for (runs in a worker thread)."""
+        w3 = get_w3()
+        if self._block_receipts:
+            resp = w3.provider.make_request("eth_getBlockReceipts", [hex(number)])
+            if "error" not in resp:
+                return [r for r in (resp.get("result") or []) if _norm(r["transactionHash"]) in self._pending]
+            logger.info("eth_getBlockReceipts unsupported (%s); scanning blocks instead", resp["error"])
+            self._block_receipts = False
+
+        block = w3.eth.get_block(number)
+        hits = [h for h in map(_norm, block["transactions"]) if h in self._pending]
+        return [w3.eth.get_transaction_receipt(h) for h in hits]
+
+    @staticmethod
+    def _direct_receipt(key: str):
+        try:
+            return get_w3().eth.get_transaction_receipt(key)
+        except Exception:
+            return None
+
+
+def receipt_ok(receipt) -> bool:
+    status = receipt["status"]
+    return (int(status, 16) if isinstance(status, str) else int(status)) == 1
+
+
+def receipt_block(receipt) -> int:
+    number = receipt["blockNumber"]
+    return int(number, 16) if isinstance(number, str) else int(number)
+
+
+receipt_tracker = ReceiptTracker()
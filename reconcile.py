@@ -0,0 +1,126 @@
+# reconcile.py
+# Balance audit (manage.py reconcile-balances). Two checks, discrepancies
+# only, written as CSV:
+#   ledger      users.balance_beam != sum of the user's confirmed payouts
+#               (before the payout queue, welcome rewards were credited with
+#               no Payout row: users with no welcome payout or claim may have
+#               whole welcome rewards on top)
+#   below_paid  an address holds fewer tokens on-chain than we confirmed
+#               paying it (tokens moved on, or a payout that never landed)
+#   unreadable  balanceOf failed for the address
+# On-chain balances are read thousands per round-trip (web3_utils.balances_of),
+# a few pages in parallel, so the whole user base is audited in seconds.
+
+import csv
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from sqlalchemy import and_, exists, false, func, select
+
+from config import WELCOME_REWARD_BEAM
+from db import engine, User, Payout, RewardClaim
+from web3_utils import balances_of, token_decimals
+
+logger = logging.getLogger("srd_airdrop_bot.reconcile")
+
+CSV_HEADER = ["issue", "address", "telegram_ids", "db_balance_beam", "paid_beam", "onchain_beam"]
+
+
+def _paid_by_user():
+    return (
+        select(Payout.telegram_id.label("tg"), func.sum(Payout.amount).label("paid"))
+        .where(Payout.status == "confirmed")
+        .group_by(Payout.telegram_id)
+        .subquery()
+    )
+
+
+def _legacy_welcome(diff):
+    """The unexplained balance is whole welcome rewards from before they were recorded."""
+    if WELCOME_REWARD_BEAM <= 0:
+        return false()
+    return and_(
+        diff > 0,
+        diff % WELCOME_REWARD_BEAM == 0,
+        ~exists().where(Payout.telegram_id == User.telegram_id, Payout.kind == "welcome"),
+        ~exists().where(RewardClaim.telegram_id == User.telegram_id, RewardClaim.reward_type == "welcome"),
+    )
+
+
+def _ledger_query():
+    paid = _paid_by_user()
+    diff = func.coalesce(User.balance_beam, 0) - func.coalesce(paid.c.paid, 0)
+    return (
+        select(User.telegram_id, User.bsc_address, User.balance_beam, func.coalesce(paid.c.paid, 0))
+        .outerjoin(paid, paid.c.tg == User.telegram_id)
+        .where(diff != 0, ~_legacy_welcome(diff))
+    )
+
+
+def _paid_by_address_page(conn, after: str, limit: int) -> List[Tuple[str, int, str]]:
+    """[(address, confirmed tokens, telegram id or "id+N" when shared)], keyset-paged by address."""
+    # legacy rows have no address; they were paid to the user's address
+    addr = func.coalesce(Payout.address, User.bsc_address)
+    q = (
+        select(addr.label("addr"), func.sum(Payout.amount), func.count(func.distinct(Payout.telegram_id)),
+               func.min(Payout.telegram_id))
+        .select_from(Payout)
+        .outerjoin(User, User.telegram_id == Payout.telegram_id)
+        .where(Payout.status == "confirmed", addr.isnot(None), addr > after)
+        .group_by(addr)
+        .order_by(addr)
+        .limit(limit)
+    )
+    rows = []
+    for address, paid, n_users, first_tg in conn.execute(q):
+        rows.append((address, int(paid or 0), str(first_tg) if n_users == 1 else f"{first_tg}+{n_users - 1}"))
+    return rows
+
+
+def reconcile_balances(out, batch_size: int = 2000, parallel: int = 4) -> dict:
+    """Write discrepancies as CSV to the file object `out`; returns counts and timings."""
+    writer = csv.writer(out)
+    writer.writerow(CSV_HEADER)
+    stats = {"ledger": 0, "addresses": 0, "below_paid": 0, "unreadable": 0}
+
+    t = time.perf_counter()
+    with engine.connect() as conn:
+        rows = conn.execution_options(stream_results=True, yield_per=batch_size).execute(_ledger_query())
+        for tg, address, balance, paid in rows:
+            writer.writerow(["ledger", address or "", tg, balance or 0, paid, ""])
+            stats["ledger"] += 1
+    stats["ledger_seconds"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    unit = 10 ** token_decimals()
+
+    def _report(page, balances):
+        for (address, paid, tgs), wei in zip(page, balances):
+            stats["addresses"] += 1
+            if wei is None:
+                writer.writerow(["unreadable", address, tgs, "", paid, ""])
+                stats["unreadable"] += 1
+            elif wei < paid * unit:
+                writer.writerow(["below_paid", address, tgs, "", paid, wei / unit])
+                stats["below_paid"] += 1
+
+    # keep `parallel` multicalls in flight while the next pages are read
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="audit") as pool, engine.connect() as conn:
+        inflight = deque()
+        after, exhausted = "", False
+        while not exhausted or inflight:
+            if not exhausted:
+                page = _paid_by_address_page(conn, after, batch_size)
+                if page:
+                    inflight.append((page, pool.submit(balances_of, [a for a, _, _ in page])))
+                    after = page[-1][0]
+                else:
+                    exhausted = True
+            if inflight and (exhausted or len(inflight) >= parallel):
+                done_page, fut = inflight.popleft()
+                _report(done_page, fut.result())
+    stats["chain_seconds"] = time.perf_counter() - t
+    return stats
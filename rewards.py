@@ -0,0 +1,73 @@
+# rewards.py
+# Idempotent one-time rewards. A claim row and its queued Payout are
+# written in one transaction; the unique keys on reward_claims decide
+# races, so a reward is paid at most once per user and once per address.
+
+import logging
+from typing import Optional, Set, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from db import run_db, RewardClaim
+from payouts import queue_payout
+from user_cache import ensure_user
+
+logger = logging.getLogger("srd_airdrop_bot.rewards")
+
+CLAIMED = "claimed"
+USER_ALREADY_CLAIMED = "user_already_claimed"
+ADDRESS_ALREADY_CLAIMED = "address_already_claimed"
+
+
+def _db_claimed_addresses(session, reward_type: str) -> Set[str]:
+    rows = session.query(RewardClaim.address).filter_by(reward_type=reward_type).yield_per(5000)
+    return {addr for (addr,) in rows}
+
+
+def _db_address_claimed(session, reward_type: str, addr: str) -> bool:
+    return session.query(RewardClaim.id).filter_by(reward_type=reward_type, address=addr).first() is not None
+
+
+def _db_claim(session, tg_id: int, reward_type: str, amount: int, addr: str) -> Tuple[str, Optional[int]]:
+    user = ensure_user(session, tg_id, None)
+    payout = queue_payout(session, user, reward_type, amount, addr)
+    session.flush()
+    session.add(RewardClaim(telegram_id=tg_id, reward_type=reward_type, address=addr, payout_id=payout.id))
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        mine = session.query(RewardClaim.id).filter_by(telegram_id=tg_id, reward_type=reward_type).first()
+        return (USER_ALREADY_CLAIMED if mine else ADDRESS_ALREADY_CLAIMED), None
+    return CLAIMED, payout.id
+
+
+class RewardLedger:
+    def __init__(self, reward_type: str):
+        self.reward_type = reward_type
+        # addresses known to have claimed; a hint only - the unique key is authoritative
+        self._addresses: Set[str] = set()
+
+    async def warm(self) -> None:
+        self._addresses = await run_db(_db_claimed_addresses, self.reward_type)
+        logger.info("%s ledger: %d claimed addresses loaded", self.reward_type, len(self._addresses))
+
+    async def address_taken(self, addr: str) -> bool:
+        """Cheap pre-check: a new address costs no query; a known one is confirmed against the DB."""
+        if addr not in self._addresses:
+            return False
+        if await run_db(_db_address_claimed, self.reward_type, addr):
+            return True
+        # the claim was released (failed payout): forget the stale hint
+        self._addresses.discard(addr)
+        return False
+
+    async def claim(self, tg_id: int, amount: int, addr: str) -> Tuple[str, Optional[int]]:
+        """Record the claim and queue its payout. Returns (status, payout_id or None)."""
+        status, payout_id = await run_db(_db_claim, tg_id, self.reward_type, amount, addr)
+        if status != USER_ALREADY_CLAIMED:
+            self._addresses.add(addr)
+        return status, payout_id
+
+
+welcome_ledger = RewardLedger("welcome")
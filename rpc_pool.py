@@ -0,0 +1,215 @@
+# rpc_pool.py
+# Multi-endpoint JSON-RPC provider for web3. Each endpoint keeps a pooled
+# keep-alive HTTP session and a latency/error score. Idempotent reads are
+# hedged: if the best node is slow, the runner-up is asked too and the
+# first answer wins. Raw transactions are broadcast to several nodes.
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from typing import Any, Dict, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3.providers.base import JSONBaseProvider
+
+from metrics import observe_rpc, rpc_endpoint_seconds
+from config import RPC_TIMEOUT, RPC_HEDGE_DELAY, RPC_BROADCAST_FANOUT, RPC_POOL_SIZE
+
+logger = logging.getLogger("srd_airdrop_bot.rpc")
+
+# safe to send twice / to two nodes
+HEDGED_METHODS = frozenset({
+    "eth_blockNumber",
+    "eth_call",                    # decimals, balanceOf, allowance
+    "eth_chainId",
+    "eth_estimateGas",
+    "eth_feeHistory",
+    "eth_gasPrice",
+    "eth_getBalance",
+    "eth_getBlockByNumber",
+    "eth_getBlockReceipts",
+    "eth_getCode",
+    "eth_getTransactionCount",     # nonce
+    "eth_getTransactionReceipt",
+})
+
+BROADCAST_METHODS = frozenset({"eth_sendRawTransaction"})
+
+EWMA_ALPHA = 0.2
+ERROR_DECAY = 0.9
+
+
+class Endpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=RPC_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self.ewma = 0.2                 # seconds; optimistic start so every node gets tried
+        self.errors = 0.0               # decaying error count
+        self.requests = 0
+        self.failures = 0
+
+    def score(self) -> float:
+        """Lower is better: smoothed latency, penalised by recent transport errors."""
+        return self.ewma * (1 + 4 * self.errors)
+
+    def post(self, payload: bytes) -> bytes:
+        t = time.perf_counter()
+        try:
+            resp = self.session.post(
+                self.url, data=payload, timeout=RPC_TIMEOUT, headers={"Content-Type": "application/json"}
+            )
+            resp.raise_for_status()
+        except Exception:
+            self._record(time.perf_counter() - t, ok=False)
+            raise
+        self._record(time.perf_counter() - t, ok=True)
+        return resp.content
+
+    def _record(self, elapsed: float, ok: bool) -> None:
+        rpc_endpoint_seconds.observe(elapsed, self.url)
+        with self._lock:
+            self.requests += 1
+            self.errors *= ERROR_DECAY
+            if ok:
+                self.ewma += EWMA_ALPHA * (elapsed - self.ewma)
+            else:
+                self.failures += 1
+                self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "url": self.url,
+                "ewma_ms": round(self.ewma * 1000, 1),
+                "score": round(self.score(), 4),
+                "requests": self.requests,
+                "failures": self.failures,
+            }
+
+
+class PooledProvider(JSONBaseProvider):
+    def __init__(self, urls: List[str]):
+        super().__init__()
+        if not urls:
+            raise ValueError("at least one RPC endpoint is required")
+        self.endpoints = [Endpoint(u) for u in urls]
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(4, len(urls) * RPC_POOL_SIZE), thread_name_prefix="rpc"
+        )
+
+    def __str__(self) -> str:
+        return f"PooledProvider({', '.join(e.url for e in self.endpoints)})"
+
+    def ranked(self) -> List[Endpoint]:
+        return sorted(self.endpoints, key=Endpoint.score)
+
+    def make_request(self, method, params):
+        return observe_rpc(method, lambda: self._request(method, params))
+
+    def _request(self, method, params):
+        payload = self.encode_rpc_request(method, params)
+        if method in BROADCAST_METHODS:
+            raw = self._broadcast(payload)
+        elif method in HEDGED_METHODS and len(self.endpoints) > 1:
+            raw = self._hedged(payload)
+        else:
+            raw = self._failover(payload)
+        return self.decode_rpc_response(raw)
+
+    def batch(self, calls: List[Tuple[str, list]]) -> List[Dict[str, Any]]:
+        """Send [(method, params)] as one JSON-RPC batch; responses come back in call order."""
+        return observe_rpc("batch", lambda: self._batch(calls))
+
+    def _batch(self, calls: List[Tuple[str, list]]) -> List[Dict[str, Any]]:
+        payload = json.dumps(
+            [{"jsonrpc": "2.0", "id": i, "method": m, "params": p} for i, (m, p) in enumerate(calls)]
+        ).encode()
+        responses = json.loads(self._failover(payload))
+        if isinstance(responses, dict):
+            # the node rejected the batch as a whole
+            raise RuntimeError(f"batch request failed: {responses.get('error')}")
+        by_id = {r.get("id"): r for r in responses}
+        return [by_id.get(i, {"error": "no response"}) for i in range(len(calls))]
+
+    def _failover(self, payload: bytes) -> bytes:
+        last = None
+        for ep in self.ranked():
+            try:
+                return ep.post(payload)
+            except Exception as e:
+                last = e
+                logger.warning("rpc %s failed: %s", ep.url, e)
+        raise last
+
+    def _hedged(self, payload: bytes) -> bytes:
+        """
+        Ask the best node; if it hasn't answered after RPC_HEDGE_DELAY also ask
+        the runner-up (at most two in parallel). Errors fail over down the ranking.
+        """
+        ranked = self.ranked()
+        futures = {self._executor.submit(ranked[0].post, payload): ranked[0]}
+        next_idx = 1
+        last = None
+        while futures:
+            timeout = RPC_HEDGE_DELAY if next_idx < 2 else None
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                ep = futures.pop(fut)
+                try:
+                    return fut.result()
+                except Exception as e:
+                    last = e
+                    logger.warning("rpc %s failed: %s", ep.url, e)
+            slow = not done and next_idx < 2
+            if next_idx < len(ranked) and (slow or not futures):
+                futures[self._executor.submit(ranked[next_idx].post, payload)] = ranked[next_idx]
+                next_idx += 1
+        raise last
+
+    def _broadcast(self, payload: bytes) -> bytes:
+        """
+        Send a raw tx to the top RPC_BROADCAST_FANOUT nodes; first accepted answer
+        wins. An error body is returned only if every node answered with one: a
+        node that timed out may have taken the tx, so that outcome is unknown and
+        the transport error is raised instead.
+        """
+        targets = self.ranked()[:max(1, RPC_BROADCAST_FANOUT)]
+        futures = {self._executor.submit(ep.post, payload): ep for ep in targets}
+        error_body = None
+        last = None
+        for fut in as_completed(futures):
+            try:
+                raw = fut.result()
+            except Exception as e:
+                last = e
+                continue
+            decoded = self.decode_rpc_response(raw)
+            if "error" not in decoded:
+                return raw
+            if "already known" in str(decoded["error"]).lower():
+                # a node that heard it via gossip first: as good as accepted
+                return raw
+            error_body = error_body or raw
+        if last is not None:
+            raise last
+        return error_body
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        try:
+            resp = self.make_request("web3_clientVersion", [])
+        except Exception:
+            if show_traceback:
+                raise
+            return False
+        return "error" not in resp
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [ep.stats() for ep in self.endpoints]
+
@@ -0,0 +1,121 @@
+# tests/conftest.py
+# config and db read the environment at import time, so test settings go in
+# before any test module is collected: a throwaway SQLite file and a fake BSC
+# node (bench/fake_rpc.py) served from a background thread. Each test that
+# asks for `fake_chain` gets a fresh node behind the same URL. The payout
+# tests share FakeBot, queue_rows() and settled() from here.
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from _http import ServerThread  # noqa: E402
+from fake_rpc import FakeRPC     # noqa: E402
+
+CHAIN_ID = 31337
+
+
+class _Node:
+    """Routes requests to whichever FakeRPC the running test installed."""
+
+    def __init__(self):
+        self.rpc = None
+
+    async def handle(self, method, path, headers, body):
+        return await self.rpc.handle(method, path, headers, body)
+
+
+_node = _Node()
+_rpc_port = ServerThread(_node.handle, 0, "fake-rpc").start_and_wait()
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='srd-test-'), 'test.db')}",
+    "BOT_TOKEN": "123456:TEST",
+    "BSC_RPC": f"http://127.0.0.1:{_rpc_port}",
+    "RPC_BROADCAST_FANOUT": "1",
+    "ADMIN_PRIVATE_KEY": "0x" + "11" * 32,
+    "BEAM_CONTRACT": "0x" + "00" * 18 + "beef",
+    "DISPERSE_CONTRACT": "0x" + "00" * 18 + "d15e",
+    "CHAIN_ID": str(CHAIN_ID),
+    "PAYOUT_BATCH_WINDOW": "0.3",
+    "RECEIPT_POLL_INTERVAL": "0.05",
+    "RECEIPT_TIMEOUT_BLOCKS": "20",
+    "STUCK_SWEEP_INTERVAL": "0",
+    "FEE_CACHE_SECONDS": "0",
+})
+
+
+@pytest.fixture
+def fresh_db():
+    """An empty schema (every table dropped and recreated)."""
+    import db
+
+    db.Base.metadata.drop_all(db.engine)
+    db.init_db()
+    return db
+
+
+@pytest.fixture
+def fake_chain(monkeypatch):
+    """A fresh fake node (block every 0.1s) and the chain-side singletons reset to match it."""
+    import payouts
+    import receipts
+    import web3_utils
+    from fees import fee_oracle
+
+    rpc = FakeRPC(CHAIN_ID, latency=0.0, jitter=0.0, block_time=0.1)
+    _node.rpc = rpc
+    web3_utils.nonces.resync()
+    monkeypatch.setattr(fee_oracle, "_gas", {})
+    monkeypatch.setattr(payouts, "receipt_tracker", receipts.ReceiptTracker())
+    yield rpc
+    if rpc._miner is not None:
+        rpc._miner.get_loop().call_soon_threadsafe(rpc._miner.cancel)
+
+
+class FakeBot:
+    """Records what the payout queue would send to users."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def queue_rows(db, amounts, **fields):
+    """Insert one queued Payout per amount (telegram ids continue the table's); [(id, address, amount)]."""
+    from eth_account import Account
+
+    with db.SessionLocal() as session:
+        start = session.query(db.Payout).count() + 1
+        rows = [
+            db.Payout(telegram_id=tg_id, amount=amount, address=Account.create().address,
+                      **{"kind": "referral", "status": "queued", **fields})
+            for tg_id, amount in enumerate(amounts, start=start)
+        ]
+        session.add_all(rows)
+        session.commit()
+        return [(p.id, p.address, p.amount) for p in rows]
+
+
+async def settled(db, ids, timeout=15.0):
+    """Statuses of payouts `ids` once each is confirmed or failed."""
+    deadline = time.monotonic() + timeout
+    while True:
+        with db.SessionLocal() as session:
+            rows = session.query(db.Payout.status).filter(db.Payout.id.in_(ids)).order_by(db.Payout.id)
+            statuses = [s for (s,) in rows]
+        if all(s in ("confirmed", "failed") for s in statuses):
+            return statuses
+        if time.monotonic() > deadline:
+            raise AssertionError(f"payouts {ids} not settled: {statuses}")
+        await asyncio.sleep(0.05)
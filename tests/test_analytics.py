@@ -0,0 +1,54 @@
+# tests/test_analytics.py
+# The users counter in daily_totals: bumped once per new row on both insert
+# paths (direct and write-behind), seeded for a pre-existing table, and
+# rebuilt by backfill().
+
+import asyncio
+
+
+def _users_total(db):
+    import analytics
+
+    with db.SessionLocal() as session:
+        return analytics._db_campaign(session, "today")["all"]["users"]
+
+
+def test_user_inserts_are_counted_once(fresh_db):
+    from user_cache import ensure_user, _wb_create_user
+
+    with fresh_db.SessionLocal() as session:
+        ensure_user(session, 1, "a")
+        ensure_user(session, 1, "a")            # existing row: not counted again
+    with fresh_db.SessionLocal() as session:
+        _wb_create_user(session, 2, "b")
+        _wb_create_user(session, 1, "a")
+        session.commit()
+
+    assert _users_total(fresh_db) == 2
+
+
+def test_repeated_write_behind_inserts_count_once(fresh_db):
+    from db import write_behind
+    from user_cache import _wb_create_user
+
+    async def scenario():
+        for _ in range(3):
+            write_behind.submit(_wb_create_user, 7, "x")
+        await write_behind.flush()
+
+    asyncio.run(scenario())
+    assert _users_total(fresh_db) == 1
+
+
+def test_seed_and_backfill(fresh_db):
+    import analytics
+
+    with fresh_db.SessionLocal() as session:
+        session.add_all(fresh_db.User(telegram_id=i) for i in (1, 2, 3))
+        session.query(fresh_db.DailyTotal).delete()
+        session.commit()
+    fresh_db.init_db()                          # a table from before the counter existed
+    assert _users_total(fresh_db) == 3
+
+    analytics.backfill()
+    assert _users_total(fresh_db) == 3
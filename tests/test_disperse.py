@@ -0,0 +1,88 @@
+# tests/test_disperse.py
+# Batched payouts against the fake node: the disperse contract is approved
+# once, through the payout queue's nonce manager and receipt tracker, and
+# each batch goes out as one disperseToken tx with an estimated gas limit.
+
+import asyncio
+from types import SimpleNamespace
+
+import rlp
+from eth_abi import decode
+
+from conftest import FakeBot, queue_rows, settled
+from fake_rpc import APPROVE_SELECTOR, DISPERSE_SELECTOR, DISPERSE_BASE_GAS, DISPERSE_GAS_PER_RECIPIENT
+
+
+def _expected_gas(n):
+    from config import GAS_LIMIT_MARGIN
+
+    one = int((DISPERSE_BASE_GAS + DISPERSE_GAS_PER_RECIPIENT) * GAS_LIMIT_MARGIN)
+    two = int((DISPERSE_BASE_GAS + 2 * DISPERSE_GAS_PER_RECIPIENT) * GAS_LIMIT_MARGIN)
+    return one + (two - one) * (n - 1)
+
+
+def test_batches_approve_once_and_disperse(fresh_db, fake_chain):
+    import payouts
+    from config import BEAM_CONTRACT, DISPERSE_CONTRACT
+
+    fake_chain.allowance = 0
+    bot = FakeBot()
+    queue = payouts.PayoutQueue()
+
+    async def scenario():
+        first = queue_rows(fresh_db, [5, 5, 5])
+        await queue.start(SimpleNamespace(bot=bot))
+        try:
+            assert await settled(fresh_db, [i for i, _, _ in first]) == ["confirmed"] * 3
+            second = queue_rows(fresh_db, [7, 9])
+            for payout_id, _, _ in second:
+                queue.enqueue(payout_id)
+            assert await settled(fresh_db, [i for i, _, _ in second]) == ["confirmed"] * 2
+        finally:
+            await queue.stop()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    txs = sorted(fake_chain.txs.values(), key=lambda tx: tx["nonce"])
+    approve, *batches = txs
+    assert approve["to"] == BEAM_CONTRACT.lower() and approve["data"].startswith(APPROVE_SELECTOR)
+    assert approve["data"][10:74].endswith(DISPERSE_CONTRACT[2:].lower())
+    assert len(batches) == 2
+    for tx, rows in zip(batches, (first, second)):
+        assert tx["to"] == DISPERSE_CONTRACT.lower() and tx["data"].startswith(DISPERSE_SELECTOR)
+        token, addrs, values = decode(["address", "address[]", "uint256[]"], bytes.fromhex(tx["data"][10:]))
+        assert token.lower() == BEAM_CONTRACT.lower()
+        assert [a.lower() for a in addrs] == [addr.lower() for _, addr, _ in rows]
+        assert list(values) == [amount * 10 ** 18 for _, _, amount in rows]
+        assert tx["gas"] == _expected_gas(len(rows))
+    assert sum(text.startswith("✅ Sent") for _, text in bot.sent) == 5
+
+
+def test_rejected_approval_fails_the_batch(fresh_db, fake_chain):
+    import payouts
+
+    fake_chain.allowance = 0
+    bot = FakeBot()
+    queue = payouts.PayoutQueue()
+    accept = fake_chain._accept
+
+    def reject_approve(raw_hex):
+        data = rlp.decode(bytes.fromhex(raw_hex[2:])[1:])[7]   # EIP-1559 fields: data is the 8th
+        if data.hex().startswith(APPROVE_SELECTOR[2:]):
+            raise ValueError("insufficient funds for gas * price + value")
+        return accept(raw_hex)
+
+    fake_chain._accept = reject_approve
+
+    async def scenario():
+        rows = queue_rows(fresh_db, [5, 5])
+        await queue.start(SimpleNamespace(bot=bot))
+        try:
+            return await settled(fresh_db, [i for i, _, _ in rows])
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(scenario()) == ["failed", "failed"]
+    assert not fake_chain.txs
+    assert all("disperse approval failed" in text for _, text in bot.sent)
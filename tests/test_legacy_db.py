@@ -0,0 +1,67 @@
+# tests/test_legacy_db.py
+# A database created by the original schema (before the payout queue) must
+# come through init_db() and `manage.py reconcile-referrals` with its paid
+# withdrawals still counted.
+
+import sqlite3
+
+from sqlalchemy import update
+
+import db   # DATABASE_URL is a throwaway SQLite file (see conftest.py)
+
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL, telegram_id BIGINT NOT NULL, username VARCHAR(255), bsc_address VARCHAR(64),
+    balance_beam INTEGER, referrals_count INTEGER, referred_by BIGINT, created_at DATETIME, PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_users_telegram_id ON users (telegram_id);
+CREATE TABLE payouts (
+    id INTEGER NOT NULL, telegram_id BIGINT NOT NULL, amount INTEGER NOT NULL, tx_hash VARCHAR(100),
+    created_at DATETIME, user_id INTEGER, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id)
+);
+CREATE INDEX ix_payouts_telegram_id ON payouts (telegram_id);
+CREATE TABLE referrals (
+    id INTEGER NOT NULL, referrer_id BIGINT NOT NULL, referee_id BIGINT NOT NULL, created_at DATETIME,
+    referrer_db_id INTEGER, PRIMARY KEY (id), FOREIGN KEY(referrer_db_id) REFERENCES users (id)
+);
+CREATE INDEX ix_referrals_referee_id ON referrals (referee_id);
+CREATE INDEX ix_referrals_referrer_id ON referrals (referrer_id);
+"""
+
+
+def _legacy_db():
+    # user 1 referred users 2-4 and withdrew once, which spent all three referrals
+    db.Base.metadata.drop_all(db.engine)
+    db.engine.dispose()
+    conn = sqlite3.connect(db.engine.url.database)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO users (id, telegram_id, referrals_count, balance_beam) VALUES (?, ?, ?, ?)",
+        [(1, 1, 0, 5), (2, 2, 0, 0), (3, 3, 0, 0), (4, 4, 0, 0)],
+    )
+    conn.executemany("INSERT INTO referrals (referrer_id, referee_id) VALUES (1, ?)", [(2,), (3,), (4,)])
+    conn.execute("INSERT INTO payouts (telegram_id, amount, tx_hash, user_id) VALUES (1, 5, '0xabc', 1)")
+    conn.commit()
+    conn.close()
+
+
+def _referrals_count(tg_id):
+    with db.SessionLocal() as session:
+        return session.query(db.User.referrals_count).filter_by(telegram_id=tg_id).scalar()
+
+
+def test_legacy_payouts_survive_migration_and_reconcile():
+    _legacy_db()
+    db.init_db()
+
+    with db.SessionLocal() as session:
+        assert session.query(db.Payout.status, db.Payout.kind).one() == ("confirmed", "referral")
+
+    db.reconcile_referral_counts()
+    assert _referrals_count(1) == 0
+
+    # a DB migrated before the backfill existed still has NULL statuses
+    with db.engine.begin() as conn:
+        conn.execute(update(db.Payout).values(status=None, kind=None))
+    db.reconcile_referral_counts()
+    assert _referrals_count(1) == 0
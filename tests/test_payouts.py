@@ -0,0 +1,149 @@
+# tests/test_payouts.py
+# The money path against the fake node: NonceManager bookkeeping and the
+# payout state machine (queued -> sending -> sent -> confirmed | failed),
+# including stale-nonce retries, reverts and recovery after a restart.
+
+import asyncio
+from types import SimpleNamespace
+
+from conftest import FakeBot, queue_rows, settled
+
+
+def _run_queue(db, bot, ids):
+    """Start a fresh PayoutQueue, wait until payouts `ids` are settled and stop it; their statuses."""
+    import payouts
+
+    async def main():
+        queue = payouts.PayoutQueue()
+        await queue.start(SimpleNamespace(bot=bot))
+        try:
+            return await settled(db, ids)
+        finally:
+            await queue.stop()
+
+    return asyncio.run(main())
+
+
+def _payout(db, payout_id):
+    with db.SessionLocal() as session:
+        return session.get(db.Payout, payout_id)
+
+
+def _user(db, tg_id, **fields):
+    with db.SessionLocal() as session:
+        session.add(db.User(telegram_id=tg_id, **fields))
+        session.commit()
+
+
+def _reject_sends(fake_chain, message, times=None):
+    """Make the node answer eth_sendRawTransaction with `message` (the first `times` sends, or all)."""
+    accept = fake_chain._accept
+    left = [times]
+
+    def reject(raw_hex):
+        if left[0] is None or left[0] > 0:
+            if left[0] is not None:
+                left[0] -= 1
+            raise ValueError(message)
+        return accept(raw_hex)
+
+    fake_chain._accept = reject
+
+
+# =========================== Nonces ===========================
+def test_nonce_manager_reuses_released_nonces(fake_chain):
+    from web3_utils import NonceManager
+
+    fake_chain.next_nonce = 5
+    nonces = NonceManager()
+    assert [nonces.allocate() for _ in range(3)] == [5, 6, 7]
+
+    nonces.release(7)          # the newest one: simply handed out again
+    assert nonces.allocate() == 7
+    nonces.release(5)          # a hole: filled before new nonces
+    assert nonces.allocate() == 5
+    assert nonces.allocate() == 8
+
+    nonces.release(6)
+    nonces.advance_to(12)      # held elsewhere: holes below are dropped
+    assert nonces.allocate() == 12
+
+    fake_chain.next_nonce = 20
+    nonces.resync()
+    assert nonces.allocate() == 20
+
+
+# =========================== Payout state machine ===========================
+def test_payout_confirms_and_credits_balance(fresh_db, fake_chain):
+    _user(fresh_db, 1, balance_beam=0)
+    [(pid, address, _)] = queue_rows(fresh_db, [15])
+    bot = FakeBot()
+
+    assert _run_queue(fresh_db, bot, [pid]) == ["confirmed"]
+
+    p = _payout(fresh_db, pid)
+    [tx_hash] = fake_chain.txs
+    assert p.tx_hash == tx_hash and p.nonce == 0 and p.raw_tx is None and p.confirmed_block
+    assert fake_chain.txs[tx_hash]["data"][34:74] == address[2:].lower()
+    with fresh_db.SessionLocal() as session:
+        assert session.query(fresh_db.User.balance_beam).filter_by(telegram_id=1).scalar() == 15
+    assert bot.sent == [(1, f"✅ Sent <b>15 BEAM</b>.\nTX: {tx_hash}")]
+
+
+def test_stale_nonce_is_resynced_and_resigned(fresh_db, fake_chain):
+    _reject_sends(fake_chain, "nonce too low", times=1)
+    [(pid, _, _)] = queue_rows(fresh_db, [5])
+
+    assert _run_queue(fresh_db, FakeBot(), [pid]) == ["confirmed"]
+    [tx_hash] = fake_chain.txs
+    assert _payout(fresh_db, pid).tx_hash == tx_hash
+
+
+def test_rejected_payout_fails_and_gives_referrals_back(fresh_db, fake_chain):
+    from web3_utils import nonces
+
+    _user(fresh_db, 1, referrals_count=0)
+    _reject_sends(fake_chain, "insufficient funds for gas * price + value")
+    [(pid, _, _)] = queue_rows(fresh_db, [5])
+    bot = FakeBot()
+
+    assert _run_queue(fresh_db, bot, [pid]) == ["failed"]
+    assert "insufficient funds" in _payout(fresh_db, pid).error
+    with fresh_db.SessionLocal() as session:
+        assert session.query(fresh_db.User.referrals_count).filter_by(telegram_id=1).scalar() == 3
+    assert bot.sent[0][1].startswith("⚠️ Transfer failed")
+    assert nonces.allocate() == 0   # never reached a node: its nonce is free again
+
+
+def test_reverted_payout_fails(fresh_db, fake_chain):
+    fake_chain.revert_rate = 1.0
+    [(pid, _, _)] = queue_rows(fresh_db, [5])
+
+    assert _run_queue(fresh_db, FakeBot(), [pid]) == ["failed"]
+    assert _payout(fresh_db, pid).error == "Token transfer failed"
+
+
+def test_restart_resumes_sent_and_sending_payouts(fresh_db, fake_chain):
+    import web3_utils
+
+    # signed and recorded before a crash, never broadcast
+    [(sent_id, address, amount)] = queue_rows(fresh_db, [5])
+    tx = web3_utils.sign_payout([(address, amount)])
+    with fresh_db.SessionLocal() as session:
+        session.query(fresh_db.Payout).filter_by(id=sent_id).update(
+            {"status": "sent", "tx_hash": tx.hash, "nonce": tx.nonce, "raw_tx": tx.raw}
+        )
+        session.commit()
+    web3_utils.forget(tx.hash)
+    web3_utils.nonces.resync()
+    [(sending_id, _, _)] = queue_rows(fresh_db, [6], status="sending")
+    [(queued_id, _, _)] = queue_rows(fresh_db, [7])
+
+    ids = [sent_id, sending_id, queued_id]
+    assert _run_queue(fresh_db, FakeBot(), ids) == ["confirmed"] * 3
+
+    resumed = _payout(fresh_db, sent_id)
+    assert resumed.tx_hash == tx.hash and resumed.nonce == tx.nonce == 0
+    # the resumed tx keeps its nonce; the requeued rows go out in one batch above it
+    assert {_payout(fresh_db, i).nonce for i in (sending_id, queued_id)} == {1}
+    assert len(fake_chain.txs) == 2
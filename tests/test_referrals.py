@@ -0,0 +1,80 @@
+# tests/test_referrals.py
+# credit_referral / link_referral: a referee is credited once, also when
+# /start races, and the closure table and per-referrer stats follow the
+# referral tree (existing downlines included, cycles not double counted).
+
+import asyncio
+
+
+def _users(db, *tg_ids):
+    with db.SessionLocal() as session:
+        session.add_all(db.User(telegram_id=i, referrals_count=0) for i in tg_ids)
+        session.commit()
+
+
+def _credit(db, referrer_id, referee_id):
+    with db.SessionLocal() as session:
+        return db.credit_referral(session, referrer_id, referee_id)
+
+
+def _paths(db):
+    with db.SessionLocal() as session:
+        return {(p.ancestor_id, p.descendant_id, p.depth) for p in session.query(db.ReferralPath)}
+
+
+def _stats(db):
+    with db.SessionLocal() as session:
+        return {s.telegram_id: (s.direct, s.downline) for s in session.query(db.ReferrerStats)}
+
+
+def test_referee_is_credited_once(fresh_db):
+    _users(fresh_db, 1, 2, 3)
+
+    assert _credit(fresh_db, 1, 2)
+    assert not _credit(fresh_db, 1, 2)      # same referral again
+    assert not _credit(fresh_db, 3, 2)      # already referred by someone else
+    assert not _credit(fresh_db, 3, 3)      # self-referral
+    assert not _credit(fresh_db, 99, 3)     # unknown referrer
+
+    with fresh_db.SessionLocal() as session:
+        users = {u.telegram_id: (u.referrals_count, u.referred_by) for u in session.query(fresh_db.User)}
+        assert users == {1: (1, None), 2: (0, 1), 3: (0, None)}
+        assert session.query(fresh_db.Referral).count() == 1
+        total = session.query(fresh_db.DailyTotal.value).filter_by(day="all", metric="referrals").scalar()
+        assert total == 1
+
+
+def test_concurrent_credits_count_once(fresh_db):
+    from db import run_db, credit_referral
+
+    _users(fresh_db, 1, 2, 3, 4, 5)
+
+    async def race():
+        return await asyncio.gather(*(run_db(credit_referral, r, 5) for r in (1, 2, 3, 4)))
+
+    assert sum(asyncio.run(race())) == 1
+    with fresh_db.SessionLocal() as session:
+        assert session.query(fresh_db.Referral).count() == 1
+        counts = [c for (c,) in session.query(fresh_db.User.referrals_count).order_by(fresh_db.User.telegram_id)]
+        assert sorted(counts) == [0, 0, 0, 0, 1]
+
+
+def test_paths_follow_the_tree(fresh_db):
+    _users(fresh_db, 1, 2, 3, 4)
+    _credit(fresh_db, 3, 4)     # 3 already has a downline when it joins 2's
+    _credit(fresh_db, 2, 3)
+    _credit(fresh_db, 1, 2)
+
+    assert _paths(fresh_db) == {
+        (3, 4, 1), (2, 3, 1), (2, 4, 2), (1, 2, 1), (1, 3, 2), (1, 4, 3),
+    }
+    assert _stats(fresh_db) == {1: (1, 3), 2: (1, 2), 3: (1, 1)}
+
+
+def test_cycle_is_not_double_counted(fresh_db):
+    _users(fresh_db, 1, 2)
+    _credit(fresh_db, 1, 2)
+    _credit(fresh_db, 2, 1)     # 1 was never referred, so this is allowed
+
+    assert _paths(fresh_db) == {(1, 2, 1), (2, 1, 1)}
+    assert _stats(fresh_db) == {1: (1, 1), 2: (1, 1)}
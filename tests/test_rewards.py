@@ -0,0 +1,68 @@
+# tests/test_rewards.py
+# RewardLedger.claim: a one-time reward is queued at most once per user and
+# once per address, also under concurrent taps, and a failed payout gives
+# the claim back.
+
+import asyncio
+
+from eth_account import Account
+
+
+def _claims(db):
+    with db.SessionLocal() as session:
+        return session.query(db.RewardClaim).count(), session.query(db.Payout).filter_by(status="queued").count()
+
+
+def test_claim_is_once_per_user_and_per_address(fresh_db):
+    from rewards import RewardLedger, CLAIMED, USER_ALREADY_CLAIMED, ADDRESS_ALREADY_CLAIMED
+
+    ledger = RewardLedger("welcome")
+    a, b = Account.create().address, Account.create().address
+
+    async def scenario():
+        first = await ledger.claim(1, 5, a)
+        again = await ledger.claim(1, 5, b)        # same user, other address
+        reused = await ledger.claim(2, 5, a)       # other user, same address
+        return first, again, reused, await ledger.address_taken(a), await ledger.address_taken(b)
+
+    (status, payout_id), again, reused, a_taken, b_taken = asyncio.run(scenario())
+    assert status == CLAIMED and payout_id
+    assert again == (USER_ALREADY_CLAIMED, None)
+    assert reused == (ADDRESS_ALREADY_CLAIMED, None)
+    assert a_taken and not b_taken
+    assert _claims(fresh_db) == (1, 1)
+    with fresh_db.SessionLocal() as session:
+        p = session.get(fresh_db.Payout, payout_id)
+        assert (p.telegram_id, p.kind, p.amount, p.address) == (1, "welcome", 5, a)
+
+
+def test_concurrent_claims_queue_one_payout(fresh_db):
+    from rewards import RewardLedger, CLAIMED
+
+    ledger = RewardLedger("welcome")
+    addr = Account.create().address
+
+    async def scenario():
+        return await asyncio.gather(*(ledger.claim(1, 5, addr) for _ in range(8)))
+
+    results = asyncio.run(scenario())
+    assert sum(status == CLAIMED for status, _ in results) == 1
+    assert _claims(fresh_db) == (1, 1)
+
+
+def test_failed_payout_releases_the_claim(fresh_db):
+    from payouts import _db_fail
+    from rewards import RewardLedger, CLAIMED
+
+    ledger = RewardLedger("welcome")
+    addr = Account.create().address
+
+    async def scenario():
+        _, payout_id = await ledger.claim(1, 5, addr)
+        with fresh_db.SessionLocal() as session:
+            _db_fail(session, [payout_id], "insufficient funds")
+        return await ledger.address_taken(addr), await ledger.claim(1, 5, addr)
+
+    taken, (status, _) = asyncio.run(scenario())
+    assert not taken
+    assert status == CLAIMED
@@ -0,0 +1,88 @@
+# tests/test_single_flight.py
+# SingleFlight: concurrent calls with one key share a single execution, its
+# result is reused for `debounce` seconds, and errors are shared but never
+# cached.
+
+import asyncio
+
+import pytest
+
+
+class Counter:
+    def __init__(self, result=None, error=None, delay=0.05):
+        self.calls = 0
+        self.result, self.error, self.delay = result, error, delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_calls_share_one_run():
+    from bot import SingleFlight
+
+    sf = SingleFlight(debounce=0)
+    fn, other = Counter("ok"), Counter("other")
+
+    async def scenario():
+        return await asyncio.gather(*(sf.run("k", fn) for _ in range(5)), sf.run("j", other))
+
+    assert asyncio.run(scenario()) == ["ok"] * 5 + ["other"]
+    assert (fn.calls, other.calls) == (1, 1)
+
+
+def test_result_is_reused_within_debounce():
+    from bot import SingleFlight
+
+    sf = SingleFlight(debounce=0.1)
+    fn = Counter("ok", delay=0)
+
+    async def scenario():
+        await sf.run("k", fn)
+        await sf.run("k", fn)
+        assert fn.calls == 1
+        await asyncio.sleep(0.15)
+        await sf.run("k", fn)
+
+    asyncio.run(scenario())
+    assert fn.calls == 2
+
+
+def test_errors_are_shared_not_cached():
+    from bot import SingleFlight
+
+    sf = SingleFlight(debounce=10)
+    fn = Counter(error=RuntimeError("rpc down"))
+
+    async def scenario():
+        results = await asyncio.gather(*(sf.run("k", fn) for _ in range(3)), return_exceptions=True)
+        assert fn.calls == 1 and all(isinstance(r, RuntimeError) for r in results)
+        fn.error = None
+        return await sf.run("k", fn)
+
+    assert asyncio.run(scenario()) is None
+    assert fn.calls == 2
+
+
+def test_cancelled_leader_frees_the_key():
+    from bot import SingleFlight
+
+    sf = SingleFlight(debounce=0)
+    fn = Counter("ok", delay=1)
+
+    async def scenario():
+        leader = asyncio.create_task(sf.run("k", fn))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(sf.run("k", fn))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        fn.delay = 0
+        return await sf.run("k", fn)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert fn.calls == 2
@@ -0,0 +1,126 @@
+# user_cache.py
+# Size-bounded LRU of compact user records in front of the users table.
+# Reads hit memory; writes update the cache and are persisted through the
+# DB (directly or via db.write_behind); balance/referral changes made
+# elsewhere invalidate the entry.
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, NamedTuple, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from config import USER_CACHE_SIZE
+from db import run_db, write_behind, bump_daily, User
+
+
+class UserRecord(NamedTuple):
+    telegram_id: int
+    username: str
+    bsc_address: Optional[str]
+    balance_beam: int
+    referrals_count: int
+    referred_by: Optional[int]
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserRecord":
+        return cls(
+            user.telegram_id,
+            user.username or "",
+            user.bsc_address,
+            user.balance_beam or 0,
+            user.referrals_count or 0,
+            user.referred_by,
+        )
+
+
+def ensure_user(session, tg_id: int, username: Optional[str]) -> User:
+    user = session.query(User).filter_by(telegram_id=tg_id).one_or_none()
+    if not user:
+        user = User(telegram_id=tg_id, username=username or "")
+        session.add(user)
+        bump_daily(session, datetime.utcnow(), users=1)
+        try:
+            session.commit()
+        except IntegrityError:
+            # a queued write-behind insert got there first
+            session.rollback()
+            user = session.query(User).filter_by(telegram_id=tg_id).one()
+    return user
+
+
+def _db_load(session, tg_id: int) -> Optional[UserRecord]:
+    user = session.query(User).filter_by(telegram_id=tg_id).one_or_none()
+    return UserRecord.from_user(user) if user else None
+
+
+# write-behind ops (see db.WriteBehind): idempotent, no commit
+def _wb_create_user(session, tg_id: int, username: Optional[str]) -> None:
+    if session.query(User.id).filter_by(telegram_id=tg_id).first() is None:
+        session.add(User(telegram_id=tg_id, username=username or ""))
+        session.flush()
+        bump_daily(session, datetime.utcnow(), users=1)
+
+
+def _wb_set_address(session, tg_id: int, username: Optional[str], addr: str) -> None:
+    _wb_create_user(session, tg_id, username)
+    session.query(User).filter_by(telegram_id=tg_id).update({User.bsc_address: addr}, synchronize_session=False)
+
+
+class UserCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[int, UserRecord]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # webhook mode: forwards invalidations to the worker process that owns the user
+        self.on_invalidate: Optional[Callable[[int], None]] = None
+
+    async def get(self, tg_id: int, username: Optional[str] = None) -> UserRecord:
+        """Cached record for `tg_id`, loading (and creating) the row on a miss."""
+        rec = self._data.get(tg_id)
+        if rec is not None:
+            self.hits += 1
+            self._data.move_to_end(tg_id)
+            return rec
+        self.misses += 1
+        rec = await run_db(_db_load, tg_id)
+        if rec is None:
+            # brand-new user: the INSERT rides along with the next group commit
+            rec = UserRecord(tg_id, username or "", None, 0, 0, None)
+            write_behind.submit(_wb_create_user, tg_id, username)
+        self.put(rec)
+        return rec
+
+    def put(self, rec: UserRecord) -> None:
+        self._data[rec.telegram_id] = rec
+        self._data.move_to_end(rec.telegram_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, tg_id: int) -> None:
+        self._data.pop(tg_id, None)
+        if self.on_invalidate is not None:
+            self.on_invalidate(tg_id)
+
+    async def set_address(self, tg_id: int, username: Optional[str], addr: str) -> UserRecord:
+        """Update the user's BSC address in the cache now and in the DB with the next group commit."""
+        rec = (await self.get(tg_id, username))._replace(bsc_address=addr)
+        self.put(rec)
+        write_behind.submit(_wb_set_address, tg_id, username, addr)
+        return rec
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+user_cache = UserCache(USER_CACHE_SIZE)
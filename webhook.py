@@ -0,0 +1,298 @@
+# webhook.py
+# Webhook mode (BOT_MODE=webhook). A small asyncio HTTP ingress receives
+# Telegram updates and shards them by user id over WEBHOOK_WORKERS processes,
+# each running the full bot from bot.build_application(). A user always
+# lands on the same worker and a worker handles one user's updates in
+# arrival order, so per-user state (user_data, caches, single-flight) stays
+# process-local. Worker 0 also runs the payout queue, polling the DB for
+# payouts queued by the other workers.
+
+import asyncio
+import json
+import logging
+import multiprocessing as mp
+import queue
+import signal
+import time
+from typing import Dict, List
+
+from config import (
+    BOT_TOKEN,
+    BOT_API_BASE_URL,
+    ALLOWED_UPDATES,
+    TG_GLOBAL_RATE,
+    TG_LOOKUP_RATE,
+    PAYOUT_POLL_INTERVAL,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_STATS_INTERVAL,
+    METRICS_PORT,
+)
+
+logger = logging.getLogger("srd_airdrop_bot.webhook")
+
+# worker inbox messages: (kind, payload)
+UPDATE = "update"            # raw JSON body of one update
+INVALIDATE = "invalidate"    # telegram id whose user_cache entry is stale (sent by worker 0)
+STOP = "stop"
+
+# update fields that carry the acting user; the first one present picks the shard
+_SENDER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request",
+)
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 503: "Service Unavailable"}
+
+MAX_BODY = 1 << 20
+
+
+def shard_key(data: dict) -> int:
+    """The update's user id (chat id as a fallback, 0 if neither)."""
+    for field in _SENDER_FIELDS:
+        obj = data.get(field)
+        if not obj:
+            continue
+        user = obj.get("from") or obj.get("user")
+        if user:
+            return int(user["id"])
+        chat = obj.get("chat")
+        if chat:
+            return int(chat["id"])
+    return 0
+
+
+# =========================== Ingress (parent process) ===========================
+class Ingress:
+    def __init__(self, queues: List, processed):
+        self.queues = queues
+        self.processed = processed          # shared per-worker handled counters
+        self.received = [0] * len(queues)
+        self.rejected = 0
+
+    def dispatch(self, body: bytes) -> int:
+        """Route one update to its worker; returns the HTTP status for Telegram."""
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+        shard = shard_key(data) % len(self.queues)
+        try:
+            self.queues[shard].put_nowait((UPDATE, body))
+        except queue.Full:
+            # Telegram retries non-2xx answers, so backpressure loses nothing
+            self.rejected += 1
+            return 503
+        self.received[shard] += 1
+        return 200
+
+    def _route(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> int:
+        if path == WEBHOOK_PATH and method == "POST":
+            if WEBHOOK_SECRET and headers.get("x-telegram-bot-api-secret-token") != WEBHOOK_SECRET:
+                return 403
+            return self.dispatch(body)
+        if path == "/healthz" and method == "GET":
+            return 200
+        return 404
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Minimal HTTP/1.1 with keep-alive: Telegram reuses connections for consecutive updates."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    break
+                body = await reader.readexactly(length)
+
+                status = self._route(method, path.split("?", 1)[0], headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                    f"Content-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def depths(self) -> List[int]:
+        try:
+            return [q.qsize() for q in self.queues]
+        except NotImplementedError:   # macOS
+            return [-1] * len(self.queues)
+
+    async def report(self, interval: float) -> None:
+        last, t = list(self.processed), time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now, counts = time.monotonic(), list(self.processed)
+            rates = [(c - p) / (now - t) for c, p in zip(counts, last)]
+            last, t = counts, now
+            logger.info(
+                "webhook: rejected=%d; %s",
+                self.rejected,
+                "; ".join(
+                    f"w{i} depth={d} recv={r} done={c} {rate:.1f}/s"
+                    for i, (d, r, c, rate) in enumerate(zip(self.depths(), self.received, counts, rates))
+                ),
+            )
+
+
+async def _register_webhook() -> None:
+    from telegram import Bot
+
+    kwargs = {}
+    if BOT_API_BASE_URL:
+        kwargs = {"base_url": f"{BOT_API_BASE_URL}/bot", "base_file_url": f"{BOT_API_BASE_URL}/file/bot"}
+    async with Bot(BOT_TOKEN, **kwargs) as bot:
+        await bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=100,
+        )
+    logger.info("webhook registered: %s", WEBHOOK_URL)
+
+
+async def _serve(ingress: Ingress) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = await asyncio.start_server(ingress.handle, WEBHOOK_LISTEN, WEBHOOK_PORT)
+    logger.info(
+        "webhook ingress on %s:%s%s -> %d worker(s)", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, len(ingress.queues)
+    )
+    if WEBHOOK_URL:
+        await _register_webhook()
+    reporter = asyncio.create_task(ingress.report(WEBHOOK_STATS_INTERVAL))
+    async with server:
+        await stop.wait()
+    reporter.cancel()
+
+
+def run_webhook() -> None:
+    n = max(1, WEBHOOK_WORKERS)
+    # spawn, not fork: workers must not inherit the parent's DB connections
+    ctx = mp.get_context("spawn")
+    queues = [ctx.Queue(WEBHOOK_QUEUE_SIZE) for _ in range(n)]
+    processed = ctx.Array("Q", n, lock=False)   # each worker only writes its own slot
+    procs = [
+        ctx.Process(target=_worker_main, args=(i, n, queues, processed), name=f"bot-worker-{i}")
+        for i in range(n)
+    ]
+    for p in procs:
+        p.start()
+    try:
+        asyncio.run(_serve(Ingress(queues, processed)))
+    finally:
+        logger.info("stopping %d worker(s)", n)
+        for q in queues:
+            try:
+                q.put((STOP, None), timeout=5)
+            except queue.Full:
+                pass
+        for p in procs:
+            p.join(timeout=30)
+            if p.is_alive():
+                p.terminate()
+
+
+# =========================== Workers ===========================
+def _worker_main(index: int, workers: int, queues: List, processed) -> None:
+    # the parent handles Ctrl-C and sends STOP, so shutdown flushes persistence and write-behind
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker(index, workers, queues, processed))
+
+
+async def _worker(index: int, workers: int, queues: List, processed) -> None:
+    from telegram import Update
+    from bot import build_application
+    from user_cache import user_cache
+
+    app = build_application(
+        global_rate=TG_GLOBAL_RATE / workers,
+        lookup_rate=TG_LOOKUP_RATE / workers,
+        run_payouts=index == 0,
+        payout_poll=PAYOUT_POLL_INTERVAL if workers > 1 else None,
+        metrics_port=METRICS_PORT + index if METRICS_PORT else 0,
+    )
+    if workers > 1:
+        # payouts settle on worker 0 and admin commands touch any user, but a
+        # user's cache entry lives on their own worker
+        def _forward(tg_id: int) -> None:
+            shard = tg_id % workers
+            if shard != index:
+                try:
+                    queues[shard].put_nowait((INVALIDATE, tg_id))
+                except queue.Full:
+                    logger.warning("worker %d inbox full; cache invalidation for %s dropped", shard, tg_id)
+
+        user_cache.on_invalidate = _forward
+
+    inbox = queues[index]
+    loop = asyncio.get_running_loop()
+    tails: Dict[int, asyncio.Task] = {}   # user id -> that user's latest update task
+
+    async def _process(prev, update) -> None:
+        if prev is not None:
+            await asyncio.wait([prev])   # ordering only; its errors are its own
+        await app.update_processor.process_update(update, app.process_update(update))
+        processed[index] += 1
+
+    def _dispatch(body: bytes) -> None:
+        try:
+            update = Update.de_json(json.loads(body), app.bot)
+        except Exception as e:
+            logger.warning("worker %d: bad update dropped: %s", index, e)
+            return
+        uid = update.effective_user.id if update.effective_user else 0
+        task = asyncio.create_task(_process(tails.get(uid), update))
+        tails[uid] = task
+        task.add_done_callback(lambda t, uid=uid: tails.get(uid) is t and tails.pop(uid))
+
+    async with app:   # initialize(); shutdown() flushes persistence
+        await app.post_init(app)
+        await app.start()
+        logger.info("worker %d/%d ready", index, workers)
+        running = True
+        while running:
+            messages = [await loop.run_in_executor(None, inbox.get)]
+            try:
+                while len(messages) < 100:
+                    messages.append(inbox.get_nowait())
+            except queue.Empty:
+                pass
+            for kind, payload in messages:
+                if kind == UPDATE:
+                    _dispatch(payload)
+                elif kind == INVALIDATE:
+                    user_cache.invalidate(payload)
+                elif kind == STOP:
+                    running = False
+        if tails:
+            await asyncio.wait(list(tails.values()))
+        await app.stop()
+    await app.post_shutdown(app)